@@ -0,0 +1,385 @@
+# future must be first
+from __future__ import print_function
+
+import datetime
+import getopt
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+# xlrd, see http://www.python-excel.org and https://pypi.python.org/pypi/xlrd
+from xlrd import open_workbook
+
+import pipeline
+import tablestat
+import xlsx_reader
+
+'''
+Benchmarks the profiler on synthetic tables, to catch regressions.
+
+Tables are generated with a given number of rows and columns, a mix of
+column types, a share of empty cells and a number of distinct values
+per column. The default mix and sizes are shaped like the DN_USER_TYPE
+extracts in Data/Regular and Data/Unregular: 16-digit ids, a parent id,
+a description, a mostly empty flag and a tenant id, all text cells.
+
+Each benchmark runs in its own process, so its peak memory is its own.
+Results are appended to a CSV file, one line per benchmark, and the
+speed is compared with the last result for the same benchmark and table.
+'''
+
+# Column types of the type mix, by letter
+column_types = {
+    "d": "Digitstring",
+    "c": "Charstring",
+    "n": "Number",
+    "t": "Date",
+}
+
+# Words for Charstring values
+words = [ u"AFFAIRES", u"SCIENTIFIQUES", u"DR", u"METIERS", u"TRANSVERSES", u"OFFICE",
+          u"Default", u"Principality", u"ASP", u"SERVICES", u"GESTION", u"RESEAU" ]
+
+# Excel serial number of the epoch used for Date columns
+date_base = datetime.datetime(2017, 1, 1)
+date_base_serial = 42736.0
+
+# Header of the results file
+results_head = ("Time,Label,Benchmark,Rows,Columns,Type mix,Empty ratio,Distinct,"
+                "Seconds,Rows per sec,Peak RSS MB")
+
+def get_value(kind, k):
+    '''
+    Returns the k-th distinct value of a column type.
+    '''
+    if kind == "d":
+        return u"%016d" % (7888500000000000 + k)
+    elif kind == "c":
+        return u"%s %s %d" % (words[k % len(words)], words[(k // len(words)) % len(words)], k)
+    elif kind == "n":
+        return k * 1.5
+    elif kind == "t":
+        return date_base + datetime.timedelta(minutes=k)
+    raise Exception("Unknown column type %r" % kind)
+
+def generate_table(rows, columns, type_mix, empty_ratio, distinct, seed):
+    '''
+    Generates a table as a header row and a list of data rows.
+    Column types cycle through the letters of type_mix. Each cell is
+    empty with probability empty_ratio; otherwise it takes one of
+    distinct values at random, or a value unique to its row if distinct
+    is zero. The same arguments always generate the same table.
+    '''
+    for kind in type_mix:
+        if kind not in column_types:
+            raise Exception("Unknown column type %r" % kind)
+    rng = random.Random(seed)
+    kinds = [ type_mix[i % len(type_mix)] for i in xrange(columns) ]
+    header = [ u"%s_%d" % (column_types[kind].upper(), i) for i, kind in enumerate(kinds) ]
+    data = []
+    for rownum in xrange(rows):
+        row = []
+        for kind in kinds:
+            if rng.random() < empty_ratio:
+                row.append(u"")
+            else:
+                row.append(get_value(kind, rng.randrange(distinct) if distinct > 0 else rownum))
+        data.append(row)
+    return header, data
+
+def get_cell_xml(ref, value):
+    '''
+    Returns the XML of an xlsx cell, with text inline and dates as
+    their serial numbers in the date style, so they read back as dates.
+    '''
+    if isinstance(value, datetime.datetime):
+        delta = value - date_base
+        serial = date_base_serial + delta.days + delta.seconds / 86400.0
+        return '<c r="%s" s="1"><v>%r</v></c>' % (ref, serial)
+    if isinstance(value, float):
+        return '<c r="%s"><v>%r</v></c>' % (ref, value)
+    return '<c r="%s" t="inlineStr"><is><t>%s</t></is></c>' % (ref, escape(value).encode("utf-8"))
+
+def write_xlsx(file_name, header, data):
+    '''
+    Writes a table to an xlsx file with a single sheet named Data,
+    as the extracts in Data/ have.
+    '''
+    names = [ xlsx_reader.get_column_name(i) for i in xrange(len(header)) ]
+    parts = []
+    for rownum, row in enumerate([ header ] + data):
+        ref = str(rownum + 1)
+        parts.append('<row r="%s">' % ref)
+        parts.extend(get_cell_xml(names[i] + ref, v) for i, v in enumerate(row) if v != u"")
+        parts.append('</row>')
+    main_ns = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+    rel_ns = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    pkg_rel_ns = "http://schemas.openxmlformats.org/package/2006/relationships"
+    content_types = ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>')
+    rels = ('<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="%s">'
+        '<Relationship Id="rId1" Type="%s/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>' % (pkg_rel_ns, rel_ns))
+    workbook = ('<?xml version="1.0" encoding="UTF-8"?><workbook xmlns="%s" xmlns:r="%s">'
+        '<sheets><sheet name="Data" sheetId="1" r:id="rId1"/></sheets></workbook>' % (main_ns, rel_ns))
+    workbook_rels = ('<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="%s">'
+        '<Relationship Id="rId1" Type="%s/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="%s/styles" Target="styles.xml"/>'
+        '</Relationships>' % (pkg_rel_ns, rel_ns, rel_ns))
+    # cell style 1 shows dates with times, built-in number format 22
+    styles = ('<?xml version="1.0" encoding="UTF-8"?><styleSheet xmlns="%s">'
+        '<cellXfs count="2"><xf numFmtId="0"/><xf numFmtId="22" applyNumberFormat="1"/></cellXfs>'
+        '</styleSheet>' % main_ns)
+    sheet = ('<?xml version="1.0" encoding="UTF-8"?><worksheet xmlns="%s"><sheetData>%s</sheetData></worksheet>'
+        % (main_ns, "".join(parts)))
+    with zipfile.ZipFile(file_name, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", content_types)
+        z.writestr("_rels/.rels", rels)
+        z.writestr("xl/workbook.xml", workbook)
+        z.writestr("xl/_rels/workbook.xml.rels", workbook_rels)
+        z.writestr("xl/worksheets/sheet1.xml", sheet)
+        z.writestr("xl/styles.xml", styles)
+
+def bench_row(table, unique_max, work_dir):
+    '''
+    Times TableStat.analyze_row over the rows of a table.
+    '''
+    header, data = generate_table(**table)
+    start = time.time()
+    ts = tablestat.TableStat(unique_max, header)
+    for row in data:
+        ts.analyze_row(row)
+    return time.time() - start, len(data)
+
+def bench_column(table, unique_max, work_dir):
+    '''
+    Times TableStat.analyze_columns over the columns of a table.
+    '''
+    header, data = generate_table(**table)
+    columns = zip(*data)
+    data = None
+    start = time.time()
+    ts = tablestat.TableStat(unique_max, header)
+    ts.analyze_columns(columns)
+    return time.time() - start, len(columns[0]) if columns else 0
+
+def bench_xlsx_stream(table, unique_max, work_dir):
+    '''
+    Times reading the rows of a table's xlsx file with xlsx_reader.
+    '''
+    file_name = os.path.join(work_dir, "table.xlsx")
+    rows = 0
+    start = time.time()
+    with xlsx_reader.XlsxReader(file_name) as reader:
+        for row in reader.iter_rows(0):
+            rows += 1
+    return time.time() - start, rows - 1
+
+def bench_xlsx_xlrd(table, unique_max, work_dir):
+    '''
+    Times reading the columns of a table's xlsx file with xlrd, as
+    profile_excel does by default.
+    '''
+    file_name = os.path.join(work_dir, "table.xlsx")
+    start = time.time()
+    with open_workbook(file_name, on_demand=True) as wb_obj:
+        s = wb_obj.sheet_by_index(0)
+        for col in range(s.ncols):
+            s.col_values(col, 1)
+        rows = s.nrows
+    return time.time() - start, rows - 1
+
+def bench_pipeline(table, unique_max, work_dir):
+    '''
+    Times pipeline.run_pipeline over copies of a table's xlsx file,
+    one worker process, with no cache or intermediate files.
+    '''
+    input_dir = os.path.join(work_dir, "pipeline")
+    start = time.time()
+    failures = pipeline.run_pipeline([ input_dir ], "1", os.path.join(work_dir, "out.xls"))
+    seconds = time.time() - start
+    if failures > 0:
+        raise Exception("Pipeline failed on %d files" % failures)
+    return seconds, table["rows"] * len(os.listdir(input_dir))
+
+# Benchmarks by name, in the order they run
+benchmarks = [
+    ("row", bench_row),
+    ("column", bench_column),
+    ("xlsx-stream", bench_xlsx_stream),
+    ("xlsx-xlrd", bench_xlsx_xlrd),
+    ("pipeline", bench_pipeline),
+]
+
+def run_benchmark(job):
+    '''
+    Runs one benchmark and sends its seconds, rows and peak RSS in
+    kilobytes to a queue, or the error message. Meant to run in a
+    process of its own.
+    '''
+    (function, table, unique_max, work_dir, queue) = job
+    try:
+        seconds, rows = function(table, unique_max, work_dir)
+        queue.put((seconds, rows, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    except Exception as e:
+        queue.put(str(e))
+
+def prepare_files(table, work_dir, files):
+    '''
+    Writes the xlsx file of a table, and copies for the pipeline.
+    '''
+    file_name = os.path.join(work_dir, "table.xlsx")
+    header, data = generate_table(**table)
+    write_xlsx(file_name, header, data)
+    input_dir = os.path.join(work_dir, "pipeline")
+    os.makedirs(input_dir)
+    for i in xrange(files):
+        shutil.copy(file_name, os.path.join(input_dir, "table%d.xlsx" % i))
+
+def get_last_speed(results_name, key):
+    '''
+    Returns the rows per second of the last result in the results file
+    with the same benchmark and table, or None.
+    '''
+    speed = None
+    if os.path.exists(results_name):
+        with open(results_name) as f:
+            for line in f:
+                fields = line.rstrip("\n").split(",")
+                if len(fields) == 11 and fields[2:8] == key:
+                    speed = float(fields[9])
+    return speed
+
+def run_benchmarks(names, table, unique_max, files, results_name, label):
+    '''
+    Runs the named benchmarks, each in a new process, and appends the
+    results to the results file. Returns the number that failed.
+    '''
+    failures = 0
+    work_dir = tempfile.mkdtemp(prefix="benchmark")
+    try:
+        if set(names) & set([ "xlsx-stream", "xlsx-xlrd", "pipeline" ]):
+            prepare_files(table, work_dir, files)
+        new_file = not os.path.exists(results_name)
+        with open(results_name, "a") as results:
+            if new_file:
+                print(results_head, file=results)
+            for name, function in benchmarks:
+                if name not in names:
+                    continue
+                queue = multiprocessing.Queue()
+                process = multiprocessing.Process(target=run_benchmark,
+                                                  args=((function, table, unique_max, work_dir, queue),))
+                process.start()
+                result = queue.get()
+                process.join()
+                if not isinstance(result, tuple):
+                    print("Error: %s: %s" % (name, result), file=sys.stderr)
+                    failures += 1
+                    continue
+                (seconds, rows, peak_kb) = result
+                speed = rows / seconds if seconds > 0 else 0.0
+                key = [ name, str(rows), str(table["columns"]), table["type_mix"],
+                        "%g" % table["empty_ratio"], str(table["distinct"]) ]
+                last_speed = get_last_speed(results_name, key)
+                print(",".join([ datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), label ] + key
+                               + [ "%.3f" % seconds, "%.0f" % speed, "%.1f" % (peak_kb / 1024.0) ]),
+                      file=results)
+                results.flush()
+                change = ""
+                if last_speed:
+                    change = " (%+.1f%% vs last)" % (100.0 * (speed / last_speed - 1.0))
+                print("%-12s %9d rows %8.3f s %10.0f rows/s %8.1f MB peak%s"
+                      % (name, rows, seconds, speed, peak_kb / 1024.0, change))
+    finally:
+        shutil.rmtree(work_dir)
+    return failures
+
+def usage():
+    '''
+    Prints a usage message and exits.
+    '''
+    print('benchmark.py [options]')
+    print('Options:')
+    print('   -b benchmarks to run, comma separated (default all: %s)'
+          % ",".join(name for name, function in benchmarks))
+    print('   -c column count (default 5)')
+    print('   -d distinct values per column, 0 for unique (default 50)')
+    print('   -e empty cell ratio (default 0.1)')
+    print('   -f file count for the pipeline (default 4)')
+    print('   -l label of this run in the results (default none)')
+    print('   -m type mix, letters d=digitstring c=charstring n=number t=date')
+    print('      (default ddccd)')
+    print('   -o results file (default bench_results.csv)')
+    print('   -r row count (default 100000)')
+    print('   -s random seed (default 0)')
+    print('   -u unique-limit (default 10000)')
+    sys.exit()
+
+def main(args):
+    '''
+    Parses command-line arguments and runs the benchmarks.
+    '''
+    try:
+        opts, args = getopt.getopt(args, "b:c:d:e:f:l:m:o:r:s:u:")
+    except getopt.GetoptError:
+        usage()
+    # default values
+    names = [ name for name, function in benchmarks ]
+    table = dict(rows=100000, columns=5, type_mix="ddccd", empty_ratio=0.1, distinct=50, seed=0)
+    files = 4
+    label = ""
+    results_name = "bench_results.csv"
+    umax = 10000
+    for opt, optarg in opts:
+        if opt in ("-b"):
+            names = optarg.split(",")
+            for name in names:
+                if name not in dict(benchmarks):
+                    usage()
+        elif opt in ("-c"):
+            table["columns"] = int(optarg)
+        elif opt in ("-d"):
+            table["distinct"] = int(optarg)
+        elif opt in ("-e"):
+            table["empty_ratio"] = float(optarg)
+        elif opt in ("-f"):
+            files = int(optarg)
+        elif opt in ("-l"):
+            label = optarg.replace(",", " ")
+        elif opt in ("-m"):
+            table["type_mix"] = optarg
+        elif opt in ("-o"):
+            results_name = optarg
+        elif opt in ("-r"):
+            table["rows"] = int(optarg)
+        elif opt in ("-s"):
+            table["seed"] = int(optarg)
+        elif opt in ("-u"):
+            umax = int(optarg)
+        else:
+            usage()
+    if len(args) > 0:
+        usage()
+    if run_benchmarks(names, table, umax, files, results_name, label) > 0:
+        sys.exit(1)
+
+# Pass all params after program name to our main
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,394 @@
+# future must be first
+from __future__ import print_function
+
+import collections
+import cStringIO
+import csv
+import datetime
+import getopt
+import json
+import math
+import os
+import sys
+import warnings
+
+import numpy as np
+# xlrd, see http://www.python-excel.org and https://pypi.python.org/pypi/xlrd
+from xlrd import open_workbook
+
+import feature_matrix
+import tablestat
+import transform
+
+'''
+Classifies profiles as Regular or Unregular with a Naive Bayes model,
+in place of exporting the merged workbook to RapidMiner. Like RapidMiner's
+Naive Bayes, numeric features are modeled as a normal distribution per
+class, and other features, e.g. data types, as a frequency per value
+with Laplace smoothing.
+
+Training and prediction read feature rows as transform.py produces them:
+the transformed CSV files, the merged workbooks pipeline.py writes, like
+output.xls, or unlabeled ones like FutureData/*FutureProf.xls. Profile
+reports are flattened by transform.py first. Labels are the Profil
+field, 1 for Regular and 2 for Unregular as script.sh asks for them.
+Prediction goes through any number of rows a batch at a time.
+'''
+
+# Field of the label, and fields that are not features
+label_head = "Profil"
+skip_heads = [ "Profil", "sheetname" ]
+# Fields not features, whatever their column number; unique values are
+# the repr of a dict, different in every profile
+skip_prefixes = [ "Unique values" ]
+
+# Names of the labels script.sh asks for
+label_names = { "1": "Regular", "2": "Unregular" }
+
+# Added to the variance of each numeric feature within a class: this
+# share of its variance over all classes, and a floor
+var_smoothing = 1e-2
+min_variance = 1e-9
+
+# Laplace smoothing of the value counts of other features
+alpha = 1.0
+
+# Rows scored at a time
+predict_batch_rows = 1000
+
+def get_label(value):
+    '''
+    Converts a label to text, e.g. 2.0 as xlrd reads numbers to "2".
+    '''
+    if isinstance(value, float) and value.is_integer():
+        return "%d" % value
+    return unicode(value).strip()
+
+def get_number(value):
+    '''
+    Converts a feature value to a number: numbers as they are, dates to
+    seconds since 1970, and None or empty text to NaN. Returns None for
+    other text.
+    '''
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return float(value)
+    if value is None:
+        return np.nan
+    value = value.strip()
+    if value in ("", "None"):
+        return np.nan
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for date_format in feature_matrix.date_formats:
+        try:
+            return (datetime.datetime.strptime(value, date_format) - tablestat.epoch).total_seconds()
+        except ValueError:
+            pass
+    return None
+
+def get_text(value):
+    '''
+    Converts a value of a nominal feature to text, None when missing.
+    '''
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.decode("utf-8", "replace")
+    value = unicode(value).strip()
+    return value if value not in ("", "None") else None
+
+def get_numeric_matrix(heads, rows):
+    '''
+    Returns an array of numeric features, a row per feature row and a
+    column per field in heads, NaN where a row lacks one or it is not
+    a number.
+    '''
+    matrix = np.full((len(rows), len(heads)), np.nan)
+    for r, row in enumerate(rows):
+        for f, head in enumerate(heads):
+            value = get_number(row.get(head))
+            if value is not None:
+                matrix[r, f] = value
+    return matrix
+
+def is_feature(head):
+    '''
+    Tells whether a field of a feature row is a feature.
+    '''
+    return head not in skip_heads and not any(head.startswith(prefix) for prefix in skip_prefixes)
+
+# Inherits only from object
+class NaiveBayes(object):
+    '''
+    A Naive Bayes model of feature rows, trained by train_model or read
+    by load_model.
+
+    Useful attributes:
+        classes (ORDERED list of labels)
+        numeric_heads (ORDERED list of numeric feature fields)
+        nominal_heads (ORDERED list of other feature fields)
+        vocabularies (list of ORDERED lists of the values of each nominal
+            feature seen in training)
+        class_log_prior (array of the log share of each class)
+        means, variances (arrays of a row per class and a column per
+            numeric feature)
+        log_probs (array of a row per class and a column per value of
+            each nominal feature in turn, then one for values not seen)
+        offsets (array of the first column of each nominal feature in
+            log_probs, and the end of the last)
+    '''
+
+    def __init__(self, meta, arrays):
+        '''
+        Constructor accepts a dict of the lists and a dict of the arrays
+        of a model, as saved.
+        '''
+        self.classes = meta["classes"]
+        self.numeric_heads = meta["numeric_heads"]
+        self.nominal_heads = meta["nominal_heads"]
+        self.vocabularies = meta["vocabularies"]
+        self.indexes = [ dict((value, i) for i, value in enumerate(vocabulary)) for vocabulary in self.vocabularies ]
+        self.class_log_prior = arrays["class_log_prior"]
+        self.means = arrays["means"]
+        self.variances = arrays["variances"]
+        self.log_probs = arrays["log_probs"]
+        self.offsets = arrays["offsets"]
+
+    def save(self, file_name):
+        '''
+        Writes the model to a NumPy .npz file, the lists as JSON text.
+        '''
+        meta = dict(classes=self.classes, numeric_heads=self.numeric_heads, nominal_heads=self.nominal_heads,
+                    vocabularies=self.vocabularies)
+        with open(file_name, "wb") as out_file:
+            np.savez(out_file, meta=np.array(json.dumps(meta)), class_log_prior=self.class_log_prior,
+                     means=self.means, variances=self.variances, log_probs=self.log_probs, offsets=self.offsets)
+
+    def predict_batch(self, rows):
+        '''
+        Scores a list of feature rows, dicts of fields to values.
+        Returns the ORDERED list of the likeliest label of each row, and
+        an array of the probability of each class, a row per row.
+        '''
+        joint = np.tile(self.class_log_prior, (len(rows), 1))
+        if len(self.numeric_heads) > 0:
+            x = get_numeric_matrix(self.numeric_heads, rows)[:, np.newaxis, :]
+            log_likelihood = -0.5 * (np.log(2 * math.pi * self.variances) + (x - self.means) ** 2 / self.variances)
+            # missing features leave the odds as they are
+            joint += np.nansum(log_likelihood, axis=2)
+        for f, head in enumerate(self.nominal_heads):
+            unseen = len(self.vocabularies[f])
+            for r, row in enumerate(rows):
+                value = get_text(row.get(head))
+                if value is not None:
+                    joint[r] += self.log_probs[:, self.offsets[f] + self.indexes[f].get(value, unseen)]
+        joint -= joint.max(axis=1)[:, np.newaxis]
+        probabilities = np.exp(joint)
+        probabilities /= probabilities.sum(axis=1)[:, np.newaxis]
+        return [ self.classes[c] for c in probabilities.argmax(axis=1) ], probabilities
+
+    def predict(self, rows):
+        '''
+        Scores feature rows from any iterable, predict_batch_rows at a
+        time, so memory does not grow with the count of rows.
+        Generates a (row, label, probability of the label) tuple for each.
+        '''
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == predict_batch_rows:
+                for result in self.predict_results(batch):
+                    yield result
+                batch = []
+        if len(batch) > 0:
+            for result in self.predict_results(batch):
+                yield result
+
+    def predict_results(self, batch):
+        '''
+        Scores a batch of rows for predict.
+        '''
+        labels, probabilities = self.predict_batch(batch)
+        for row, label, p in zip(batch, labels, probabilities.max(axis=1)):
+            yield (row, label, float(p))
+
+def train_model(rows):
+    '''
+    Trains a NaiveBayes model on labeled feature rows, dicts of fields to
+    values with the label in label_head. A feature is numeric if all its
+    values are numbers, dates or missing, else nominal.
+    '''
+    rows = [ row for row in rows if get_text(row.get(label_head)) is not None ]
+    if len(rows) == 0:
+        raise Exception("No labeled feature rows to train on")
+    labels = [ get_label(row[label_head]) for row in rows ]
+    classes = sorted(set(labels))
+    heads = []
+    numeric = {}
+    for row in rows:
+        for head, value in row.iteritems():
+            if not is_feature(head):
+                continue
+            if head not in numeric:
+                heads.append(head)
+                numeric[head] = True
+            if numeric[head] and get_number(value) is None:
+                numeric[head] = False
+    numeric_heads = [ head for head in heads if numeric[head] ]
+    nominal_heads = [ head for head in heads if not numeric[head] ]
+    y = np.array([ classes.index(label) for label in labels ])
+    counts = np.bincount(y, minlength=len(classes)).astype(np.float64)
+    arrays = dict(class_log_prior=np.log(counts / counts.sum()))
+    # numeric features: a normal distribution per class
+    x = get_numeric_matrix(numeric_heads, rows)
+    with warnings.catch_warnings():
+        # features no row has a number for are left at 0
+        warnings.simplefilter("ignore", RuntimeWarning)
+        overall_mean = np.nan_to_num(np.nanmean(x, axis=0))
+        overall_var = np.nan_to_num(np.nanvar(x, axis=0))
+    means = np.empty((len(classes), len(numeric_heads)))
+    variances = np.empty((len(classes), len(numeric_heads)))
+    for c in xrange(len(classes)):
+        xc = x[y == c]
+        seen = (~np.isnan(xc)).sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means[c] = np.where(seen > 0, np.nansum(xc, axis=0) / seen, overall_mean)
+            variances[c] = np.where(seen > 0, np.nansum((xc - means[c]) ** 2, axis=0) / seen, overall_var)
+    arrays["means"] = means
+    arrays["variances"] = variances + var_smoothing * overall_var + min_variance
+    # other features: a frequency per value and class
+    vocabularies = []
+    columns = []
+    for head in nominal_heads:
+        values = [ get_text(row.get(head)) for row in rows ]
+        vocabulary = sorted(set(v for v in values if v is not None))
+        index = dict((v, i) for i, v in enumerate(vocabulary))
+        value_counts = np.zeros((len(classes), len(vocabulary) + 1))
+        for c, v in zip(y, values):
+            if v is not None:
+                value_counts[c, index[v]] += 1
+        smoothed = value_counts + alpha
+        columns.append(np.log(smoothed / smoothed.sum(axis=1)[:, np.newaxis]))
+        vocabularies.append(vocabulary)
+    arrays["log_probs"] = (np.concatenate(columns, axis=1) if len(columns) > 0
+                           else np.zeros((len(classes), 0)))
+    arrays["offsets"] = np.cumsum([ 0 ] + [ len(v) + 1 for v in vocabularies ])
+    meta = dict(classes=classes, numeric_heads=numeric_heads, nominal_heads=nominal_heads,
+                vocabularies=vocabularies)
+    return NaiveBayes(meta, arrays)
+
+def load_model(file_name):
+    '''
+    Reads a model saved by NaiveBayes.save.
+    '''
+    with np.load(file_name) as data:
+        arrays = dict((name, data[name]) for name in data.files)
+    return NaiveBayes(json.loads(unicode(arrays.pop("meta"))), arrays)
+
+def read_feature_rows(file_name):
+    '''
+    Generates the feature rows of a file as ORDERED dicts of fields to
+    values, fields stripped of the spaces transform.py leaves. Reads
+    merged workbooks, a header row atop each sheet, and CSV files of a
+    header line then feature rows, or profile reports, flattened by
+    transform.py first. Each row also gets a "sheetname", if it has none,
+    naming it after its file.
+    '''
+    base_name = os.path.splitext(os.path.basename(file_name))[0]
+    if os.path.splitext(file_name)[1].lower() in (".xls", ".xlsx"):
+        with open_workbook(file_name, on_demand=True) as wb_obj:
+            for sheet_name in wb_obj.sheet_names():
+                s = wb_obj.sheet_by_name(sheet_name)
+                if s.nrows > 0:
+                    heads = [ unicode(h).strip() for h in s.row_values(0) ]
+                    for rownum in xrange(1, s.nrows):
+                        yield get_feature_row(heads, s.row_values(rownum), "%s %d" % (base_name, rownum))
+                wb_obj.unload_sheet(sheet_name)
+        return
+    with open(file_name, "r") as in_file:
+        reader = csv.reader(in_file)
+        heads = [ h.strip() for h in next(reader, []) ]
+        if label_head not in heads and "Sheet name" in heads:
+            # a profile report, flattened as pipeline.py does
+            in_file.seek(0)
+            lines = transform.transform(csv.reader(in_file), "")
+            reader = csv.reader(cStringIO.StringIO("".join(line + "\n" for line in lines)))
+            heads = [ h.strip() for h in next(reader) ]
+        for rownum, values in enumerate(reader, 1):
+            if len(values) > 0:
+                yield get_feature_row(heads, values, base_name if rownum == 1 else "%s %d" % (base_name, rownum))
+
+def get_feature_row(heads, values, name):
+    '''
+    Pairs the fields of a feature row with its values.
+    '''
+    row = collections.OrderedDict(zip(heads, values))
+    if "sheetname" not in row:
+        row["sheetname"] = name
+    return row
+
+def find_feature_files(paths):
+    '''
+    Expands directories to the files of feature rows or reports they
+    contain, workbooks or CSV, in name order.
+    '''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, n) for n in sorted(os.listdir(path))
+                         if os.path.splitext(n)[1].lower() in (".xls", ".xlsx", ".csv"))
+        else:
+            files.append(path)
+    return files
+
+def read_all_rows(paths):
+    '''
+    Generates the feature rows of files, and of the files in directories.
+    '''
+    for file_name in find_feature_files(paths):
+        for row in read_feature_rows(file_name):
+            yield row
+
+def usage():
+    '''
+    Prints a usage message and exits.
+    '''
+    print('classifier.py [options] rows.xls | rows.csv | report.csv | directory ...')
+    print('Options:')
+    print('   -m model file to label the feature rows with')
+    print('   -t model file to train on the labeled feature rows')
+    sys.exit()
+
+def main(args):
+    '''
+    Parses command-line arguments, and trains a model or labels rows.
+    '''
+    try:
+        opts, args = getopt.getopt(args, "m:t:")
+    except getopt.GetoptError:
+        usage()
+    # default values
+    model_name = None
+    train_name = None
+    for opt, optarg in opts:
+        if opt in ("-m"):
+            model_name = optarg
+        elif opt in ("-t"):
+            train_name = optarg
+        else:
+            usage()
+    if len(args) == 0 or (model_name is None) == (train_name is None):
+        usage()
+    if train_name is not None:
+        train_model(read_all_rows(args)).save(train_name)
+        return
+    model = load_model(model_name)
+    print("Name,Label,Class,Probability")
+    for row, label, p in model.predict(read_all_rows(args)):
+        print("%s,%s,%s,%f" % (row["sheetname"], label, label_names.get(label, label), p))
+
+# Pass all params after program name to our main
+if __name__ == "__main__":
+    main(sys.argv[1:])
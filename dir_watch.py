@@ -0,0 +1,172 @@
+'''
+Watches a directory for files that are added, changed or removed.
+
+On Linux the kernel tells of each change through inotify, called
+through ctypes as the standard library has no binding; elsewhere, or
+when inotify can't be set up, the directory is scanned every
+poll_seconds and compared with the scan before. Either way a watch is
+waited on for the names of the files that changed.
+'''
+
+# future must be first
+from __future__ import print_function
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+# Seconds between scans when polling
+poll_seconds = 0.2
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+watch_mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# wd, mask, cookie and length of the name that follows
+event_header = struct.Struct("iIII")
+
+# Bytes read from inotify at a time, room for many events
+read_bytes = 65536
+
+def load_libc():
+    '''
+    Returns the C library if it has inotify, else None.
+    '''
+    name = ctypes.util.find_library("c")
+    if name is None:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, "inotify_init") or not hasattr(libc, "inotify_add_watch"):
+        return None
+    return libc
+
+# Inherits only from object
+class InotifyWatch(object):
+    '''
+    Watches a directory through inotify.
+
+    Useful attributes:
+        dir_name (directory watched)
+    '''
+
+    def __init__(self, dir_name, libc):
+        self.dir_name = dir_name
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        if libc.inotify_add_watch(self.fd, dir_name, watch_mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, "inotify_add_watch failed for %s" % dir_name)
+
+    def wait(self, timeout):
+        '''
+        Waits up to timeout seconds for changes.
+        Returns the set of names of the files changed, empty if none, or
+        None if the kernel dropped events and the directory has to be
+        scanned again.
+        '''
+        try:
+            readable = select.select([ self.fd ], [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return set()
+            raise
+        if len(readable) == 0:
+            return set()
+        # the kernel returns whole events only
+        data = os.read(self.fd, read_bytes)
+        names = set()
+        offset = 0
+        while offset + event_header.size <= len(data):
+            wd, mask, cookie, length = event_header.unpack_from(data, offset)
+            offset += event_header.size
+            name = data[offset:offset + length].rstrip("\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                raise Exception("Directory %s is no longer watched" % self.dir_name)
+            if name:
+                names.add(name)
+        return names
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+# Inherits only from object
+class PollWatch(object):
+    '''
+    Watches a directory by scanning it, a change being a file added,
+    removed or of another size or modified time.
+
+    Useful attributes:
+        dir_name (directory watched)
+        states (dict of file names to (size, modified time) at the last scan)
+    '''
+
+    def __init__(self, dir_name, interval=poll_seconds):
+        if not os.path.isdir(dir_name):
+            raise OSError(errno.ENOENT, "Directory %s not found" % dir_name)
+        self.dir_name = dir_name
+        self.interval = interval
+        self.states = self.scan()
+
+    def scan(self):
+        '''
+        Returns the size and modified time of each file in the directory.
+        '''
+        states = {}
+        for name in os.listdir(self.dir_name):
+            try:
+                stat = os.stat(os.path.join(self.dir_name, name))
+            except OSError:
+                # removed since listed
+                continue
+            states[name] = (stat.st_size, stat.st_mtime)
+        return states
+
+    def wait(self, timeout):
+        '''
+        Waits up to timeout seconds, or until the next scan if sooner.
+        Returns the set of names of the files changed, empty if none.
+        '''
+        time.sleep(max(0.0, min(timeout, self.interval)))
+        states = self.scan()
+        names = set(name for name, state in states.items() if self.states.get(name) != state)
+        names.update(name for name in self.states if name not in states)
+        self.states = states
+        return names
+
+    def close(self):
+        pass
+
+def open_watch(dir_name):
+    '''
+    Returns a watch of a directory, through inotify where it can be set
+    up, else by polling.
+    '''
+    libc = load_libc()
+    if libc is not None:
+        try:
+            return InotifyWatch(dir_name, libc)
+        except OSError:
+            # out of watches, or a file system inotify can't watch
+            pass
+    return PollWatch(dir_name)
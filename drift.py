@@ -0,0 +1,420 @@
+# future must be first
+from __future__ import print_function
+
+import ast
+import collections
+import csv
+import datetime
+import getopt
+import itertools
+import os
+import sys
+import warnings
+
+import numpy as np
+
+import feature_matrix
+
+'''
+Scores profiles for drift against a baseline set of profiles, column by
+column, as was done by hand in spreadsheets after xlsTransform.py. For
+example, profile the files of Data/Regular as the baseline, then score
+each new file: how far its density moved from the baseline mean, whether
+its datatype is one the baseline never had, how far its numbers or dates
+reach past the baseline range, and how far its frequencies of unique
+values diverge from the pooled baseline frequencies, as the population
+stability index (PSI) and the Kullback-Leibler divergence (KL).
+
+Profiles are the records of reports, tabular or JSON Lines, as read by
+feature_matrix.read_report_records; a TableStat gives the same records
+through profile_output.get_sheet_records. Columns are matched by sheet
+index and name, or by column index where the name is missing or
+repeated, as in feature_matrix.py. Each score is computed for all
+profiles at once, as arrays of a row per profile and a column per
+column of the baseline, so thousands of profiles score in seconds.
+'''
+
+# Proportions below this are raised to it, so PSI and KL stay finite
+# for values one side never had
+min_proportion = 1e-4
+
+# Default limits past which a column has drifted
+density_limit = 0.1
+range_limit = 0.5
+psi_limit = 0.25
+
+# Fields of a score, as the report heads name them
+score_heads = [ "Profile", "Sheet index", "Column name", "Data type", "Baseline data type", "Type changed",
+                "Density", "Baseline density", "Density shift", "Range shift", "PSI", "KL", "Drift" ]
+
+# Fields of a profile summary
+summary_heads = [ "Profile", "Columns", "Drifted columns", "Types changed", "Max density shift", "Max PSI",
+                  "Drift share" ]
+
+def get_category(value):
+    '''
+    Converts a unique value of a report to text, the same whether read
+    from a tabular or a JSON Lines report or taken from a TableStat.
+    '''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, str):
+        return value.decode("utf-8", "replace")
+    return unicode(value)
+
+def get_unique_counts(value):
+    '''
+    Reads the unique values of a report record: a list of (value, count)
+    pairs, or the repr of a dict in tabular reports. Returns a dict of
+    values as text to counts, or None past the unique limit, or where
+    the repr can't be read back, as for dates.
+    '''
+    if value is None:
+        return None
+    if isinstance(value, basestring):
+        if not value.startswith("{"):
+            return None
+        try:
+            value = ast.literal_eval(value).items()
+        except (ValueError, SyntaxError):
+            return None
+    counts = {}
+    for key, count in value:
+        category = get_category(key)
+        counts[category] = counts.get(category, 0) + int(count)
+    return counts
+
+def get_profile_columns(records):
+    '''
+    Returns an ORDERED dict of column keys to the records of a profile,
+    keyed as by feature_matrix.get_column_keys.
+    '''
+    return collections.OrderedDict(itertools.izip(feature_matrix.get_column_keys(records), records))
+
+def get_field_matrix(keys, profiles, fields):
+    '''
+    Returns an array of a numeric field, a row per profile and a column
+    per key, NaN where a profile lacks the column. The first of the
+    fields the record has a number for is taken, e.g. the least number,
+    else the least date.
+    '''
+    index = dict((key, i) for i, key in enumerate(keys))
+    matrix = np.full((len(profiles), len(keys)), np.nan)
+    for r, columns in enumerate(profiles):
+        for key, record in columns.iteritems():
+            i = index.get(key)
+            if i is None:
+                continue
+            for field in fields:
+                value = feature_matrix.get_feature_value(field, record.get(field))
+                if not np.isnan(value):
+                    matrix[r, i] = value
+                    break
+    return matrix
+
+def get_divergences(expected, counts, starts):
+    '''
+    Returns the PSI and KL divergence of each row of counts from the
+    expected proportions, NaN for rows without counts. The columns of
+    counts and expected are the categories of many keys side by side,
+    each key's starting at its offset in starts; the results have a
+    column per key.
+    '''
+    totals = np.add.reduceat(counts, starts, axis=1)
+    # the key of each category
+    keys = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, counts.shape[1])))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        actual = np.maximum(counts / totals[:, keys], min_proportion)
+        psi = np.add.reduceat((actual - expected) * np.log(actual / expected), starts, axis=1)
+        kl = np.add.reduceat(actual * np.log(actual / expected), starts, axis=1)
+    psi[totals == 0] = np.nan
+    kl[totals == 0] = np.nan
+    return psi, kl
+
+def to_value(x):
+    '''
+    Converts a score from numpy to a plain value, None for NaN.
+    '''
+    x = float(x)
+    return None if np.isnan(x) else x
+
+# Inherits only from object
+class DriftBaseline(object):
+    '''
+    Summarizes a set of baseline profiles per column, and scores other
+    profiles against it.
+
+    Useful attributes:
+        keys (ORDERED list of column keys, "sheet:column")
+        index (dict of keys to their index)
+        names (list of (sheet index, column name) tuples per key)
+        profile_count (count of baseline profiles)
+        density_mean, density_std (arrays of the density of each key)
+        range_low, range_high (arrays of the least and greatest number,
+            or else date as seconds since 1970, NaN where neither)
+        datatypes (list of sets of datatype names per key)
+        categories (list per key of dicts of values as text to their
+            index in expected, or None where no profile had them)
+        expected (list per key of arrays of the proportion of each value
+            over all baseline profiles, the last for all other values)
+        offsets (array of where the categories of each key start among
+            those of all keys, and where the last key's end)
+        codes (dict of (key index, value as text) to the index of the
+            value among the categories of all keys)
+    '''
+
+    def __init__(self, profiles):
+        '''
+        Constructor accepts a list of profiles, each a list of records.
+        '''
+        profiles = [ get_profile_columns(records) for records in profiles ]
+        if len(profiles) == 0:
+            raise Exception("A baseline needs at least one profile")
+        self.profile_count = len(profiles)
+        self.keys = []
+        self.names = []
+        self.index = {}
+        index = self.index
+        for columns in profiles:
+            for key, record in columns.iteritems():
+                if key not in index:
+                    index[key] = len(self.keys)
+                    self.keys.append(key)
+                    self.names.append((record.get("sheet_index", 0), record["column_name"]))
+        density = get_field_matrix(self.keys, profiles, [ "density" ])
+        low = get_field_matrix(self.keys, profiles, [ "min_number", "min_date" ])
+        high = get_field_matrix(self.keys, profiles, [ "max_number", "max_date" ])
+        with warnings.catch_warnings():
+            # keys with no numbers or dates in any profile are left NaN
+            warnings.simplefilter("ignore", RuntimeWarning)
+            self.density_mean = np.nanmean(density, axis=0)
+            self.density_std = np.nanstd(density, axis=0)
+            self.range_low = np.nanmin(low, axis=0)
+            self.range_high = np.nanmax(high, axis=0)
+        self.datatypes = [ set() for key in self.keys ]
+        pooled = [ None ] * len(self.keys)
+        for columns in profiles:
+            for key, record in columns.iteritems():
+                i = index[key]
+                self.datatypes[i].add(record.get("data_type"))
+                counts = get_unique_counts(record.get("unique_values"))
+                if counts is None:
+                    continue
+                if pooled[i] is None:
+                    pooled[i] = {}
+                for category, count in counts.iteritems():
+                    pooled[i][category] = pooled[i].get(category, 0) + count
+        self.categories = []
+        self.expected = []
+        for counts in pooled:
+            if counts is None or sum(counts.values()) == 0:
+                self.categories.append(None)
+                self.expected.append(None)
+                continue
+            categories = sorted(counts)
+            self.categories.append(dict((c, i) for i, c in enumerate(categories)))
+            expected = np.array([ counts[c] for c in categories ] + [ 0 ], dtype=np.float64)
+            self.expected.append(np.maximum(expected / expected.sum(), min_proportion))
+        # the categories of all keys side by side, so the counts of all
+        # profiles fit one matrix
+        self.offsets = np.zeros(len(self.keys) + 1, dtype=np.int64)
+        self.codes = {}
+        for i, categories in enumerate(self.categories):
+            width = 0
+            if categories is not None:
+                width = len(categories) + 1
+                for category, c in categories.iteritems():
+                    self.codes[(i, category)] = self.offsets[i] + c
+            self.offsets[i + 1] = self.offsets[i] + width
+
+    def get_category_counts(self, profiles):
+        '''
+        Returns an array of the counts of the unique values of profiles,
+        each an ORDERED dict of column keys to records, with a row per
+        profile and a column per category of all keys, as in offsets.
+        Values the baseline never had count as the last category of
+        their key.
+        '''
+        rows = []
+        codes = []
+        counts = []
+        for r, columns in enumerate(profiles):
+            for key, record in columns.iteritems():
+                i = self.index.get(key)
+                if i is None or self.categories[i] is None:
+                    continue
+                unique = get_unique_counts(record.get("unique_values"))
+                if unique is None:
+                    continue
+                other = self.offsets[i + 1] - 1
+                rows.extend([ r ] * len(unique))
+                codes.extend(self.codes.get((i, category), other) for category in unique)
+                counts.extend(unique.itervalues())
+        width = int(self.offsets[-1])
+        cells = np.array(rows, dtype=np.int64) * width + np.array(codes, dtype=np.int64)
+        matrix = np.bincount(cells, weights=np.array(counts, dtype=np.float64), minlength=len(profiles) * width)
+        return matrix.reshape(len(profiles), width)
+
+    def score(self, names, profiles, limits=None):
+        '''
+        Scores profiles, each a list of records, against the baseline.
+        Names are the profile names, and limits an optional dict of the
+        density, range and psi limits past which a column has drifted.
+        Returns an ORDERED list with an ORDERED list of scores for each
+        profile, ORDERED dicts with a field for each of score_heads, for
+        each column of the baseline and then each column only the profile
+        has. Columns missing from either side have drifted.
+        '''
+        if limits is None:
+            limits = dict(density=density_limit, range=range_limit, psi=psi_limit)
+        profiles = [ get_profile_columns(records) for records in profiles ]
+        count = len(self.keys)
+        density = get_field_matrix(self.keys, profiles, [ "density" ])
+        low = get_field_matrix(self.keys, profiles, [ "min_number", "min_date" ])
+        high = get_field_matrix(self.keys, profiles, [ "max_number", "max_date" ])
+        shift = density - self.density_mean
+        # range shift is how far past the baseline range a profile reaches,
+        # in baseline ranges, or in its magnitude for a single value
+        width = self.range_high - self.range_low
+        with np.errstate(invalid="ignore"):
+            width = np.where(width > 0, width, np.maximum(np.abs(self.range_high), 1.0))
+            reach = np.maximum(self.range_low - low, 0) + np.maximum(high - self.range_high, 0)
+        range_shift = reach / width
+        psi = np.full((len(profiles), count), np.nan)
+        kl = np.full((len(profiles), count), np.nan)
+        # the keys with categories, all scored at once
+        keyed = np.flatnonzero(np.diff(self.offsets) > 0)
+        if len(keyed) > 0:
+            expected = np.concatenate([ self.expected[i] for i in keyed ])
+            psi[:, keyed], kl[:, keyed] = get_divergences(expected, self.get_category_counts(profiles),
+                                                          self.offsets[keyed])
+        with np.errstate(invalid="ignore"):
+            drift = ((np.abs(shift) > limits["density"]) | (range_shift > limits["range"])
+                     | (psi > limits["psi"]) | np.isnan(density))
+        results = []
+        for r, (name, columns) in enumerate(itertools.izip(names, profiles)):
+            scores = []
+            for i, key in enumerate(self.keys):
+                record = columns.get(key)
+                data_type = record.get("data_type") if record is not None else None
+                changed = data_type not in self.datatypes[i] if record is not None else None
+                scores.append(collections.OrderedDict([
+                    ("Profile", name), ("Sheet index", self.names[i][0]), ("Column name", self.names[i][1]),
+                    ("Data type", data_type), ("Baseline data type", "/".join(sorted(self.datatypes[i]))),
+                    ("Type changed", changed), ("Density", to_value(density[r, i])),
+                    ("Baseline density", to_value(self.density_mean[i])),
+                    ("Density shift", to_value(shift[r, i])), ("Range shift", to_value(range_shift[r, i])),
+                    ("PSI", to_value(psi[r, i])), ("KL", to_value(kl[r, i])),
+                    ("Drift", bool(drift[r, i]) or bool(changed)) ]))
+            for key, record in columns.iteritems():
+                if key in self.index:
+                    continue
+                density_value = feature_matrix.get_feature_value("density", record.get("density"))
+                scores.append(collections.OrderedDict([
+                    ("Profile", name), ("Sheet index", record.get("sheet_index", 0)),
+                    ("Column name", record["column_name"]), ("Data type", record.get("data_type")),
+                    ("Baseline data type", None), ("Type changed", None), ("Density", to_value(density_value)),
+                    ("Baseline density", None), ("Density shift", None), ("Range shift", None),
+                    ("PSI", None), ("KL", None), ("Drift", True) ]))
+            results.append(scores)
+        return results
+
+def summarize_scores(scores):
+    '''
+    Sums up the scores of a profile, as returned by DriftBaseline.score:
+    its columns, those drifted and those whose type changed, the largest
+    density shift either way and the largest PSI. Returns an ORDERED dict
+    with a field for each of summary_heads.
+    '''
+    summary = collections.OrderedDict((head, 0) for head in summary_heads)
+    summary["Profile"] = scores[0]["Profile"] if len(scores) > 0 else None
+    summary["Max density shift"] = None
+    summary["Max PSI"] = None
+    for score in scores:
+        summary["Columns"] += 1
+        summary["Drifted columns"] += score["Drift"]
+        summary["Types changed"] += score["Type changed"] is True
+        if score["Density shift"] is not None:
+            summary["Max density shift"] = max(summary["Max density shift"], abs(score["Density shift"]))
+        if score["PSI"] is not None:
+            summary["Max PSI"] = max(summary["Max PSI"], score["PSI"])
+    if summary["Columns"] > 0:
+        summary["Drift share"] = summary["Drifted columns"] / float(summary["Columns"])
+    return summary
+
+def read_profiles(paths):
+    '''
+    Reads the records of report files, or of the reports in directories.
+    Returns the ORDERED lists of profile names, after the files, and of
+    profiles, each a list of records.
+    '''
+    names = []
+    profiles = []
+    for file_name in feature_matrix.find_report_files(paths):
+        with open(file_name, "r") as in_file:
+            profiles.append(feature_matrix.read_report_records(in_file))
+        names.append(os.path.splitext(os.path.basename(file_name))[0])
+    return names, profiles
+
+def print_rows(heads, rows):
+    '''
+    Prints dicts as CSV lines to stdout, after a line of heads.
+    '''
+    writer = csv.writer(sys.stdout)
+    writer.writerow(heads)
+    for row in rows:
+        writer.writerow([ get_category(row[head]).encode("utf-8") if row[head] is not None else None
+                          for head in heads ])
+
+def usage():
+    '''
+    Prints a usage message and exits.
+    '''
+    print('drift.py [options] -b baseline ... report.csv | report.jsonl | directory ...')
+    print('Options:')
+    print('   -b baseline report or directory of reports, may be repeated (required)')
+    print('   -d density shift past which a column has drifted (default %g)' % density_limit)
+    print('   -p PSI past which a column has drifted (default %g)' % psi_limit)
+    print('   -r range shift, in baseline ranges, past which a column has drifted (default %g)' % range_limit)
+    print('   -s summary, one line per profile (default one line per column)')
+    sys.exit()
+
+def main(args):
+    '''
+    Parses command-line arguments and scores the reports named against
+    the baseline reports.
+    '''
+    try:
+        opts, args = getopt.getopt(args, "b:d:p:r:s")
+    except getopt.GetoptError:
+        usage()
+    # default values
+    baseline_paths = []
+    limits = dict(density=density_limit, range=range_limit, psi=psi_limit)
+    summary = False
+    for opt, optarg in opts:
+        if opt in ("-b"):
+            baseline_paths.append(optarg)
+        elif opt in ("-d"):
+            limits["density"] = float(optarg)
+        elif opt in ("-p"):
+            limits["psi"] = float(optarg)
+        elif opt in ("-r"):
+            limits["range"] = float(optarg)
+        elif opt in ("-s"):
+            summary = True
+        else:
+            usage()
+    if len(baseline_paths) == 0 or len(args) == 0:
+        usage()
+    baseline = DriftBaseline(read_profiles(baseline_paths)[1])
+    names, profiles = read_profiles(args)
+    results = baseline.score(names, profiles, limits)
+    if summary:
+        print_rows(summary_heads, [ summarize_scores(scores) for scores in results ])
+    else:
+        print_rows(score_heads, [ score for scores in results for score in scores ])
+
+# Pass all params after program name to our main
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,294 @@
+# future must be first
+from __future__ import print_function
+
+import collections
+import csv
+import datetime
+import getopt
+import itertools
+import json
+import os
+import struct
+import sys
+import tempfile
+
+import numpy as np
+
+import tablestat
+
+'''
+Builds one feature matrix from many profile reports, a row per report,
+instead of flattening each report on its own as transform.py does.
+A feature is a statistic of a named column of a sheet, so a column
+missing from a report is left NaN and a column in a new place still
+lands under its own features, where transform.py shifted everything
+after it. The layout of features is saved with the matrix, and can be
+given back to later runs so their matrices line up with this one.
+'''
+
+# Report fields kept as features, all as numbers
+feature_fields = [ "data_type", "empty_count", "nonempty_count", "density", "max_length", "min_length",
+                   "max_number", "min_number", "max_date", "min_date", "unique_count", "distinct_estimate",
+                   "mean", "variance", "skew", "p1", "p25", "p50", "p75", "p99" ]
+
+# Field names of the tabular report heads
+report_heads = { "Sheet name": "sheet_name", "Sheet index": "sheet_index", "Column name": "column_name",
+                 "Column index": "column_index", "Data type": "data_type", "Empty count": "empty_count",
+                 "Nonempty count": "nonempty_count", "Density": "density", "Max length str": "max_length",
+                 "Min length str": "min_length", "Max number": "max_number", "Min number": "min_number",
+                 "Max date": "max_date", "Min date": "min_date", "Unique count": "unique_count",
+                 "Unique values": "unique_values", "Distinct estimate": "distinct_estimate",
+                 "Distinct error": "distinct_error", "Top values": "top_values", "Mean": "mean",
+                 "Variance": "variance", "Skew": "skew", "P1": "p1", "P25": "p25", "P50": "p50",
+                 "P75": "p75", "P99": "p99", "Rows analyzed": "rows_analyzed", "Estimated": "estimated" }
+
+# Formats of dates in reports: str() of datetime, and ISO 8601
+date_formats = [ "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S",
+                 "%Y-%m-%d" ]
+
+def read_report_records(lines):
+    '''
+    Reads the records of a tabular report or a JSON Lines report, from
+    an iterable of lines. Returns a list of dicts with the field names
+    of ColumnStat.get_report_record, values left as read. Records of
+    pairs of columns, in JSON Lines reports, are skipped.
+    '''
+    lines = iter(lines)
+    first = next(lines, "")
+    while first.strip() == "":
+        first = next(lines, None)
+        if first is None:
+            return []
+    if first.lstrip().startswith("{"):
+        records = [ json.loads(line) for line in itertools.chain([ first ], lines) if line.strip() ]
+        return [ record for record in records if "pair_kind" not in record ]
+    reader = csv.reader(itertools.chain([ first ], lines))
+    heads = next(reader)
+    if "Column name" not in heads:
+        raise Exception("Not a tabular or JSON Lines report")
+    names = [ report_heads.get(head, head) for head in heads ]
+    return [ dict(zip(names, row)) for row in reader if len(row) > 0 ]
+
+def get_feature_value(field, value):
+    '''
+    Converts a report value to a number: datatypes to their code, dates
+    to seconds since 1970, and None, "None" or a count past the unique
+    limit, like "> 20", to NaN.
+    '''
+    if value is None or isinstance(value, bool):
+        return np.nan
+    if isinstance(value, (int, long, float)):
+        return float(value)
+    if field == "data_type":
+        if value == tablestat.get_datatype_name(tablestat.datatype_unknown):
+            return float(tablestat.datatype_unknown)
+        return float(tablestat.get_datatype_from_name(value))
+    if isinstance(value, basestring):
+        if value in ("", "None"):
+            return np.nan
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        for date_format in date_formats:
+            try:
+                return (datetime.datetime.strptime(value, date_format) - tablestat.epoch).total_seconds()
+            except ValueError:
+                pass
+    return np.nan
+
+def get_column_keys(records):
+    '''
+    Names the column of each record by sheet index and column name. A
+    column without a name, as in reports made with no header row, or
+    with the name of an earlier column of its sheet, is named by sheet
+    index and "#" and its column index instead, so no two columns of a
+    report share a key. Returns a list of keys in the order of records.
+    '''
+    keys = []
+    seen = set()
+    for record in records:
+        sheet = record.get("sheet_index", 0)
+        name = record.get("column_name")
+        key = "%s:%s" % (sheet, name)
+        if name is None or (isinstance(name, basestring) and name.strip() in ("", "None")) or key in seen:
+            key = "%s:#%s" % (sheet, record.get("column_index"))
+        seen.add(key)
+        keys.append(key)
+    return keys
+
+# Inherits only from object
+class FeatureMatrix(object):
+    '''
+    Streams profiles into an aligned feature matrix.
+
+    Each profile becomes a row, held in a temporary spool file until
+    save, so memory does not grow with the number of rows. The layout,
+    an ORDERED list of feature names, grows as new columns are seen,
+    unless frozen, when features not in it are dropped and counted.
+
+    Useful attributes:
+        layout (ORDERED list of feature names, "sheet:column:field", the
+            column named as by get_column_keys)
+        frozen (boolean)
+        rows (ORDERED list of row names)
+        labels (ORDERED list of row labels)
+        dropped (count of values dropped by a frozen layout)
+    '''
+
+    def __init__(self, layout=None, frozen=False):
+        '''
+        Constructor accepts the layout of an earlier matrix to start from.
+        '''
+        self.layout = list(layout) if layout is not None else []
+        self.index = dict((name, i) for i, name in enumerate(self.layout))
+        self.frozen = frozen
+        self.rows = []
+        self.labels = []
+        self.dropped = 0
+        # rows as counts, then feature indexes and values
+        self.spool = tempfile.TemporaryFile()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.spool.close()
+
+    def get_feature_index(self, name):
+        '''
+        Returns the index of a feature, adding it to the layout unless
+        frozen, or None.
+        '''
+        i = self.index.get(name)
+        if i is None and not self.frozen:
+            i = len(self.layout)
+            self.layout.append(name)
+            self.index[name] = i
+        return i
+
+    def add_profile(self, row_name, label, records):
+        '''
+        Adds the records of a report as a row.
+        '''
+        indexes = []
+        values = []
+        for key, record in itertools.izip(get_column_keys(records), records):
+            prefix = key + ":"
+            for field in feature_fields:
+                if field not in record:
+                    continue
+                i = self.get_feature_index(prefix + field)
+                if i is None:
+                    self.dropped += 1
+                    continue
+                indexes.append(i)
+                values.append(get_feature_value(field, record[field]))
+        self.spool.write(struct.pack("<I", len(indexes)))
+        self.spool.write(np.array(indexes, dtype="<i4").tobytes())
+        self.spool.write(np.array(values, dtype="<f8").tobytes())
+        self.rows.append(row_name)
+        self.labels.append(label)
+
+    def save(self, out_name):
+        '''
+        Writes the matrix to a .npy file of float64, a row per profile in
+        the order added and a column per feature of the layout, NaN where
+        a profile lacks a feature. The layout, row names and labels go
+        to a .json file of the same name.
+        '''
+        matrix = np.lib.format.open_memmap(out_name, mode="w+", dtype=np.float64,
+                                           shape=(len(self.rows), len(self.layout)))
+        self.spool.seek(0)
+        for r in xrange(len(self.rows)):
+            (count,) = struct.unpack("<I", self.spool.read(4))
+            indexes = np.frombuffer(self.spool.read(count * 4), dtype="<i4")
+            values = np.frombuffer(self.spool.read(count * 8), dtype="<f8")
+            matrix[r, :] = np.nan
+            matrix[r, indexes] = values
+        matrix.flush()
+        del matrix
+        self.spool.seek(0, os.SEEK_END)
+        info = collections.OrderedDict([ ("layout", self.layout), ("rows", self.rows), ("labels", self.labels) ])
+        with open(get_info_name(out_name), "w") as info_file:
+            json.dump(info, info_file, indent=1)
+
+def get_info_name(out_name):
+    '''
+    Names the .json file of a matrix after its .npy file.
+    '''
+    return os.path.splitext(out_name)[0] + ".json"
+
+def load_feature_matrix(file_name):
+    '''
+    Loads a matrix saved by FeatureMatrix.save, memory-mapped.
+    Returns the matrix and a dict of its layout, rows and labels.
+    '''
+    with open(get_info_name(file_name), "r") as info_file:
+        info = json.load(info_file)
+    return np.load(file_name, mmap_mode="r"), info
+
+def find_report_files(paths):
+    '''
+    Expands directories to the report files they contain, tabular CSV
+    or JSON Lines, in name order.
+    '''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, n) for n in sorted(os.listdir(path))
+                         if os.path.splitext(n)[1].lower() in (".csv", ".jsonl"))
+        else:
+            files.append(path)
+    return files
+
+def usage():
+    '''
+    Prints a usage message and exits.
+    '''
+    print('feature_matrix.py [options] report.csv | report.jsonl | directory ...')
+    print('Options:')
+    print('   -l layout of an earlier matrix, its .json file, to keep (default none)')
+    print('   -o output matrix (default features.npy)')
+    print('   -p profile label of the reports, 1-2 for regular-unregular (default 1)')
+    sys.exit()
+
+def main(args):
+    '''
+    Parses command-line arguments and builds the matrix.
+    '''
+    try:
+        opts, args = getopt.getopt(args, "l:o:p:")
+    except getopt.GetoptError:
+        usage()
+    # default values
+    layout = None
+    out_name = "features.npy"
+    prof = "1"
+    for opt, optarg in opts:
+        if opt in ("-l"):
+            with open(optarg, "r") as info_file:
+                layout = json.load(info_file)["layout"]
+        elif opt in ("-o"):
+            out_name = optarg
+        elif opt in ("-p"):
+            prof = optarg
+        else:
+            usage()
+    if len(args) == 0:
+        usage()
+    with FeatureMatrix(layout, frozen=layout is not None) as fm:
+        for file_name in find_report_files(args):
+            with open(file_name, "r") as in_file:
+                fm.add_profile(os.path.splitext(os.path.basename(file_name))[0], prof,
+                               read_report_records(in_file))
+        fm.save(out_name)
+        if fm.dropped > 0:
+            print("Dropped %d values of features not in the layout" % fm.dropped, file=sys.stderr)
+
+# Pass all params after program name to our main
+if __name__ == "__main__":
+    main(sys.argv[1:])
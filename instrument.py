@@ -0,0 +1,217 @@
+'''
+Opt-in instrumentation of profiling runs.
+
+An Instrument is handed to profile_excel, which then reports the time
+spent in each stage of the run, reading, converting rows, analyzing
+and reporting, the rows per second and peak memory of each sheet, and
+the columns that took the most analysis time. The summary is a dict,
+written as JSON. Without an Instrument none of this costs anything.
+
+The stages are timed by switching from one to the next, so they add up
+to the run time. Reading also counts opening the workbook and loading
+sheets; streamed xlsx dates are converted as they are read.
+
+The peak memory of a process never goes down, so on Linux it is reset
+at the start of each sheet. Elsewhere a sheet gets the increase of the
+peak while it ran instead, which is zero for a sheet smaller than one
+before it.
+'''
+
+# future must be first
+from __future__ import print_function
+import collections
+import cProfile
+import json
+import timeit
+
+# resource is only found on Unix; without it peak memory is unknown
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Stages of a run, in order
+stages = [ "read", "convert", "analyze", "report" ]
+
+# Rows analyzed one at a time are timed per column one in this many,
+# as timing every value would slow the run it measures
+column_sample_rows = 16
+
+# Columns listed as hot spots
+hot_column_count = 10
+
+# Linux resets the peak resident memory of a process when "5" is written
+# to clear_refs, and shows the peak as VmHWM in status
+clear_refs_name = "/proc/self/clear_refs"
+status_name = "/proc/self/status"
+
+def get_peak_memory():
+    '''
+    Returns the peak resident memory of this process in kilobytes, since
+    the last reset_peak_memory, or None where that is unknown.
+    '''
+    try:
+        with open(status_name, "r") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def reset_peak_memory():
+    '''
+    Resets the peak resident memory of this process to the memory now
+    resident. Returns False where that can't be done.
+    '''
+    try:
+        with open(clear_refs_name, "w") as clear_refs:
+            clear_refs.write("5")
+    except IOError:
+        return False
+    return True
+
+# Inherits only from object
+class Instrument(object):
+    '''
+    Collects stage timings, row counts and column hot spots of a run.
+
+    Useful attributes:
+        seconds (dict of stage names to seconds spent)
+        rows (count of rows analyzed)
+        sheets (ORDERED list of dicts, one per sheet)
+        peak_memory (peak resident memory in kilobytes before the last
+            sheet reset it, or None)
+        column_times (list of seconds per column of the current sheet,
+            to pass to TableStat)
+    '''
+
+    def __init__(self):
+        self.start = timeit.default_timer()
+        self.seconds = dict((stage, 0.0) for stage in stages)
+        self.stage = None
+        self.stage_start = None
+        self.rows = 0
+        self.sheets = []
+        self.sheet = None
+        self.sheet_start = None
+        self.sheet_rows = 0
+        self.sheet_reset = False
+        self.sheet_memory = None
+        self.peak_memory = None
+        self.column_times = []
+
+    def switch(self, stage):
+        '''
+        Ends the current stage and starts another, or none.
+        '''
+        now = timeit.default_timer()
+        if self.stage is not None:
+            self.seconds[self.stage] += now - self.stage_start
+        self.stage = stage
+        self.stage_start = now
+
+    def begin_sheet(self, file_name, sheet_name):
+        '''
+        Starts timing a sheet, which begins with reading it.
+        '''
+        self.switch("read")
+        self.sheet = collections.OrderedDict([ ("file_name", file_name), ("sheet_name", sheet_name) ])
+        self.sheet_start = timeit.default_timer()
+        self.sheet_rows = 0
+        self.column_times = []
+        # the peak so far is kept for the run, None sorting first
+        self.peak_memory = max(self.peak_memory, get_peak_memory())
+        self.sheet_reset = reset_peak_memory()
+        self.sheet_memory = get_peak_memory()
+
+    def add_rows(self, count):
+        '''
+        Counts rows analyzed.
+        '''
+        self.rows += count
+        self.sheet_rows += count
+
+    def sample_row(self, rownum):
+        '''
+        Returns column_times for the rows analyzed one at a time that
+        are timed per column, else None.
+        '''
+        if rownum % column_sample_rows == 0:
+            return self.column_times
+        return None
+
+    def end_sheet(self, ts):
+        '''
+        Ends timing a sheet, with the TableStat that profiled it.
+        '''
+        seconds = timeit.default_timer() - self.sheet_start
+        self.sheet["rows"] = self.sheet_rows
+        self.sheet["seconds"] = seconds
+        self.sheet["rows_per_second"] = self.sheet_rows / seconds if seconds > 0 else None
+        peak = get_peak_memory()
+        if self.sheet_reset:
+            self.sheet["peak_memory_kb"] = peak
+        elif peak is not None:
+            self.sheet["peak_memory_increase_kb"] = peak - self.sheet_memory
+        else:
+            self.sheet["peak_memory_increase_kb"] = None
+        total = sum(self.column_times)
+        columns = []
+        for i, column_seconds in enumerate(self.column_times):
+            name = ts.stats[i].name if ts is not None and i < len(ts.stats) else None
+            columns.append(collections.OrderedDict([ ("column_name", name), ("column_index", i),
+                                                     ("timed_seconds", column_seconds),
+                                                     ("share", column_seconds / total if total > 0 else None) ]))
+        self.sheet["columns"] = columns
+        self.sheets.append(self.sheet)
+        self.sheet = None
+
+    def get_summary(self):
+        '''
+        Returns the summary of the run so far as an ORDERED dict.
+        Hot columns are the columns of all sheets that took the largest
+        share of their sheet's analysis time.
+        '''
+        self.switch(self.stage)
+        seconds = timeit.default_timer() - self.start
+        hot = []
+        for sheet in self.sheets:
+            for column in sheet["columns"]:
+                if column["share"] is not None:
+                    hot.append((column["share"], sheet["file_name"], sheet["sheet_name"], column))
+        hot.sort(key=lambda h: h[0], reverse=True)
+        summary = collections.OrderedDict()
+        summary["seconds"] = seconds
+        summary["stages"] = collections.OrderedDict((stage, self.seconds[stage]) for stage in stages)
+        summary["rows"] = self.rows
+        summary["rows_per_second"] = self.rows / seconds if seconds > 0 else None
+        summary["peak_memory_kb"] = max(self.peak_memory, get_peak_memory())
+        summary["sheets"] = [ collections.OrderedDict((k, v) for k, v in sheet.items() if k != "columns")
+                              for sheet in self.sheets ]
+        summary["hot_columns"] = [ collections.OrderedDict([ ("file_name", file_name), ("sheet_name", sheet_name) ]
+                                                           + column.items())
+                                   for share, file_name, sheet_name, column in hot[:hot_column_count] ]
+        return summary
+
+    def write_summary(self, file_name):
+        '''
+        Writes the summary to a JSON file.
+        '''
+        with open(file_name, "w") as out_file:
+            json.dump(self.get_summary(), out_file, indent=1)
+
+def run_profiled(dump_name, func, *args, **kwargs):
+    '''
+    Runs a function under cProfile and dumps the statistics to a file,
+    for pstats or other viewers. Returns what the function returns.
+    '''
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(dump_name)
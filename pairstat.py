@@ -0,0 +1,588 @@
+'''
+Statistics of pairs of columns, gathered by TableStat in the same pass
+as the statistics of each column.
+
+Reports the correlations of numeric columns, the columns whose empty
+cells fall on the same rows, the patterns of empty columns in rows,
+candidate keys, and functional dependencies between columns of few
+values: one column determines another when each of its values goes
+with a single value of the other. A dependency is approximate when it
+fails on a small share of rows, the share that would have to be
+removed for it to hold.
+
+Wide sheets have many pairs, so the cost is bounded. Correlations and
+shared empty counts are matrices of sums over at most pair_max_columns
+columns, updated a batch of rows at a time with matrix products, and
+dependencies are counted in fixed tables of codes of at most
+dependency_max_columns columns of few values. Every column also gets
+two signatures, hashes of where its empty cells are and of all its
+values, so columns with the same empty cells or the same values are
+found by comparing one number per column however wide the sheet, and a
+HyperLogLog of its values, to find candidate keys.
+
+A PairStat can merge with that of the rows that follow, e.g. from row
+ranges of a sheet profiled in separate processes.
+'''
+
+# future must be first
+from __future__ import print_function
+import collections
+import itertools
+import operator
+
+import numpy as np
+
+import sketches
+
+# Columns whose correlations are kept, the first found to hold numbers,
+# and columns whose shared empty counts are kept, the first of the sheet
+pair_max_columns = 64
+
+# Columns of few values tested for dependencies, and the most values
+# each may have; a column found to have more is no longer tested
+dependency_max_columns = 32
+dependency_max_values = 32
+
+# Patterns of empty columns counted; rows of patterns past this many
+# are only counted together
+pattern_max_count = 1000
+
+# Rows analyzed at a time, which bounds the size of the matrices of a
+# batch; rows given one at a time are held until there are this many
+pair_batch_rows = 10000
+
+# Reported: correlations at least this strong, columns whose empty
+# cells are at least this alike, and dependencies failing on at most
+# this share of rows
+correlation_min = 0.5
+empty_match_min = 0.9
+dependency_error_max = 0.01
+
+# Most results of each kind reported
+report_max_count = 20
+
+# Multiplier of the polynomial hashes of signatures, modulo 2^64
+signature_base = 0x100000001b3
+
+# Labels of the kinds of results in the tall report
+kind_labels = collections.OrderedDict([ ("correlation", "Correlation   "), ("same_empties", "Same empties  "),
+                                        ("shared_empties", "Shared empties"), ("same_values", "Same values   "),
+                                        ("empty_pattern", "Empty pattern "), ("candidate_key", "Candidate key "),
+                                        ("composite_key", "Composite key "), ("dependency", "Dependency    ") ])
+
+# Element-wise builtins for object arrays; these loop in C, not Python.
+get_types = np.frompyfunc(type, 1, 1)
+get_lengths = np.frompyfunc(len, 1, 1)
+get_isspace = np.frompyfunc(operator.methodcaller("isspace"), 1, 1)
+get_item = np.frompyfunc(dict.__getitem__, 2, 1)
+
+def get_kind(t):
+    '''
+    Translates a value's type to 0 for an empty value, 1 for a string,
+    2 for a number or 3 for anything else.
+    '''
+    if t is type(None):                       return 0
+    elif issubclass(t, basestring):           return 1
+    elif issubclass(t, (int, long, float)):   return 2
+    else:                                     return 3
+
+def split_values(data):
+    '''
+    Sorts the values of an object array. Returns a boolean array of the
+    empty values, None and strings empty or all whitespace as ColumnStat
+    counts them, and the numbers as floats, NaN for other values and
+    for numbers that are not finite.
+    '''
+    types = get_types(data)
+    kinds = dict((t, get_kind(t)) for t in set(types))
+    if len(kinds) == 1:
+        # one type of value, as most columns have
+        codes = np.full(len(data), kinds.values()[0], dtype=np.int8)
+    else:
+        codes = get_item(kinds, types).astype(np.int8)
+    empty = codes == 0
+    rows = codes == 1
+    if rows.any():
+        strings = data[rows]
+        empty[rows] = (get_lengths(strings).astype(np.int64) == 0) | get_isspace(strings).astype(bool)
+    numbers = np.full(len(data), np.nan)
+    rows = codes == 2
+    if rows.any():
+        numbers[rows] = data[rows].astype(np.float64)
+        numbers[~np.isfinite(numbers)] = np.nan
+    return empty, numbers
+
+def get_powers(count):
+    '''
+    Returns the powers of signature_base from count - 1 down to 0, as
+    uint64 wrapping modulo 2^64, to hash count rows in order.
+    '''
+    powers = np.ones(count, dtype=np.uint64)
+    if count > 1:
+        powers[:-1] = np.cumprod(np.full(count - 1, signature_base, dtype=np.uint64))[::-1]
+    return powers
+
+def get_shift(count):
+    '''
+    Returns signature_base to the power count modulo 2^64, which shifts
+    a signature past count more rows.
+    '''
+    return np.uint64(pow(signature_base, count, 1 << 64))
+
+def get_groups(signatures, columns):
+    '''
+    Returns the groups of two or more of the columns with the same
+    signature, as ORDERED lists, in order of their first column.
+    '''
+    groups = collections.OrderedDict()
+    for i in columns:
+        groups.setdefault(int(signatures[i]), []).append(i)
+    return [ group for group in groups.values() if len(group) > 1 ]
+
+# Inherits only from object
+class PairStat(object):
+    '''
+    Gathers statistics of pairs of columns of a table.
+
+    Useful attributes:
+        width (count of columns)
+        row_count (integer)
+        empty_counts (array of the count of empty values of each column)
+        empty_signatures, value_signatures (uint64 arrays, a hash for
+            each column of where its values are not empty, and of its
+            values)
+        distinct (list of HyperLogLog sketches of each column's values)
+        numeric (ORDERED list of the columns whose correlations are kept)
+        patterns (dict of hashes of patterns of empty columns to lists
+            of the count of rows and the tuple of the empty columns)
+        other_patterns (count of rows of patterns not kept)
+        dependent (ORDERED list of the columns tested for dependencies,
+            or None until the first batch picks them)
+        codes (dict of those columns to dicts of value hashes to codes)
+        tables (dict of (column, column) pairs to the counts of the
+            pairs of their codes, dependency_max_values squared)
+    '''
+
+    def __init__(self, width=0):
+        self.width = 0
+        self.row_count = 0
+        self.empty_counts = np.zeros(0, dtype=np.int64)
+        self.empty_signatures = np.zeros(0, dtype=np.uint64)
+        self.value_signatures = np.zeros(0, dtype=np.uint64)
+        self.distinct = []
+        # Shared empty counts of the first pair_max_columns columns
+        self.shared_empties = np.zeros((pair_max_columns, pair_max_columns))
+        # Over the rows where both columns have numbers: the count, and
+        # the sums of the first column's numbers less its shift, of their
+        # squares, and of their products with the second column's
+        self.numeric = []
+        self.shifts = []
+        self.sums = np.zeros((4, pair_max_columns, pair_max_columns))
+        self.patterns = {}
+        self.other_patterns = 0
+        self.dependent = None
+        self.codes = {}
+        self.tables = {}
+        self.widen(width)
+
+    def widen(self, width):
+        '''
+        Adds columns up to width, empty in the rows seen so far.
+        '''
+        added = width - self.width
+        if added <= 0:
+            return
+        old = self.width
+        top = min(width, pair_max_columns)
+        if top > old:
+            # rows seen were empty in the new columns
+            self.shared_empties[old:top, :old] = self.empty_counts[:old]
+            self.shared_empties[:old, old:top] = self.empty_counts[:old, np.newaxis]
+            self.shared_empties[old:top, old:top] = self.row_count
+        self.empty_counts = np.concatenate([ self.empty_counts, np.full(added, self.row_count, dtype=np.int64) ])
+        # empty values add nothing to signatures
+        self.empty_signatures = np.concatenate([ self.empty_signatures, np.zeros(added, dtype=np.uint64) ])
+        self.value_signatures = np.concatenate([ self.value_signatures, np.zeros(added, dtype=np.uint64) ])
+        self.distinct.extend(sketches.HyperLogLog() for i in xrange(added))
+        self.width = width
+
+    def analyze_rows(self, rows):
+        '''
+        Analyzes a batch of rows, each an ORDERED list of values, as
+        TableStat.analyze_row takes them.
+        '''
+        if len(rows) == 0:
+            return
+        width = max(len(row) for row in rows)
+        self.analyze_columns([ [ row[i] if i < len(row) else None for row in rows ] for i in xrange(width) ])
+
+    def analyze_columns(self, column_lists):
+        '''
+        Analyzes a batch of rows given column by column, as
+        TableStat.analyze_columns takes them. Short columns, and columns
+        missing from the batch, are empty in the rows they lack.
+        '''
+        if len(column_lists) == 0:
+            return
+        count = max(len(c) for c in column_lists)
+        self.widen(len(column_lists))
+        for start in xrange(0, count, pair_batch_rows):
+            end = min(count, start + pair_batch_rows)
+            data = []
+            for i in xrange(self.width):
+                values = np.empty(end - start, dtype=object)
+                if i < len(column_lists):
+                    part = column_lists[i][start:end]
+                    values[:len(part)] = part
+                data.append(values)
+            self.analyze_batch(data)
+
+    def analyze_batch(self, data):
+        '''
+        Analyzes a batch of rows as a list of an object array per column.
+        '''
+        count = len(data[0])
+        empties = np.empty((count, self.width), dtype=bool)
+        numbers = []
+        hashes = []
+        for i, values in enumerate(data):
+            empty, floats = split_values(values)
+            empties[:, i] = empty
+            numbers.append(floats)
+            h = sketches.mix64_array(values)
+            h[empty] = 0
+            hashes.append(h)
+            if not empty.all():
+                self.distinct[i].add_hashes(h[~empty])
+        self.empty_counts += empties.sum(axis=0)
+        # signatures hash the rows in order, so they go on across batches
+        powers = get_powers(count)
+        shift = get_shift(count)
+        self.empty_signatures = self.empty_signatures * shift + np.dot(powers, (~empties).astype(np.uint64))
+        self.value_signatures = (self.value_signatures * shift
+                                 + np.array([ np.sum(h * powers, dtype=np.uint64) for h in hashes ], dtype=np.uint64))
+        top = min(self.width, pair_max_columns)
+        e = empties[:, :top].astype(np.float64)
+        self.shared_empties[:top, :top] += np.dot(e.T, e)
+        self.analyze_patterns(empties)
+        self.analyze_numbers(numbers)
+        self.analyze_dependencies(hashes)
+        self.row_count += count
+
+    def analyze_patterns(self, empties):
+        '''
+        Counts the rows of each pattern of empty columns.
+        '''
+        weights = np.array([ sketches.mix64(i + 1) for i in xrange(self.width) ], dtype=np.uint64)
+        row_hashes = (empties * weights).sum(axis=1, dtype=np.uint64)
+        uniques, first, counts = np.unique(row_hashes, return_index=True, return_counts=True)
+        for h, rownum, count in itertools.izip(uniques.tolist(), first.tolist(), counts.tolist()):
+            pattern = self.patterns.get(h)
+            if pattern is not None:
+                pattern[0] += count
+            elif len(self.patterns) < pattern_max_count:
+                self.patterns[h] = [ count, tuple(np.flatnonzero(empties[rownum]).tolist()) ]
+            else:
+                self.other_patterns += count
+
+    def analyze_numbers(self, numbers):
+        '''
+        Adds the numbers of a batch to the sums of the numeric columns,
+        taking on columns holding numbers for the first time while there
+        is room. The first number of a column is its shift, subtracted
+        from the others so that large numbers lose no precision.
+        '''
+        slots = dict((c, k) for k, c in enumerate(self.numeric))
+        for i, floats in enumerate(numbers):
+            if i not in slots and len(self.numeric) < pair_max_columns:
+                found = np.flatnonzero(~np.isnan(floats))
+                if len(found) > 0:
+                    slots[i] = len(self.numeric)
+                    self.numeric.append(i)
+                    self.shifts.append(float(floats[found[0]]))
+        m = len(self.numeric)
+        if m == 0:
+            return
+        x = np.column_stack([ numbers[c] - shift for c, shift in itertools.izip(self.numeric, self.shifts) ])
+        found = ~np.isnan(x)
+        x[~found] = 0.0
+        found = found.astype(np.float64)
+        self.sums[0, :m, :m] += np.dot(found.T, found)
+        self.sums[1, :m, :m] += np.dot(x.T, found)
+        self.sums[2, :m, :m] += np.dot((x * x).T, found)
+        self.sums[3, :m, :m] += np.dot(x.T, x)
+
+    def analyze_dependencies(self, hashes):
+        '''
+        Counts the pairs of values of the columns tested for dependencies.
+        The first batch picks the columns with the fewest values, up to
+        dependency_max_values each; empty is a value like any other.
+        '''
+        size = dependency_max_values
+        if self.dependent is None:
+            counts = [ (len(np.unique(h)), i) for i, h in enumerate(hashes) ]
+            self.dependent = sorted(i for count, i in sorted(counts)[:dependency_max_columns] if count <= size)
+            self.codes = dict((i, {}) for i in self.dependent)
+        codes = {}
+        for i in list(self.dependent):
+            uniques, inverse = np.unique(hashes[i], return_inverse=True)
+            known = self.codes[i]
+            for h in uniques.tolist():
+                if h not in known:
+                    known[h] = len(known)
+            if len(known) > size:
+                self.drop_dependent(i)
+                continue
+            codes[i] = np.array([ known[h] for h in uniques.tolist() ], dtype=np.int64)[inverse]
+        for a, b in itertools.combinations(self.dependent, 2):
+            table = self.tables.get((a, b))
+            if table is None:
+                table = self.tables[(a, b)] = np.zeros(size * size, dtype=np.int64)
+            table += np.bincount(codes[a] * size + codes[b], minlength=size * size)
+
+    def drop_dependent(self, i):
+        '''
+        Stops testing a column for dependencies.
+        '''
+        self.dependent.remove(i)
+        del self.codes[i]
+        for pair in [ pair for pair in self.tables if i in pair ]:
+            del self.tables[pair]
+
+    def merge(self, other):
+        '''
+        Combines the statistics of another PairStat into this one, as if
+        this one had also analyzed the other's rows after its own. The
+        narrower of the two is widened to match. Returns self.
+        '''
+        self.widen(other.width)
+        other.widen(self.width)
+        shift = get_shift(other.row_count)
+        self.empty_signatures = self.empty_signatures * shift + other.empty_signatures
+        self.value_signatures = self.value_signatures * shift + other.value_signatures
+        self.empty_counts += other.empty_counts
+        for mine, theirs in itertools.izip(self.distinct, other.distinct):
+            mine.merge(theirs)
+        self.shared_empties += other.shared_empties
+        self.merge_numbers(other)
+        for h, (count, columns) in other.patterns.items():
+            pattern = self.patterns.get(h)
+            if pattern is not None:
+                pattern[0] += count
+            elif len(self.patterns) < pattern_max_count:
+                self.patterns[h] = [ count, columns ]
+            else:
+                self.other_patterns += count
+        self.other_patterns += other.other_patterns
+        self.merge_dependencies(other)
+        self.row_count += other.row_count
+        return self
+
+    def merge_numbers(self, other):
+        '''
+        Adds the sums of another PairStat's numeric columns to these,
+        moved to the shifts of this one.
+        '''
+        slots = dict((c, k) for k, c in enumerate(self.numeric))
+        for c, shift in itertools.izip(other.numeric, other.shifts):
+            if c not in slots and len(self.numeric) < pair_max_columns:
+                slots[c] = len(self.numeric)
+                self.numeric.append(c)
+                self.shifts.append(shift)
+        kept = np.array([ k for k, c in enumerate(other.numeric) if c in slots ], dtype=np.intp)
+        if len(kept) == 0:
+            return
+        index = np.array([ slots[other.numeric[k]] for k in kept ], dtype=np.intp)
+        n, sx, sxx, sxy = other.sums[:, kept[:, np.newaxis], kept[np.newaxis, :]]
+        d = np.array(other.shifts)[kept] - np.array(self.shifts)[index]
+        di = d[:, np.newaxis]
+        dj = d[np.newaxis, :]
+        self.sums[:, index[:, np.newaxis], index[np.newaxis, :]] += np.array([
+            n, sx + n * di, sxx + 2 * di * sx + n * di * di, sxy + sx * dj + sx.T * di + n * di * dj ])
+
+    def merge_dependencies(self, other):
+        '''
+        Adds the tables of another PairStat to these, translating its
+        codes. Only the columns both still test are kept.
+        '''
+        size = dependency_max_values
+        if other.dependent is None:
+            return
+        if self.dependent is None:
+            self.dependent = list(other.dependent)
+            self.codes = dict((i, dict(known)) for i, known in other.codes.items())
+            self.tables = dict((pair, table.copy()) for pair, table in other.tables.items())
+            return
+        mappings = {}
+        for i in list(self.dependent):
+            if i not in other.codes:
+                self.drop_dependent(i)
+                continue
+            known = self.codes[i]
+            mapping = np.zeros(len(other.codes[i]), dtype=np.intp)
+            for h, code in other.codes[i].items():
+                if h not in known:
+                    known[h] = len(known)
+                mapping[code] = known[h]
+            if len(known) > size:
+                self.drop_dependent(i)
+            else:
+                mappings[i] = mapping
+        for (a, b), table in self.tables.items():
+            theirs = other.tables[(a, b)].reshape(size, size)[:len(mappings[a]), :len(mappings[b])]
+            table.reshape(size, size)[np.ix_(mappings[a], mappings[b])] += theirs
+
+    def get_correlations(self):
+        '''
+        Returns (r, rows, column, column) tuples of the pairs of numeric
+        columns, Pearson's r over the rows where both have numbers.
+        '''
+        m = len(self.numeric)
+        n, sx, sxx, sxy = self.sums[:, :m, :m]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = n * sxy - sx * sx.T
+            var = n * sxx - sx * sx
+            r = cov / np.sqrt(var * var.T)
+        results = []
+        for k, l in itertools.combinations(xrange(m), 2):
+            if n[k, l] >= 3 and var[k, l] > 0 and var[l, k] > 0:
+                results.append((max(-1.0, min(1.0, float(r[k, l]))), int(n[k, l]),
+                                self.numeric[k], self.numeric[l]))
+        return results
+
+    def get_distinct(self, i):
+        '''
+        Returns the count of distinct nonempty values of a column, exact
+        if it is tested for dependencies, and its standard error.
+        '''
+        if self.dependent is not None and i in self.codes:
+            # empty values hash to 0
+            return len(self.codes[i]) - (1 if 0 in self.codes[i] else 0), 0
+        return self.distinct[i].estimate(), self.distinct[i].std_error()
+
+    def get_report_records(self, names):
+        '''
+        Returns the results worth reporting, given the column names, as
+        a list of ORDERED dicts of the kind of result, the names of the
+        columns, a value and a count of rows:
+            correlation: Pearson's r, over the rows with both numbers
+            same_empties: columns empty on the same rows; the count of
+                those rows, of all rows
+            shared_empties: columns empty mostly on the same rows; the
+                Jaccard index of those rows, over the rows both are empty
+            same_values: columns of the same values, as the count of
+                nonempty values, of all rows
+            empty_pattern: columns empty together, no others, in a share
+                of the rows; the most common patterns first
+            candidate_key: a column of no empty and no repeated values;
+                the count of distinct values, estimated if not tested
+                for dependencies, of all rows
+            composite_key: two columns of few values whose pairs of
+                values are never repeated; the count of pairs, of all rows
+            dependency: the first column determines the second, but for
+                the share of rows given, of all rows
+        Up to report_max_count results of each kind.
+        '''
+        records = []
+        def add(kind, columns, value, rows):
+            records.append(collections.OrderedDict([ ("pair_kind", kind),
+                                                     ("column_names", [ self.get_name(names, i) for i in columns ]),
+                                                     ("value", value), ("rows", rows) ]))
+        correlations = [ c for c in self.get_correlations() if abs(c[0]) >= correlation_min ]
+        correlations.sort(key=lambda c: (-abs(c[0]), c[2], c[3]))
+        for r, rows, a, b in correlations[:report_max_count]:
+            add("correlation", [ a, b ], r, rows)
+        emptied = [ i for i in xrange(self.width) if self.empty_counts[i] > 0 ]
+        same_empties = get_groups(self.empty_signatures, emptied)
+        for group in same_empties[:report_max_count]:
+            add("same_empties", group, int(self.empty_counts[group[0]]), self.row_count)
+        grouped = set()
+        for group in same_empties:
+            grouped.update(itertools.combinations(group, 2))
+        shared = []
+        for a, b in itertools.combinations([ i for i in emptied if i < pair_max_columns ], 2):
+            both = self.shared_empties[a, b]
+            either = self.empty_counts[a] + self.empty_counts[b] - both
+            if (a, b) not in grouped and both > 0 and both / either >= empty_match_min:
+                shared.append((both / either, int(both), a, b))
+        shared.sort(key=lambda s: (-s[0], s[2], s[3]))
+        for jaccard, rows, a, b in shared[:report_max_count]:
+            add("shared_empties", [ a, b ], jaccard, rows)
+        filled = [ i for i in xrange(self.width) if self.empty_counts[i] < self.row_count ]
+        for group in get_groups(self.value_signatures, filled)[:report_max_count]:
+            add("same_values", group, self.row_count - int(self.empty_counts[group[0]]), self.row_count)
+        patterns = sorted(self.patterns.values(), key=lambda p: (-p[0], p[1]))
+        for count, columns in patterns[:report_max_count]:
+            add("empty_pattern", columns, count / float(self.row_count), count)
+        keys = set()
+        if self.row_count >= 2:
+            for i in xrange(self.width):
+                distinct, error = self.get_distinct(i)
+                if self.empty_counts[i] == 0 and distinct >= self.row_count - error:
+                    keys.add(i)
+                    if len(keys) <= report_max_count:
+                        add("candidate_key", [ i ], distinct, self.row_count)
+        if self.dependent is not None:
+            self.add_dependencies(add, keys)
+        return records
+
+    def add_dependencies(self, add, keys):
+        '''
+        Adds the composite keys and the dependencies, but for those that
+        follow from a key or a column of a single value, to the report.
+        '''
+        size = dependency_max_values
+        composite = []
+        dependencies = []
+        for (a, b), table in sorted(self.tables.items()):
+            table = table.reshape(size, size)
+            if a not in keys and b not in keys and np.count_nonzero(table) == self.row_count:
+                composite.append((a, b))
+            for x, y, best in ((a, b, table.max(axis=1)), (b, a, table.max(axis=0))):
+                # a key determines anything, anything determines a constant
+                if x in keys or len(self.codes[y]) < 2:
+                    continue
+                holds = int(best.sum())
+                error = 1.0 - holds / float(self.row_count)
+                if error <= dependency_error_max:
+                    dependencies.append((error, x, y, holds))
+        for a, b in composite[:report_max_count]:
+            add("composite_key", [ a, b ], self.row_count, self.row_count)
+        dependencies.sort(key=lambda d: d[:3])
+        for error, x, y, holds in dependencies[:report_max_count]:
+            add("dependency", [ x, y ], error, holds)
+
+    def get_name(self, names, i):
+        '''
+        Returns the name of a column, or its index if it has none.
+        '''
+        if i < len(names) and names[i] is not None:
+            return names[i]
+        return "%d" % i
+
+    def print_report(self, names):
+        '''
+        Prints the report on pairs of columns to stdout, one result per
+        line, given the column names.
+        '''
+        print("Pairs of columns")
+        if len(self.numeric) == pair_max_columns:
+            print("Note: correlations of the first %d numeric columns only" % pair_max_columns)
+        for record in self.get_report_records(names):
+            kind = record["pair_kind"]
+            quoted = [ "'%s'" % name for name in record["column_names"] ]
+            if kind == "correlation":
+                line = "%s = %f (%d rows)" % (" ~ ".join(quoted), record["value"], record["rows"])
+            elif kind == "same_empties":
+                line = "%s (%d empty)" % (", ".join(quoted), record["value"])
+            elif kind == "shared_empties" or kind == "empty_pattern":
+                line = "{%s} = %f (%d rows)" % (", ".join(quoted), record["value"], record["rows"])
+            elif kind == "candidate_key":
+                line = "%s (%d distinct)" % (quoted[0], record["value"])
+            elif kind == "dependency":
+                line = "%s = %f error (%d rows)" % (" -> ".join(quoted), record["value"], record["rows"])
+            else:
+                line = ", ".join(quoted)
+            print("\t%s %s" % (kind_labels[kind], line))
+        if self.other_patterns > 0:
+            print("Note: %d rows of rarer empty patterns not counted apart" % self.other_patterns)
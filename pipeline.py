@@ -0,0 +1,207 @@
+# future must be first
+from __future__ import print_function
+
+import cStringIO
+import csv
+import getopt
+import json
+import multiprocessing
+import os
+import sys
+
+import feature_matrix
+import profile_cache
+import profile_excel
+import transform
+import workbook_writer
+
+'''
+Runs the stages of script.sh in one process: profiles each Excel file,
+flattens each report to a feature row like transform.py, and writes all
+rows to one workbook, as csv_to_excel.py and xlsTransform.py did through
+output.xls. Reports and feature rows stay in memory, unless asked to be
+kept in the stats and transform directories. The reports can also make
+a feature matrix aligned by column name; see feature_matrix.py.
+'''
+
+# The profile options script.sh has always used
+profile_options = dict(header_skip=1, table=True, unique_max=10000, sheet_index=0,
+                       columnar=True, streaming=True, sketch_top=0, distributions=False)
+
+def profile_report(job):
+    '''
+    Profiles one file and returns its report as a string. Takes a single
+    tuple of the file name, a dict of profile_excel arguments and a
+    ProfileCache or None, so it can run in a worker process.
+    Returns the file name, the report or None, and an error message or
+    None on success.
+    '''
+    (file_name, options, cache) = job
+    saved_stdout = sys.stdout
+    try:
+        sys.stdout = cStringIO.StringIO()
+        profile_excel.profile_excel_any(file_name, options, cache)
+        report = sys.stdout.getvalue()
+    except Exception as e:
+        return (file_name, None, "%s: %s" % (file_name, e))
+    finally:
+        sys.stdout = saved_stdout
+    return (file_name, report, None)
+
+def profile_reports(paths, workers, cache=None, options=profile_options):
+    '''
+    Profiles many files, or directories of files, using a pool of worker
+    processes. Generates the file name, report and error message of each
+    file as it finishes, like profile_report.
+    '''
+    jobs = [ (f, options, cache) for f in profile_excel.find_excel_files(paths) ]
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        for result in pool.imap_unordered(profile_report, jobs, chunksize=1):
+            yield result
+        pool.close()
+        pool.join()
+    else:
+        for job in jobs:
+            yield profile_report(job)
+
+def read_feature_rows(lines):
+    '''
+    Splits the header and values lines of a feature row into rows of
+    cells, as csv_to_excel.py read them back from the file transform.py
+    wrote.
+    '''
+    return list(csv.reader(cStringIO.StringIO("".join(line + "\n" for line in lines))))
+
+def write_workbook(out_name, sheets):
+    '''
+    Writes feature rows to a workbook with a single sheet, as
+    xlsTransform.py merged the sheets csv_to_excel.py wrote: a header
+    row from the first sheet, then each values row after the name of
+    its sheet. Takes an ORDERED iterable of (sheet name, rows) tuples.
+    Rows are written as they come; past the limits of an xls sheet, or
+    of an xlsx sheet for an .xlsx name, they go on in more sheets. Only
+    an .xlsx name streams them to disk; xlwt keeps an xls in memory.
+    '''
+    with workbook_writer.open_workbook_writer(out_name) as writer:
+        for sheetx, (sheet_name, rows) in enumerate(sheets):
+            # xlrd saw every row as wide as the widest
+            ncols = max(len(row) for row in rows)
+            for rx, row in enumerate(rows):
+                row = row + [ "" ] * (ncols - len(row))
+                if rx == 0 and sheetx == 0:
+                    writer.add_sheet("merged", [ "sheetname" ] + row)
+                if rx > 0:
+                    writer.write_row([ sheet_name ] + row)
+
+def run_pipeline(paths, prof, out_name, workers=1, cache=None, stats_dir=None, transform_dir=None,
+                 matrix_name=None, layout=None):
+    '''
+    Profiles the files, flattens the reports and writes the workbook.
+    Reports are also written to stats_dir and feature rows to
+    transform_dir when given, named as script.sh named them.
+    With a matrix name, also writes a feature matrix of the reports, a
+    row per file in name order, keeping the layout of an earlier matrix
+    when given one.
+    Returns the number of files that failed.
+    '''
+    for out_dir in (stats_dir, transform_dir):
+        if out_dir is not None and not os.path.isdir(out_dir):
+            os.makedirs(out_dir)
+    failures = 0
+    sheets = []
+    reports = []
+    for file_name, report, error in profile_reports(paths, workers, cache):
+        if error is not None:
+            print("Error: " + error, file=sys.stderr)
+            failures += 1
+            continue
+        base_name = os.path.splitext(os.path.basename(file_name))[0]
+        lines = transform.transform(csv.reader(cStringIO.StringIO(report)), prof)
+        if stats_dir is not None:
+            with open(os.path.join(stats_dir, base_name + ".csv"), 'w') as out_file:
+                out_file.write(report)
+        if transform_dir is not None:
+            with open(os.path.join(transform_dir, base_name + "Transformed.csv"), 'w') as out_file:
+                for line in lines:
+                    print(line, file=out_file)
+        sheets.append((base_name + "Transformed.csv", read_feature_rows(lines)))
+        if matrix_name is not None:
+            reports.append((base_name, report))
+    if len(sheets) > 0:
+        # in the order the shell listed the transformed files
+        sheets.sort()
+        write_workbook(out_name, sheets)
+    if matrix_name is not None:
+        with feature_matrix.FeatureMatrix(layout, frozen=layout is not None) as fm:
+            for base_name, report in sorted(reports):
+                fm.add_profile(base_name, prof, feature_matrix.read_report_records(report.splitlines()))
+            fm.save(matrix_name)
+    return failures
+
+def usage():
+    '''
+    Prints a usage message and exits.
+    '''
+    print('pipeline.py [options] file.xls | file.xlsx | directory ...')
+    print('Options:')
+    print('   -c cache directory, to skip files profiled before (default none)')
+    print('   -j worker process count (default 1)')
+    print('   -l layout of an earlier feature matrix, its .json file, to keep (default none)')
+    print('   -m feature matrix to write, a .npy file (default none)')
+    print('   -o output workbook, xls or xlsx; an xls workbook is held in memory until it is saved,')
+    print('      so use xlsx for large inputs (default out.xls)')
+    print('   -p profile label of the inputs, 1-2 for regular-unregular (default 1)')
+    print('   -s directory to keep the profile reports in (default none)')
+    print('   -t directory to keep the feature rows in (default none)')
+    sys.exit()
+
+def main(args):
+    '''
+    Parses command-line arguments and runs the pipeline.
+    '''
+    try:
+        opts, args = getopt.getopt(args, "c:j:l:m:o:p:s:t:")
+    except getopt.GetoptError:
+        usage()
+    # default values
+    cache_dir = None
+    workers = 1
+    out_name = "out.xls"
+    prof = "1"
+    stats_dir = None
+    transform_dir = None
+    matrix_name = None
+    layout = None
+    for opt, optarg in opts:
+        if opt in ("-c"):
+            cache_dir = optarg
+        elif opt in ("-j"):
+            workers = int(optarg)
+        elif opt in ("-l"):
+            with open(optarg, "r") as info_file:
+                layout = json.load(info_file)["layout"]
+        elif opt in ("-m"):
+            matrix_name = optarg
+        elif opt in ("-o"):
+            out_name = optarg
+        elif opt in ("-p"):
+            prof = optarg
+        elif opt in ("-s"):
+            stats_dir = optarg
+        elif opt in ("-t"):
+            transform_dir = optarg
+        else:
+            usage()
+    if len(args) == 0:
+        usage()
+    cache = None
+    if cache_dir is not None:
+        cache = profile_cache.ProfileCache(cache_dir, profile_excel.cache_max_megabytes << 20)
+    failures = run_pipeline(args, prof, out_name, workers, cache, stats_dir, transform_dir, matrix_name, layout)
+    if failures > 0:
+        sys.exit(1)
+
+# Pass all params after program name to our main
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,144 @@
+'''
+Persistent cache of profile results, so unchanged inputs are not
+profiled again.
+
+Entries are keyed by a hash of the input file's contents and of the
+options that change the statistics, and hold the pickled TableStat of
+each sheet. The cache directory is kept under a size limit by removing
+the least recently used entries.
+
+Also has the helpers to save and load the state of incremental runs.
+'''
+
+# future must be first
+from __future__ import print_function
+import cPickle as pickle
+import hashlib
+import os
+
+# Bump when TableStat or ColumnStat change, so old entries are not used
+cache_version = 6
+
+# Bytes read at a time when hashing a file
+hash_block_size = 1 << 20
+
+def get_file_hash(file_name):
+    '''
+    Returns the hex SHA-1 digest of a file's contents.
+    '''
+    digest = hashlib.sha1()
+    with open(file_name, "rb") as f:
+        block = f.read(hash_block_size)
+        while block:
+            digest.update(block)
+            block = f.read(hash_block_size)
+    return digest.hexdigest()
+
+def get_options_hash(options):
+    '''
+    Returns the hex SHA-1 digest of a dict of profile options.
+    Options are sorted so the digest does not depend on their order.
+    '''
+    return hashlib.sha1("%d:%r" % (cache_version, sorted(options.items()))).hexdigest()
+
+def load_pickle(path):
+    '''
+    Returns the value pickled in a file, or None if it can't be read.
+    '''
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except (IOError, OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+def save_pickle(path, value):
+    '''
+    Pickles a value to a file, through a temporary file renamed into
+    place, so readers never see a partial file.
+    '''
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp_path, "wb") as f:
+        pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, path)
+
+# Inherits only from object
+class ProfileCache(object):
+    '''
+    Directory of cached profiles, one file per entry, named by key.
+    The modification time of an entry is its last use.
+    Safe to share between worker processes: entries are written to a
+    temporary file and renamed into place, and an entry that vanishes
+    while in use is treated as a miss.
+    '''
+
+    def __init__(self, cache_dir, max_bytes):
+        if not isinstance(max_bytes, (int, long)) or max_bytes < 0:
+            raise Exception("Cache size must be a non-negative integer")
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                # another worker may have made it first
+                if not os.path.isdir(cache_dir):
+                    raise
+
+    def get_key(self, file_name, options):
+        '''
+        Builds the key of a file profiled with a dict of options.
+        '''
+        return hashlib.sha1(get_file_hash(file_name) + get_options_hash(options)).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key + ".pickle")
+
+    def load(self, key):
+        '''
+        Returns the cached value for a key, or None on a miss.
+        A hit counts as a use of the entry.
+        '''
+        path = self.get_path(key)
+        value = load_pickle(path)
+        if value is not None:
+            try:
+                os.utime(path, None)
+            except OSError:
+                pass
+        return value
+
+    def save(self, key, value):
+        '''
+        Stores a value for a key, then evicts entries past the size limit.
+        '''
+        save_pickle(self.get_path(key), value)
+        self.evict()
+
+    def evict(self):
+        '''
+        Removes the least recently used entries until the cache fits
+        within its size limit.
+        '''
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".pickle"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        # oldest first
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # already removed by another worker
+                pass
+            total -= size
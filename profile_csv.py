@@ -0,0 +1,364 @@
+# future must be first
+from __future__ import print_function
+
+import csv
+import getopt
+import gzip
+import io
+import mmap
+import multiprocessing
+import os
+import sys
+
+import profile_excel
+import tablestat
+
+'''
+Script to profile the values in a delimited text file (CSV or TSV),
+optionally gzip-compressed, with the same report as profile_excel.py.
+The file is treated as a workbook with a single sheet, named after it.
+'''
+
+# Bytes read from the file at a time
+read_buffer_size = 1 << 20
+
+# Rows fed to TableStat at a time
+batch_rows = profile_excel.stream_batch_rows
+
+def is_gzip(file_name):
+    '''
+    Tells a gzip-compressed file by its leading bytes.
+    '''
+    with open(file_name, "rb") as f:
+        return f.read(2) == b"\x1f\x8b"
+
+def open_delimited(file_name):
+    '''
+    Opens a delimited file for reading in large blocks, decompressing
+    it on the fly when it is gzip-compressed.
+    '''
+    if is_gzip(file_name):
+        # gzip reads ahead in blocks of its own
+        return gzip.open(file_name, "rb")
+    return io.open(file_name, "rb", buffering=read_buffer_size)
+
+def get_sheet_name(file_name):
+    '''
+    Names the single sheet of a file after it, without extensions.
+    '''
+    name = os.path.basename(file_name)
+    if name.lower().endswith(".gz"):
+        name = name[:-3]
+    return os.path.splitext(name)[0]
+
+def get_delimiter(file_name):
+    '''
+    Guesses the delimiter of a file from its extension: tab for .tsv
+    and .tab files, else comma.
+    '''
+    name = file_name.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if os.path.splitext(name)[1] in (".tsv", ".tab"):
+        return "\t"
+    return ","
+
+def read_header(reader, header_skip, encoding):
+    '''
+    Reads the header rows from a csv reader and returns the column names
+    they make, or None if the file ends first. Blank lines are skipped.
+    '''
+    column_names = []
+    rownum = 0
+    while rownum < header_skip:
+        row = next(reader, None)
+        if row is None:
+            return None
+        if len(row) == 0:
+            continue
+        rownum += 1
+        row = [ v.decode(encoding) for v in row ]
+        # gather header contents to use as cell names
+        # First ensure list is the right length
+        while len(column_names) < len(row):
+            column_names.append("")
+        column_names = [ column_names[i] + row[i] for i in xrange(len(row)) ]
+    return column_names
+
+def analyze_rows(ts, reader, encoding, columnar, new_name):
+    '''
+    Analyzes the rows left in a csv reader, in batches. Blank lines are
+    skipped, and short rows count as empty in the missing columns.
+    Columns first seen past the header are named new_name.
+    '''
+    # data rows analyzed so far, and rows waiting in this batch
+    sheet_rows = 0
+    batch = []
+    width = len(ts.stats)
+    for row in reader:
+        if len(row) == 0:
+            continue
+        row = [ v.decode(encoding) for v in row ]
+        # pad to the widest row so far, as the xlsx reader does
+        if len(row) > width:
+            width = len(row)
+        elif len(row) < width:
+            row.extend([ u"" ] * (width - len(row)))
+        batch.append(row)
+        if len(batch) == batch_rows:
+            profile_excel.analyze_stream_batch(ts, batch, columnar, sheet_rows, new_name)
+            sheet_rows += len(batch)
+            batch = []
+    if len(batch) > 0:
+        profile_excel.analyze_stream_batch(ts, batch, columnar, sheet_rows, new_name)
+
+def read_records(m, end):
+    '''
+    Generates the lines of a memory-mapped file from its position until
+    a line starts at or past the end offset.
+    '''
+    while m.tell() < end:
+        line = m.readline()
+        if not line:
+            break
+        yield line
+
+def find_record_start(m, pos, quotes):
+    '''
+    Returns the offset of the first record starting at or after pos in a
+    memory-mapped file, given the count of quote characters before pos.
+    A newline ends a record only outside quotes, which is when an even
+    count of quotes comes before it, escaped quotes being doubled.
+    '''
+    if pos == 0:
+        return 0
+    size = len(m)
+    while pos < size:
+        newline = m.find("\n", pos)
+        if newline < 0:
+            return size
+        quotes += m[pos:newline].count('"')
+        pos = newline + 1
+        if quotes % 2 == 0:
+            return pos
+    return size
+
+def split_records(m, start, parts):
+    '''
+    Splits the bytes of a memory-mapped file from start to its end into
+    up to parts ranges of about equal size, at record boundaries.
+    Returns the ORDERED list of (start, end) offsets.
+    '''
+    size = len(m)
+    offsets = [ start ]
+    # count quotes in blocks, so the whole file is never copied
+    quotes = 0
+    pos = start
+    for i in xrange(1, parts):
+        target = max(start + (size - start) * i // parts, offsets[-1])
+        while pos < target:
+            block_end = min(target, pos + read_buffer_size)
+            quotes += m[pos:block_end].count('"')
+            pos = block_end
+        record_start = find_record_start(m, pos, quotes)
+        if record_start > pos:
+            quotes += m[pos:record_start].count('"')
+            pos = record_start
+        offsets.append(record_start)
+    offsets.append(size)
+    return [ (offsets[i], offsets[i + 1]) for i in xrange(parts) if offsets[i] < offsets[i + 1] ]
+
+def profile_csv_range(job):
+    '''
+    Profiles the records in a byte range of a file into a new TableStat,
+    in a worker process. Takes a single tuple of the file name, start and
+    end offsets, column names, and a dict of the other arguments.
+    '''
+    (file_name, start, end, column_names, options) = job
+    ts = tablestat.TableStat(options["unique_max"], column_names, options["sketch_top"], options["distributions"],
+                             options["schema"], options["adaptive"], pairs=options["pairs"])
+    with open(file_name, "rb") as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            m.seek(start)
+            analyze_rows(ts, csv.reader(read_records(m, end), delimiter=options["delimiter"]),
+                         options["encoding"], options["columnar"], options["new_name"])
+        finally:
+            m.close()
+    return ts
+
+def profile_csv_parallel(file_name, header_skip, workers, **options):
+    '''
+    Profiles a file with a pool of worker processes. The file is memory
+    mapped and split at record boundaries into a byte range per worker;
+    the partial TableStats are merged in file order.
+    Returns the TableStat, or None if the file ends within the header.
+    '''
+    with open(file_name, "rb") as f:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            column_names = read_header(csv.reader(read_records(m, len(m)), delimiter=options["delimiter"]),
+                                       header_skip, options["encoding"])
+            ranges = split_records(m, m.tell(), workers)
+        finally:
+            m.close()
+    if column_names is None:
+        return None
+    jobs = [ (file_name, start, end, column_names, options) for start, end in ranges ]
+    pool = multiprocessing.Pool(workers)
+    try:
+        parts = pool.map(profile_csv_range, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    if len(parts) == 0:
+        return tablestat.TableStat(options["unique_max"], column_names, options["sketch_top"],
+                                   options["distributions"], options["schema"], options["adaptive"],
+                                   pairs=options["pairs"])
+    # a column first seen in a later range is empty in the earlier ones,
+    # as a single pass would have filled it in
+    width = max(len(ts.stats) for ts in parts)
+    for ts in parts:
+        while len(ts.stats) < width:
+            cs = ts.new_column(len(ts.stats), options["new_name"])
+            for start in xrange(0, ts.row_count, batch_rows):
+                cs.analyze_values([ u"" ] * min(batch_rows, ts.row_count - start))
+            ts.stats.append(cs)
+    ts = parts[0]
+    for other in parts[1:]:
+        ts.merge(other)
+    return ts
+
+def profile_csv(header_skip, table, unique_max, file_name, sheet_index, columnar=True,
+                sketch_top=0, distributions=False, delimiter=None, encoding="utf-8", workers=1,
+                schema=None, adaptive=False, pairs=False):
+    '''
+    Reads a delimited file with the csv module, feeding TableStat in
+    batches, so memory use stays flat however many rows the file has.
+    Values are decoded to unicode text, as xlrd gives text cells; like
+    any CSV profile, numbers are reported as strings. Blank lines are
+    skipped. By default the delimiter is guessed from the file name.
+    With more than one worker, an uncompressed file is split among
+    worker processes by profile_csv_parallel. A file without data rows,
+    empty or only a header, is reported as such instead of profiled.
+    Other arguments are as for profile_excel.
+    '''
+    # the fast path is only taken by rows analyzed one at a time
+    adaptive = adaptive and not columnar
+    if sheet_index is not None and sheet_index != 0:
+        # warn on bad arguments
+        print("Failed to find sheet at index %d" % sheet_index)
+        return
+    if delimiter is None:
+        delimiter = get_delimiter(file_name)
+    new_name = "" if header_skip > 0 else None
+    if workers > 1 and not is_gzip(file_name) and os.path.getsize(file_name) > 0:
+        ts = profile_csv_parallel(file_name, header_skip, workers, unique_max=unique_max,
+                                  sketch_top=sketch_top, distributions=distributions, schema=schema,
+                                  adaptive=adaptive, pairs=pairs, delimiter=delimiter,
+                                  encoding=encoding, columnar=columnar, new_name=new_name)
+    else:
+        ts = None
+        with open_delimited(file_name) as f:
+            reader = csv.reader(f, delimiter=delimiter)
+            column_names = read_header(reader, header_skip, encoding)
+            if column_names is not None:
+                # instantiate the stat collector
+                ts = tablestat.TableStat(unique_max, column_names, sketch_top, distributions, schema, adaptive,
+                                         pairs=pairs)
+                analyze_rows(ts, reader, encoding, columnar, new_name)
+    if ts is None or ts.row_count == 0:
+        # warn on inputs with no rows to report on
+        print("Failed to find data rows in %s" % file_name)
+        return
+    # print report for the only sheet
+    profile_excel.print_sheet_report(ts, table, True, get_sheet_name(file_name), 0)
+
+def usage():
+    '''
+    Prints a usage message and exits.
+    '''
+    print('profile_csv.py [options] file.csv | file.tsv | file.csv.gz')
+    print('Options:')
+    print('   -d delimiter (default tab for .tsv and .tab files, else comma)')
+    print('   -e text encoding (default utf-8)')
+    print('   -f fast path for columns settled on one type, with -r (default no)')
+    print('   -h header row skip count (default 1)')
+    print('   -j worker process count, splitting an uncompressed file (default 1)')
+    print('   -k sketch distinct count and top-k values past the unique-limit (default off)')
+    print('   -m moments and percentiles of numbers and dates (default no)')
+    print('   -r analyze one row at a time (default columnar)')
+    print('   -s sheet-index, only 0 exists (default all)')
+    print('   -t tabular format report (default no)')
+    print('   -u unique-limit (default 20)')
+    print('   -v pairs of columns: correlations, shared empties, keys and dependencies,')
+    print('      in tall and JSON Lines reports (default no)')
+    print('   -w JSON Lines report, one object per column (default no)')
+    print('   -y schema file of column names and declared datatypes (default none)')
+    sys.exit()
+
+def main(args):
+    '''
+    Parses command-line arguments and profiles the named file.
+    '''
+    try:
+        opts, args = getopt.getopt(args, "d:e:fh:j:k:mrs:tu:vwy:")
+    except getopt.GetoptError:
+        usage()
+    # default values
+    delimiter = None
+    encoding = "utf-8"
+    hskip = 1
+    table = False
+    json_lines = False
+    sheetidx = None
+    umax = 20
+    columnar = True
+    sketch_top = 0
+    distributions = False
+    workers = 1
+    adaptive = False
+    schema = None
+    pairs = False
+    for opt, optarg in opts:
+        if opt in ("-d"):
+            # allow a tab to be given as \t
+            delimiter = optarg.decode("string_escape")
+        elif opt in ("-e"):
+            encoding = optarg
+        elif opt in ("-f"):
+            adaptive = True
+        elif opt in ("-h"):
+            hskip = int(optarg)
+        elif opt in ("-j"):
+            workers = int(optarg)
+        elif opt in ("-k"):
+            sketch_top = int(optarg)
+        elif opt in ("-m"):
+            distributions = True
+        elif opt in ("-r"):
+            columnar = False
+        elif opt in ("-s"):
+            sheetidx = int(optarg)
+        elif opt in ("-t"):
+            table = True
+        elif opt in ("-u"):
+            umax = int(optarg)
+        elif opt in ("-v"):
+            pairs = True
+        elif opt in ("-w"):
+            json_lines = True
+        elif opt in ("-y"):
+            schema = profile_excel.read_schema(optarg)
+        else:
+            usage()
+    if json_lines:
+        table = "json"
+    if len(args) != 1 or (pairs and table is True) or (adaptive and columnar):
+        usage()
+    profile_csv(hskip, table, umax, args[0], sheetidx, columnar, sketch_top, distributions,
+                delimiter, encoding, workers, schema, adaptive, pairs)
+
+# Pass all params after program name to our main
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,33 +1,132 @@
+# future must be first
+from __future__ import print_function
+
+import cPickle as pickle
+import csv
 import getopt
+import hashlib
+import multiprocessing
+import os
 import sys
 
+import numpy as np
 # xlrd, see http://www.python-excel.org and https://pypi.python.org/pypi/xlrd
-from xlrd import open_workbook
+from xlrd import open_workbook, XL_CELL_DATE
 
+import instrument
+import profile_cache
+import profile_output
+import sampling
 import tablestat
+import xlsx_reader
 
 '''
 Script to profile the values in sheets within an Excel file (xls or xlsx).
 '''
 
-def profile_excel(header_skip, table, unique_max, file_name, sheet_index):
+# Rows per batch when streaming, to bound memory use
+stream_batch_rows = 10000
+
+# Default size limit of the profile cache, in megabytes
+cache_max_megabytes = 256
+
+# Options that do not change the statistics, left out of cache keys
+report_options = ("table", "instrument")
+
+# Options that change how rows are read, but not the statistics unless
+# sketches or distributions are kept, whose estimates depend on the
+# order and batches values come in
+read_options = ("columnar", "streaming")
+
+def profile_excel(header_skip, table, unique_max, file_name, sheet_index, columnar=True, streaming=False,
+                  sketch_top=0, distributions=False, sheets=None, states=None, schema=None, adaptive=False,
+                  dates=True, instrument=None, sample_size=None, sample_method="reservoir", sample_seed=0,
+                  tolerance=None, pairs=False):
     '''
     Reads a XLS file using xlrd
     Uses on-demand features to reduce memory requirements.
-    TODO: Send date-time values as type datetime.datetime (not float)
+    Prints a tall report, a tabular one if table is True, or JSON Lines
+    if table is "json".
+    By default analyzes each sheet column by column with vectorized
+    operations; set columnar to False to analyze one row at a time.
+    Set streaming to read XLSX files with profile_xlsx_stream instead;
+    XLS files are still read with xlrd.
+    A positive sketch_top adds estimated distinct counts and that many
+    top values to the report, past the unique-limit. Set distributions
+    to add mean, variance, skew and percentiles of numbers and dates.
+    A schema dict declares the datatypes of columns by name, and
+    adaptive lets settled columns take a fast path when rows are
+    analyzed one at a time; see TableStat. Columnar analysis is
+    vectorized already, and ignores adaptive.
+    By default cells formatted as dates are profiled as date-time values,
+    converted with the workbook's datemode; clear dates to profile their
+    serial numbers as before.
+    If sheets is a list, the sheet name, index and pickled TableStat of
+    each sheet reported are appended to it.
+    If states is a dict, it maps sheet names to the state saved by an
+    earlier run; a sheet that still starts with the rows it covers is
+    resumed, profiling only the rows added since. The dict is updated
+    with the state of each sheet reported.
+    A sample_size analyzes only a sample of the data rows of each sheet,
+    that many rows or a fraction of them if below 1, picked by a method
+    of sampling.methods with sample_seed. A tolerance stops analyzing
+    each column once it settles, and each sheet once all its columns
+    have; see TableStat. Either way, reports mark estimated columns.
+    Set pairs to add statistics of pairs of columns to tall and JSON
+    Lines reports; see pairstat.py.
+    Given an Instrument, times the stages of the run; see instrument.py.
     '''
+    # the fast path is only taken by rows analyzed one at a time
+    adaptive = adaptive and not columnar
+    if streaming and xlsx_reader.is_xlsx(file_name):
+        profile_xlsx_stream(header_skip, table, unique_max, file_name, sheet_index, columnar, sketch_top,
+                            distributions, sheets, states, schema, adaptive, dates, instrument, sample_size,
+                            sample_method, sample_seed, tolerance, pairs)
+        return
+    if instrument is not None:
+        instrument.switch("read")
     ts = None
     # detect failure to do anything
     found_sheet = False
     with open_workbook(file_name, on_demand=True) as wb_obj:
+        # date-time values of recent serial numbers, see xlsx_reader.get_date
+        date_cache = {}
         sheet_names = [ n for n in wb_obj.sheet_names() ]
         # print("Sheet names: " + ",".join(sheet_names))
         for idx in xrange(len(sheet_names)):
             if sheet_index is not None and sheet_index != idx:
                 continue
+            if instrument is not None:
+                instrument.begin_sheet(file_name, sheet_names[idx])
             s = wb_obj.sheet_by_name(sheet_names[idx])
             column_names = []
-            for rownum in range(s.nrows):
+            # rows profiled by an earlier run, skipped when resuming
+            start = 0
+            if states is not None:
+                digest = hashlib.sha1()
+                rows = (s.row_values(r) for r in xrange(s.nrows))
+                resumed = resume_sheet(states.get(sheet_names[idx]), header_skip, rows, digest)
+                # xlrd pads all rows to the widest, so a wider sheet starts over
+                if resumed is not None and len(resumed[0].stats) == s.ncols:
+                    (ts, start) = resumed
+                else:
+                    digest = hashlib.sha1()
+                    rows = (s.row_values(r) for r in xrange(s.nrows))
+                # the state covers all the rows
+                for row in rows:
+                    digest.update(repr(row))
+            # the data rows, or those sampled, as offsets from the first
+            first = max(header_skip, start)
+            sample = None
+            rownums = range(start, s.nrows)
+            if sample_size is not None:
+                sampler = sampling.new_sampler(sample_method, sample_size, sample_seed, max(s.nrows - first, 0))
+                sample = sampling.sample_indexes(sampler, max(s.nrows - first, 0))
+                rownums = range(start, min(first, s.nrows)) + [ first + i for i in sample ]
+            for rownum in rownums:
+                # columnar mode reads only the header rows one at a time
+                if columnar and rownum >= header_skip:
+                    break
                 # get the row's values as a regular list
                 row = [ s.cell(rownum,col).value for col in range(s.ncols) ]
                 # skip header rows as directed, possibly zero
@@ -40,44 +139,493 @@ def profile_excel(header_skip, table, unique_max, file_name, sheet_index):
                     # detect the last header row
                     if rownum + 1 == header_skip:
                         # instantiate the stat collector
-                        ts = tablestat.TableStat(unique_max, column_names)
+                        ts = tablestat.TableStat(unique_max, column_names, sketch_top, distributions, schema, adaptive,
+                                                 tolerance, pairs)
                 else:
                     # special case for header-free inputs
                     if ts is None and header_skip == 0:
-                        ts = tablestat.TableStat(unique_max, [])
+                        ts = tablestat.TableStat(unique_max, [], sketch_top, distributions, schema, adaptive, tolerance,
+                                                 pairs)
+                    if dates:
+                        if instrument is not None:
+                            instrument.switch("convert")
+                        convert_dates(row, s.row_types(rownum), wb_obj.datemode, date_cache)
                     # this is a data row (not a header), analyze it
-                    ts.analyze_row(row)
+                    if instrument is not None:
+                        instrument.switch("analyze")
+                        ts.analyze_row(row, instrument.sample_row(rownum))
+                        instrument.add_rows(1)
+                        instrument.switch("read")
+                    else:
+                        ts.analyze_row(row)
+                    if tolerance is not None and ts.is_stopped():
+                        break
+            if columnar and s.nrows > first:
+                # special case for header-free inputs
+                if ts is None and header_skip == 0:
+                    ts = tablestat.TableStat(unique_max, [], sketch_top, distributions, schema, adaptive, tolerance,
+                                             pairs)
+                # all data rows at once, as one list per column
+                columns = [ take_rows(s.col_values(col, first), sample) for col in range(s.ncols) ]
+                if dates:
+                    if instrument is not None:
+                        instrument.switch("convert")
+                    for col in range(s.ncols):
+                        convert_dates(columns[col], take_rows(s.col_types(col, first), sample),
+                                      wb_obj.datemode, date_cache)
+                if instrument is not None:
+                    instrument.switch("analyze")
+                    ts.analyze_columns(columns, instrument.column_times)
+                    instrument.add_rows(len(sample) if sample is not None else s.nrows - first)
+                else:
+                    ts.analyze_columns(columns)
+                columns = None
+            if sample is not None and ts is not None:
+                ts.add_sampled_rows(max(s.nrows - first, 0))
+            if states is not None:
+                states[sheet_names[idx]] = get_sheet_state(ts, s.nrows, digest)
             # for all rows
             # Free some memory
             s = None
             wb_obj.unload_sheet(sheet_names[idx])
             # print report for this sheet
-            if table:
-                # emit header when the first sheet is found (a bit of a hack)
-                if not found_sheet: ts.print_report_thead("Sheet name,Sheet index,")
-                ts.print_report_tbody("%s,%d," % (sheet_names[idx], idx))
-            else:
-                print ("---Begin sheet: '%s' (index %d)---" % (sheet_names[idx], idx))
-                ts.print_report()
-                print ("---End sheet: '%s' (index %d)---" % (sheet_names[idx], idx))
+            if instrument is not None:
+                instrument.switch("report")
+            print_sheet_report(ts, table, not found_sheet, sheet_names[idx], idx)
+            # keep a copy, the stats may go on to the next sheet
+            if sheets is not None:
+                sheets.append((sheet_names[idx], idx, pickle.dumps(ts, pickle.HIGHEST_PROTOCOL)))
+            if instrument is not None:
+                instrument.end_sheet(ts)
+            # If we got here, we found a sheet.
+            found_sheet = True
+        # for all sheets
+    # with
+    if instrument is not None:
+        instrument.switch(None)
+    # warn on bad arguments
+    if not found_sheet:
+        print("Failed to find sheet at index %d" % sheet_index)
+
+def profile_xlsx_stream(header_skip, table, unique_max, file_name, sheet_index, columnar=True, sketch_top=0,
+                        distributions=False, sheets=None, states=None, schema=None, adaptive=False,
+                        dates=True, instrument=None, sample_size=None, sample_method="reservoir", sample_seed=0,
+                        tolerance=None, pairs=False):
+    '''
+    Reads a XLSX file one row at a time using xlsx_reader, feeding
+    TableStat in batches, so memory use stays flat however many rows
+    the sheets have. Reports the same statistics as profile_excel.
+    As the rows of a sheet are not counted until the end, a reservoir
+    sample takes a row count and a systematic one a fraction; a sheet
+    whose columns have all settled is not read any further.
+    '''
+    ts = None
+    # detect failure to do anything
+    found_sheet = False
+    if instrument is not None:
+        instrument.switch("read")
+    with xlsx_reader.XlsxReader(file_name, dates) as reader:
+        sheet_names = reader.sheet_names()
+        for idx in xrange(len(sheet_names)):
+            if sheet_index is not None and sheet_index != idx:
+                continue
+            if instrument is not None:
+                instrument.begin_sheet(file_name, sheet_names[idx])
+            column_names = []
+            # data rows analyzed so far, and rows waiting in this batch
+            sheet_rows = 0
+            batch = []
+            # rows profiled by an earlier run, skipped when resuming
+            start = 0
+            rows = reader.iter_rows(idx)
+            sampler = None
+            if sample_size is not None:
+                sampler = sampling.new_sampler(sample_method, sample_size, sample_seed)
+            if states is not None:
+                digest = hashlib.sha1()
+                resumed = resume_sheet(states.get(sheet_names[idx]), header_skip, rows, digest)
+                if resumed is not None:
+                    (ts, start) = resumed
+                    sheet_rows = max(start - header_skip, 0)
+                else:
+                    # the rows read while checking are gone, start over
+                    digest = hashlib.sha1()
+                    rows = reader.iter_rows(idx)
+            row_count = start
+            for rownum, row in enumerate(rows, start):
+                if states is not None:
+                    digest.update(repr(row))
+                    row_count = rownum + 1
+                # skip header rows as directed, possibly zero
+                if rownum < header_skip:
+                    # gather header contents to use as cell names
+                    # First ensure list is the right length
+                    while len(column_names) < len(row):
+                        column_names.append("")
+                    column_names = [ column_names[i] + str(row[i]) for i in xrange(len(row)) ]
+                    # detect the last header row
+                    if rownum + 1 == header_skip:
+                        # instantiate the stat collector
+                        ts = tablestat.TableStat(unique_max, column_names, sketch_top, distributions, schema, adaptive,
+                                                 tolerance, pairs)
+                    continue
+                # special case for header-free inputs
+                if ts is None and header_skip == 0:
+                    ts = tablestat.TableStat(unique_max, [], sketch_top, distributions, schema, adaptive, tolerance,
+                                             pairs)
+                if sampler is not None and not sampler.offer(row):
+                    continue
+                batch.append(row)
+                if len(batch) == stream_batch_rows:
+                    analyze_stream_batch(ts, batch, columnar, sheet_rows, "" if header_skip > 0 else None,
+                                         instrument)
+                    sheet_rows += len(batch)
+                    batch = []
+                    if ts.is_stopped():
+                        break
+            if sampler is not None and ts is not None:
+                # the rows a reservoir held until the end
+                batch.extend(sampler.get_items())
+                ts.add_sampled_rows(sampler.count)
+            for part_start in xrange(0, len(batch), stream_batch_rows):
+                if ts.is_stopped():
+                    break
+                part = batch[part_start:part_start + stream_batch_rows]
+                analyze_stream_batch(ts, part, columnar, sheet_rows, "" if header_skip > 0 else None, instrument)
+                sheet_rows += len(part)
+            if states is not None:
+                states[sheet_names[idx]] = get_sheet_state(ts, row_count, digest)
+            # print report for this sheet
+            if instrument is not None:
+                instrument.switch("report")
+            print_sheet_report(ts, table, not found_sheet, sheet_names[idx], idx)
+            # keep a copy, the stats may go on to the next sheet
+            if sheets is not None:
+                sheets.append((sheet_names[idx], idx, pickle.dumps(ts, pickle.HIGHEST_PROTOCOL)))
+            if instrument is not None:
+                instrument.end_sheet(ts)
             # If we got here, we found a sheet.
             found_sheet = True
         # for all sheets
     # with
+    if instrument is not None:
+        instrument.switch(None)
     # warn on bad arguments
     if not found_sheet:
         print("Failed to find sheet at index %d" % sheet_index)
 
+def convert_dates(values, types, datemode, cache):
+    '''
+    Replaces the values of date cells in a list, which xlrd gives as
+    float serial numbers, with datetime.datetime values. The cells are
+    found in bulk from xlrd's list of cell types, and each serial number
+    is converted once, through the cache dict.
+    '''
+    for i in np.flatnonzero(np.array(types, dtype=np.int8) == XL_CELL_DATE):
+        values[i] = xlsx_reader.get_date(values[i], datemode, cache)
+
+def take_rows(values, sample):
+    '''
+    Returns the values of a column at the offsets of a sample, or all of
+    them if sample is None.
+    '''
+    if sample is None:
+        return values
+    return [ values[i] for i in sample ]
+
+def analyze_stream_batch(ts, rows, columnar, prior_rows, new_name, instrument=None):
+    '''
+    Analyzes a batch of streamed rows. Streamed rows only grow as wide
+    as the widest row so far, so a column first seen in this batch is
+    given empty values for the prior rows of the sheet, as xlrd would.
+    Given an Instrument, times the batch as converting and analyzing,
+    then goes back to reading.
+    '''
+    if instrument is not None:
+        instrument.switch("convert")
+    width = max(len(row) for row in rows)
+    while len(ts.stats) < width:
+        cs = ts.new_column(len(ts.stats), new_name)
+        for start in xrange(0, prior_rows, stream_batch_rows):
+            cs.analyze_values([ u"" ] * min(stream_batch_rows, prior_rows - start))
+        ts.stats.append(cs)
+    for row in rows:
+        row.extend([ u"" ] * (width - len(row)))
+    if instrument is None:
+        if columnar:
+            ts.analyze_columns(zip(*rows))
+        else:
+            for row in rows:
+                ts.analyze_row(row)
+        return
+    if columnar:
+        columns = zip(*rows)
+        instrument.switch("analyze")
+        ts.analyze_columns(columns, instrument.column_times)
+    else:
+        instrument.switch("analyze")
+        for rownum, row in enumerate(rows, prior_rows):
+            ts.analyze_row(row, instrument.sample_row(rownum))
+    instrument.add_rows(len(rows))
+    instrument.switch("read")
+
+def read_schema(file_name):
+    '''
+    Reads a declared schema from a CSV file of column names and datatype
+    names as reported, e.g. "Number", one column per line.
+    Returns a dict of names to datatype names.
+    '''
+    schema = {}
+    with open(file_name, 'r') as schema_file:
+        for row in csv.reader(schema_file):
+            if len(row) == 0:
+                continue
+            if len(row) != 2:
+                raise Exception("Schema line %r is not a column name and a datatype" % row)
+            # fails on unknown names
+            tablestat.get_datatype_from_name(row[1])
+            schema[row[0]] = row[1]
+    return schema
+
+def get_sheet_state(ts, row_count, digest):
+    '''
+    Builds the state saved for a sheet after profiling it: the pickled
+    TableStat, the count of rows it covers and the digest of those rows,
+    to check the sheet was only appended to.
+    '''
+    return dict(stats=pickle.dumps(ts, pickle.HIGHEST_PROTOCOL), rows=row_count, hash=digest.hexdigest())
+
+def resume_sheet(state, header_skip, rows, digest):
+    '''
+    Checks a sheet against its saved state, adding its rows from the top
+    to digest up to the last row the state covers. If those rows are
+    unchanged, returns the saved TableStat and the count of rows it
+    covers, so profiling can go on from there. Otherwise returns None,
+    and the sheet must be profiled from scratch.
+    Reading the covered rows is still needed, as neither xls nor xlsx
+    files can be read from the middle, but analyzing them is not.
+    '''
+    if state is None or state["rows"] == 0 or state["rows"] < header_skip:
+        return None
+    row_count = 0
+    for row in rows:
+        digest.update(repr(row))
+        row_count += 1
+        if row_count == state["rows"]:
+            break
+    # the sheet shrank, or changed
+    if row_count < state["rows"] or digest.hexdigest() != state["hash"]:
+        return None
+    return (pickle.loads(state["stats"]), state["rows"])
+
+def print_sheet_report(ts, table, first_sheet, sheet_name, idx):
+    '''
+    Prints the report for one sheet, tabular or not, or as JSON Lines
+    when table is "json".
+    '''
+    if table == "json":
+        profile_output.print_json_lines(profile_output.get_sheet_records(ts, sheet_name, idx))
+        profile_output.print_json_lines(profile_output.get_pair_records(ts, sheet_name, idx))
+    elif table:
+        # emit header when the first sheet is found (a bit of a hack)
+        if first_sheet: ts.print_report_thead("Sheet name,Sheet index,")
+        ts.print_report_tbody("%s,%d," % (sheet_name, idx))
+    else:
+        print ("---Begin sheet: '%s' (index %d)---" % (sheet_name, idx))
+        ts.print_report()
+        print ("---End sheet: '%s' (index %d)---" % (sheet_name, idx))
+
+def get_stat_options(options):
+    '''
+    Returns the options that change the statistics, out of a dict of
+    profile_excel arguments, to key cached profiles and saved states by.
+    '''
+    left_out = report_options
+    if not options.get("sketch_top") and not options.get("distributions"):
+        left_out += read_options
+    return dict((k, v) for k, v in options.items() if k not in left_out)
+
+def profile_excel_cached(cache, file_name, **options):
+    '''
+    Profiles a file like profile_excel, but reprints the cached sheets
+    instead when the cache has the same file contents profiled with the
+    same options. New results are added to the cache.
+    '''
+    key = cache.get_key(file_name, get_stat_options(options))
+    sheets = cache.load(key)
+    if sheets is None:
+        sheets = []
+        profile_excel(file_name=file_name, sheets=sheets, **options)
+        cache.save(key, sheets)
+        return
+    for n, (sheet_name, idx, pickled) in enumerate(sheets):
+        print_sheet_report(pickle.loads(pickled), options["table"], n == 0, sheet_name, idx)
+    if len(sheets) == 0:
+        print("Failed to find sheet at index %d" % options["sheet_index"])
+
+def profile_excel_incremental(state_dir, file_name, **options):
+    '''
+    Profiles a file like profile_excel, resuming each sheet from the
+    state saved in state_dir by the last run on a file of the same name,
+    so a sheet that only had rows appended costs only its new rows.
+    The state is saved again for the next run.
+    '''
+    if options["header_skip"] == 0 and options["sheet_index"] is None:
+        # without headers the stats of a sheet go on to the next one
+        raise Exception("Incremental profiling needs a header row or a single sheet")
+    if options.get("sample_size") is not None or options.get("tolerance") is not None:
+        # the rows left out would never be profiled
+        raise Exception("Incremental profiling cannot resume a sample or an early stop")
+    state_name = "%s.%s.state" % (os.path.basename(file_name),
+                                  profile_cache.get_options_hash(get_stat_options(options)))
+    state_path = os.path.join(state_dir, state_name)
+    states = profile_cache.load_pickle(state_path)
+    if states is None:
+        states = {}
+    profile_excel(file_name=file_name, states=states, **options)
+    if not os.path.isdir(state_dir):
+        os.makedirs(state_dir)
+    profile_cache.save_pickle(state_path, states)
+
+def profile_excel_any(file_name, options, cache=None, state_dir=None):
+    '''
+    Profiles a file to stdout incrementally when given a state directory,
+    else through the cache when given a ProfileCache, else in full.
+    Options are a dict of the other profile_excel arguments.
+    '''
+    if state_dir is not None:
+        profile_excel_incremental(state_dir, file_name, **options)
+    elif cache is not None:
+        profile_excel_cached(cache, file_name, **options)
+    else:
+        profile_excel(file_name=file_name, **options)
+
+def profile_excel_file(job):
+    '''
+    Profiles one file with its report written to the named output file
+    instead of stdout. Takes a single tuple of the file name, output file
+    name, a dict of the other profile_excel arguments, a ProfileCache or
+    None and a state directory for incremental runs or None, so it can
+    run in a worker process.
+    Returns an error message, or None on success.
+    '''
+    (file_name, out_name, options, cache, state_dir) = job
+    saved_stdout = sys.stdout
+    try:
+        with open(out_name, 'w') as out_file:
+            sys.stdout = out_file
+            profile_excel_any(file_name, options, cache, state_dir)
+    except Exception as e:
+        # one bad workbook should not stop the whole batch,
+        # but don't leave a partial report behind
+        if os.path.exists(out_name):
+            os.remove(out_name)
+        return "%s: %s" % (file_name, e)
+    finally:
+        sys.stdout = saved_stdout
+    return None
+
+def find_excel_files(paths):
+    '''
+    Expands directories to the xls and xlsx files they contain.
+    Returns the files largest first, so big ones start early in a pool.
+    '''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, n) for n in sorted(os.listdir(path))
+                         if os.path.splitext(n)[1].lower() in (".xls", ".xlsx"))
+        else:
+            files.append(path)
+    # missing files sort last and fail in profile_excel_file
+    return sorted(files, key=lambda f: os.path.getsize(f) if os.path.isfile(f) else 0, reverse=True)
+
+def get_report_name(file_name, out_dir, table):
+    '''
+    Returns the name of the report of a file in out_dir: the file name
+    with .jsonl for JSON reports, else .csv.
+    '''
+    extension = ".jsonl" if table == "json" else ".csv"
+    return os.path.join(out_dir, os.path.splitext(os.path.basename(file_name))[0] + extension)
+
+def profile_excel_files(paths, out_dir, workers, cache=None, state_dir=None, **options):
+    '''
+    Profiles many files, or directories of files, using a pool of worker
+    processes. Each report goes to a CSV in out_dir named after the input
+    file, as script.sh used to arrange one process at a time, or to a
+    JSON Lines file for JSON reports.
+    With a ProfileCache, files profiled before are not read again.
+    With a state directory, sheets that grew are resumed from the last run.
+    Keyword options are passed on to profile_excel.
+    Returns the number of files that failed.
+    '''
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    jobs = [ (f, get_report_name(f, out_dir, options.get("table")), options, cache, state_dir)
+             for f in find_excel_files(paths) ]
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(profile_excel_file, jobs, chunksize=1)
+    else:
+        pool = None
+        results = (profile_excel_file(job) for job in jobs)
+    failures = 0
+    for error in results:
+        if error is not None:
+            print("Error: " + error, file=sys.stderr)
+            failures += 1
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return failures
+
+def run_profiles(args, out_dir, workers, cache, state_dir, options):
+    '''
+    Profiles the files and directories named on the command line.
+    Returns the count of files that failed.
+    '''
+    # a single file reports to stdout, unless told otherwise
+    if len(args) == 1 and out_dir is None and not os.path.isdir(args[0]):
+        profile_excel_any(args[0], options, cache, state_dir)
+        return 0
+    return profile_excel_files(args, out_dir if out_dir is not None else "stats",
+                               workers, cache, state_dir, **options)
+
 def usage():
     '''
     Prints a usage message and exits.
     '''
-    print('profile_excel.py [options] file.xls | file.xlsx')
+    print('profile_excel.py [options] file.xls | file.xlsx | directory ...')
     print('Options:')
+    print('   -a state directory, to profile only rows appended since the last run')
+    print('      (default none)')
+    print('   -b sample size, a row count or a fraction below 1 (default all rows)')
+    print('   -c cache directory, to skip files profiled before (default none)')
+    print('   -e sampling method, %s (default %s)' % (" or ".join(sampling.methods), sampling.methods[0]))
+    print('   -f fast path for columns settled on one type, with -r (default no)')
+    print('   -g sampling seed (default 0)')
     print('   -h header row skip count (default 1)')
+    print('   -i instrument the run, writing stage timings, rows per second, peak memory')
+    print('      and the slowest columns to a JSON file (default none)')
+    print('   -j worker process count for many files (default 1)')
+    print('   -k sketch distinct count and top-k values past the unique-limit (default off)')
+    print('   -l cache size limit in megabytes (default %d)' % cache_max_megabytes)
+    print('   -m moments and percentiles of numbers and dates (default no)')
+    print('   -n date cells as serial numbers (default date-time values)')
+    print('   -o output directory for per-file reports (default stdout')
+    print('      for a single file, otherwise stats)')
+    print('   -p cProfile statistics file, for pstats (default none)')
+    print('   -q early-stop tolerance, stopping a column once its density moves by no more')
+    print('      every %d rows (default off)' % tablestat.stop_check_rows)
+    print('   -r analyze one row at a time (default columnar)')
     print('   -s sheet-index (default all)')
     print('   -t tabular format report (default no)')
     print('   -u unique-limit (default 20)')
+    print('   -v pairs of columns: correlations, shared empties, keys and dependencies,')
+    print('      in tall and JSON Lines reports (default no)')
+    print('   -w JSON Lines report, one object per column (default no)')
+    print('   -x stream xlsx rows with flat memory use (default no)')
+    print('   -y schema file of column names and declared datatypes (default none)')
     sys.exit()
 
 def main(args):
@@ -85,28 +633,114 @@ def main(args):
     Parses command-line arguments and profiles the named file.
     '''
     try:
-        opts, args = getopt.getopt(args, "h:s:tu:")
+        opts, args = getopt.getopt(args, "a:b:c:e:fg:h:i:j:k:l:mno:p:q:rs:tu:vwxy:")
     except getopt.GetoptError:
         usage()
     # default values
     hskip = 1
     table = False
+    json_lines = False
     sheetidx = None
     umax = 20
+    columnar = True
+    streaming = False
+    sketch_top = 0
+    distributions = False
+    adaptive = False
+    schema = None
+    dates = True
+    workers = 1
+    out_dir = None
+    cache_dir = None
+    state_dir = None
+    cache_megabytes = cache_max_megabytes
+    summary_name = None
+    cprofile_name = None
+    sample_size = None
+    sample_method = sampling.methods[0]
+    sample_seed = 0
+    tolerance = None
+    pairs = False
     for opt, optarg in opts:
-        if opt in ("-h"):
+        if opt in ("-a"):
+            state_dir = optarg
+        elif opt in ("-b"):
+            sample_size = float(optarg)
+            if sample_size >= 1:
+                sample_size = int(sample_size)
+        elif opt in ("-c"):
+            cache_dir = optarg
+        elif opt in ("-e"):
+            if optarg not in sampling.methods:
+                usage()
+            sample_method = optarg
+        elif opt in ("-f"):
+            adaptive = True
+        elif opt in ("-g"):
+            sample_seed = int(optarg)
+        elif opt in ("-h"):
             hskip = int(optarg)
+        elif opt in ("-i"):
+            summary_name = optarg
+        elif opt in ("-j"):
+            workers = int(optarg)
+        elif opt in ("-k"):
+            sketch_top = int(optarg)
+        elif opt in ("-l"):
+            cache_megabytes = int(optarg)
+        elif opt in ("-m"):
+            distributions = True
+        elif opt in ("-n"):
+            dates = False
+        elif opt in ("-o"):
+            out_dir = optarg
+        elif opt in ("-p"):
+            cprofile_name = optarg
+        elif opt in ("-q"):
+            tolerance = float(optarg)
+        elif opt in ("-r"):
+            columnar = False
         elif opt in ("-s"):
             sheetidx = int(optarg)
         elif opt in ("-t"):
             table = True
         elif opt in ("-u"):
             umax = int(optarg)
+        elif opt in ("-v"):
+            pairs = True
+        elif opt in ("-w"):
+            json_lines = True
+        elif opt in ("-x"):
+            streaming = True
+        elif opt in ("-y"):
+            schema = read_schema(optarg)
         else:
             usage()
-    if len(args) != 1:
+    if json_lines:
+        table = "json"
+    if len(args) == 0 or (pairs and table is True) or (adaptive and columnar):
         usage()
-    profile_excel(hskip, table, umax, args[0], sheetidx)
+    options = dict(header_skip=hskip, table=table, unique_max=umax, sheet_index=sheetidx,
+                   columnar=columnar, streaming=streaming, sketch_top=sketch_top,
+                   distributions=distributions, schema=schema, adaptive=adaptive, dates=dates,
+                   sample_size=sample_size, sample_method=sample_method, sample_seed=sample_seed,
+                   tolerance=tolerance, pairs=pairs)
+    if summary_name is not None:
+        options["instrument"] = instrument.Instrument()
+        # worker processes would time themselves, unseen
+        workers = 1
+    cache = None
+    if cache_dir is not None:
+        cache = profile_cache.ProfileCache(cache_dir, cache_megabytes << 20)
+    if cprofile_name is not None:
+        failures = instrument.run_profiled(cprofile_name, run_profiles, args, out_dir, workers, cache,
+                                           state_dir, options)
+    else:
+        failures = run_profiles(args, out_dir, workers, cache, state_dir, options)
+    if summary_name is not None:
+        options["instrument"].write_summary(summary_name)
+    if failures > 0:
+        sys.exit(1)
 
 # Pass all params after program name to our main
 if __name__ == "__main__":
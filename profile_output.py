@@ -0,0 +1,256 @@
+'''
+Machine-readable profile output, one record per column of each sheet,
+as JSON Lines or as a compact columnar binary file.
+
+Records hold the fields of ColumnStat.get_report_record after the sheet
+name and index. Values stay plain: numbers as numbers, dates as ISO 8601
+strings, and unique values as a list of [value, count] pairs rather than
+the repr of a dict.
+
+The columnar file keeps each field of all the records together, so a
+dashboard can load thousands of profiles and read only the fields it
+needs. Arrow and Parquet have no writers for this Python, so it is a
+format of its own. All integers are little-endian:
+
+    magic       4 bytes, "TSPC"
+    version     uint16, 1
+    fields      uint16, count of fields
+    records     uint32, count of records
+    then for each field, in record order:
+      name      uint16 byte length, then the UTF-8 name
+      type      1 byte: "i" int64, "f" float64, "b" boolean as uint8,
+                "s" UTF-8 text, "j" JSON text of lists, dicts, or of
+                numbers mixed with text, e.g. percentiles of numbers
+                in some columns and of dates in others
+      nulls     (records + 7) / 8 bytes, a bit per record, set where the
+                value is null; the first record is the high bit of the
+                first byte, as numpy.packbits has it
+      values    "i" and "f": 8 bytes per record; "b": 1 byte per record;
+                "s" and "j": (records + 1) uint32 offsets into the bytes
+                that follow, then the bytes of all values
+Null values take the place of a zero or an empty text. Records missing
+a field, e.g. from sheets profiled with other options, have it null.
+'''
+
+# future must be first
+from __future__ import print_function
+import collections
+import datetime
+import getopt
+import json
+import struct
+import sys
+
+import numpy as np
+
+# Leading bytes and version of a columnar file
+columnar_magic = b"TSPC"
+columnar_version = 1
+
+def encode_value(value):
+    '''
+    Converts values json can't write: dates and times to ISO 8601.
+    '''
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError("Cannot write %r as JSON" % (value,))
+
+def get_sheet_records(ts, sheet_name, idx):
+    '''
+    Returns the records of a sheet's TableStat, led by the sheet name
+    and index.
+    '''
+    records = []
+    for column in ts.get_report_records():
+        record = collections.OrderedDict([ ("sheet_name", sheet_name), ("sheet_index", idx) ])
+        record.update(column)
+        records.append(record)
+    return records
+
+def get_pair_records(ts, sheet_name, idx):
+    '''
+    Returns the records of the pairs of columns of a sheet's TableStat,
+    led by the sheet name and index, or none if it has no pairs.
+    '''
+    if ts.pairs is None:
+        return []
+    records = []
+    for pair in ts.get_pairs().get_report_records(ts.get_column_names()):
+        record = collections.OrderedDict([ ("sheet_name", sheet_name), ("sheet_index", idx) ])
+        record.update(pair)
+        records.append(record)
+    return records
+
+def print_json_lines(records, out_file=None):
+    '''
+    Prints each record as a line of JSON, to stdout by default.
+    '''
+    for record in records:
+        print(json.dumps(record, default=encode_value), file=out_file)
+
+def read_json_lines(in_file):
+    '''
+    Reads records from lines of JSON, skipping blank lines.
+    Returns a list of ORDERED dicts.
+    '''
+    return [ json.loads(line, object_pairs_hook=collections.OrderedDict) for line in in_file if line.strip() ]
+
+def get_field_type(values):
+    '''
+    Chooses the narrowest columnar type that holds all the values of a
+    field, nulls aside.
+    '''
+    kinds = set(type(v) for v in values if v is not None)
+    if len(kinds) == 0:
+        return "s"
+    if any(issubclass(k, (list, tuple, dict)) for k in kinds):
+        return "j"
+    texts = [ issubclass(k, (basestring, datetime.date)) for k in kinds ]
+    if any(texts) and not all(texts):
+        # JSON keeps numbers apart from text
+        return "j"
+    if kinds == set([ bool ]):
+        return "b"
+    if all(issubclass(k, (int, long)) and not issubclass(k, bool) for k in kinds):
+        return "i"
+    if all(issubclass(k, (int, long, float)) and not issubclass(k, bool) for k in kinds):
+        return "f"
+    return "s"
+
+def to_text(value, field_type):
+    '''
+    Encodes a value of a text field as UTF-8.
+    '''
+    if field_type == "j":
+        value = json.dumps(value, default=encode_value)
+    elif isinstance(value, (datetime.datetime, datetime.date)):
+        value = value.isoformat()
+    elif not isinstance(value, basestring):
+        value = unicode(value)
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    return value
+
+def write_columnar(out_file, records):
+    '''
+    Writes records to a binary file object in the columnar format.
+    '''
+    # fields of all the records, in order of first appearance
+    names = []
+    seen = set()
+    for record in records:
+        for name in record:
+            if name not in seen:
+                seen.add(name)
+                names.append(name)
+    count = len(records)
+    out_file.write(columnar_magic)
+    out_file.write(struct.pack("<HHI", columnar_version, len(names), count))
+    for name in names:
+        values = [ record.get(name) for record in records ]
+        field_type = get_field_type(values)
+        encoded = name.encode("utf-8")
+        out_file.write(struct.pack("<H", len(encoded)) + encoded + field_type)
+        nulls = np.array([ v is None for v in values ], dtype=bool)
+        out_file.write(np.packbits(nulls).tobytes())
+        if field_type in ("i", "f", "b"):
+            dtype = { "i": "<i8", "f": "<f8", "b": "u1" }[field_type]
+            out_file.write(np.array([ v if v is not None else 0 for v in values ], dtype=dtype).tobytes())
+        else:
+            texts = [ to_text(v, field_type) if v is not None else b"" for v in values ]
+            offsets = np.zeros(count + 1, dtype="<u4")
+            np.cumsum([ len(t) for t in texts ], out=offsets[1:])
+            out_file.write(offsets.tobytes())
+            out_file.write(b"".join(texts))
+
+def read_exactly(in_file, size):
+    '''
+    Reads exactly size bytes from a file object.
+    '''
+    data = in_file.read(size)
+    if len(data) != size:
+        raise Exception("Columnar file ends early")
+    return data
+
+def read_columnar(in_file):
+    '''
+    Reads a binary file object in the columnar format.
+    Returns an ORDERED dict of field names to lists of values, None
+    where null; JSON fields are parsed, dates stay ISO 8601 text.
+    '''
+    if read_exactly(in_file, 4) != columnar_magic:
+        raise Exception("Not a columnar profile file")
+    version, field_count, count = struct.unpack("<HHI", read_exactly(in_file, 8))
+    if version != columnar_version:
+        raise Exception("Unknown columnar profile version %d" % version)
+    fields = collections.OrderedDict()
+    for i in xrange(field_count):
+        (length,) = struct.unpack("<H", read_exactly(in_file, 2))
+        name = read_exactly(in_file, length).decode("utf-8")
+        field_type = read_exactly(in_file, 1)
+        nulls = np.unpackbits(np.frombuffer(read_exactly(in_file, (count + 7) // 8), dtype=np.uint8))[:count]
+        if field_type in ("i", "f", "b"):
+            dtype = { "i": "<i8", "f": "<f8", "b": "u1" }[field_type]
+            size = np.dtype(dtype).itemsize
+            values = np.frombuffer(read_exactly(in_file, count * size), dtype=dtype).tolist()
+            if field_type == "b":
+                values = [ bool(v) for v in values ]
+        elif field_type in ("s", "j"):
+            offsets = np.frombuffer(read_exactly(in_file, (count + 1) * 4), dtype="<u4").tolist()
+            data = read_exactly(in_file, offsets[-1])
+            values = [ data[offsets[r]:offsets[r + 1]].decode("utf-8") for r in xrange(count) ]
+            if field_type == "j":
+                values = [ json.loads(v) if not nulls[r] else None for r, v in enumerate(values) ]
+        else:
+            raise Exception("Unknown columnar field type %r" % field_type)
+        fields[name] = [ v if not nulls[r] else None for r, v in enumerate(values) ]
+    return fields
+
+def usage():
+    '''
+    Prints a usage message and exits.
+    '''
+    print('profile_output.py [options] file.jsonl ... | -r file.tspc')
+    print('Options:')
+    print('   -o columnar output file, to combine JSON Lines reports (default profiles.tspc)')
+    print('   -r print a columnar file as JSON Lines')
+    sys.exit()
+
+def main(args):
+    '''
+    Parses command-line arguments and combines JSON Lines reports into
+    one columnar file, or prints a columnar file back as JSON Lines.
+    '''
+    try:
+        opts, args = getopt.getopt(args, "o:r")
+    except getopt.GetoptError:
+        usage()
+    # default values
+    out_name = "profiles.tspc"
+    read = False
+    for opt, optarg in opts:
+        if opt in ("-o"):
+            out_name = optarg
+        elif opt in ("-r"):
+            read = True
+        else:
+            usage()
+    if len(args) == 0 or (read and len(args) != 1):
+        usage()
+    if read:
+        with open(args[0], "rb") as in_file:
+            fields = read_columnar(in_file)
+        names = fields.keys()
+        print_json_lines(collections.OrderedDict((n, fields[n][r]) for n in names)
+                         for r in xrange(len(fields[names[0]]) if names else 0))
+        return
+    records = []
+    for name in args:
+        with open(name, "r") as in_file:
+            records.extend(read_json_lines(in_file))
+    with open(out_name, "wb") as out_file:
+        write_columnar(out_file, records)
+
+# Pass all params after program name to our main
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,657 @@
+# future must be first
+from __future__ import print_function
+
+import collections
+import csv
+import getopt
+import heapq
+import json
+import multiprocessing
+import os
+import Queue
+import signal
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import timeit
+
+import dir_watch
+import pipeline
+import profile_cache
+import profile_excel
+import transform
+
+'''
+A long-running profiling service, so files are profiled as they come
+instead of one script.sh run at a time. Its worker processes start
+once and stay up, with numpy, xlrd and the profiling modules loaded,
+so a job costs only the profiling itself.
+
+Jobs come from a spool directory, such as Input/, watched for new or
+changed xls and xlsx files, or from clients over a local socket, as one
+JSON object a line. Queued files are profiled smallest first, no more
+at a time than there are workers, so a small file dropped behind big
+ones is not held up by them. Once the queue is full, taking more jobs
+waits for room. Each report is written by
+profile_excel.profile_excel_file, as profile_excel.py -o writes it, to
+a file named after the input in the output directory, and optionally
+flattened to its feature row as pipeline.py does, as soon as the file
+is done. For example, to profile what lands in Input/ as script.sh
+would, without waiting for the whole batch:
+
+    python profile_service.py -d Input -o stats -f transform -p 1
+'''
+
+# Seconds a spooled file must go unchanged before it is queued, so it
+# is not read half written
+settle_seconds = 0.2
+
+# Default count of jobs queued before taking more waits
+queue_max_jobs = 100
+
+# Default seconds a job may run before it is failed, as a worker that
+# died never reports back
+job_max_seconds = 3600
+
+# Seconds between checks of the jobs in the workers
+check_seconds = 1.0
+
+def init_worker():
+    '''
+    Runs in each worker process as it starts. Interrupts are left to
+    the service, which stops its workers itself.
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def run_job(job):
+    '''
+    Runs in a worker process. Profiles a file as
+    profile_excel.profile_excel_file does, but returns the error of
+    anything that stops it, so the service always hears back unless the
+    worker dies.
+    '''
+    try:
+        return profile_excel.profile_excel_file(job)
+    except BaseException as e:
+        return "%s: %r" % (job[0], e)
+
+def get_file_size(file_name):
+    '''
+    Returns the size of a file, or 0 if it is missing, so it fails fast
+    in profile_excel_file.
+    '''
+    return os.path.getsize(file_name) if os.path.isfile(file_name) else 0
+
+def get_result(file_name, report_name, error, seconds, row_name=None):
+    '''
+    Returns the result of a job as an ORDERED dict.
+    '''
+    return collections.OrderedDict([ ("file", file_name), ("report", report_name if error is None else None),
+                                      ("features", row_name if error is None else None),
+                                      ("error", error), ("seconds", seconds) ])
+
+def write_feature_row(report_name, transform_dir, prof):
+    '''
+    Flattens a tabular report to its feature row, labeled with the
+    profile prof, as pipeline.py does. Writes it to transform_dir, named
+    as script.sh named it.
+    Returns the name of the file written.
+    '''
+    base_name = os.path.splitext(os.path.basename(report_name))[0]
+    with open(report_name, "r") as in_file:
+        lines = transform.transform(csv.reader(in_file), prof)
+    row_name = os.path.join(transform_dir, base_name + "Transformed.csv")
+    with open(row_name, "w") as out_file:
+        for line in lines:
+            print(line, file=out_file)
+    return row_name
+
+def print_result(result):
+    '''
+    Logs the result of a job, errors to stderr.
+    '''
+    if result["error"] is not None:
+        print("Error: " + result["error"], file=sys.stderr)
+    elif result["features"] is not None:
+        print("%s -> %s, %s in %.3fs" % (result["file"], result["report"], result["features"], result["seconds"]))
+    else:
+        print("%s -> %s in %.3fs" % (result["file"], result["report"], result["seconds"]))
+    sys.stdout.flush()
+
+# Inherits only from object
+class ProfileService(object):
+    '''
+    Queues files to profile and hands them to a pool of warm worker
+    processes, smallest file first. With a transform directory, each
+    report is also flattened to its feature row there. A job still
+    running after max_seconds is failed and its worker taken for dead,
+    so the worker's place goes to the next job.
+
+    Useful attributes:
+        out_dir (directory of reports)
+        workers (count of worker processes)
+        options (dict of profile_excel arguments for every job)
+        queue (heap of jobs waiting, smallest file first)
+        max_queued (count of jobs queued before submit waits, or None)
+        running (dict of job counts to (AsyncResult, time started, file
+            name, function finishing the job) of the jobs in the workers)
+        lost (count of jobs failed for running too long)
+    '''
+
+    def __init__(self, out_dir, workers, options, cache=None, max_queued=queue_max_jobs, transform_dir=None,
+                 prof="1", max_seconds=job_max_seconds):
+        for dir_name in (out_dir, transform_dir):
+            if dir_name is not None and not os.path.isdir(dir_name):
+                os.makedirs(dir_name)
+        if transform_dir is not None and options.get("table") is not True:
+            raise Exception("Feature rows need tabular reports")
+        self.out_dir = out_dir
+        self.workers = workers
+        self.options = options
+        self.cache = cache
+        self.max_queued = max_queued
+        self.transform_dir = transform_dir
+        self.prof = prof
+        self.max_seconds = max_seconds
+        # before any thread starts, as a fork copies only the thread forking
+        self.pool = multiprocessing.Pool(workers, init_worker)
+        self.condition = threading.Condition()
+        self.queue = []
+        # count of jobs queued so far, to keep jobs of a size in order
+        self.count = 0
+        self.running = {}
+        self.lost = 0
+        self.stopped = False
+        self.dispatcher = threading.Thread(target=self.dispatch)
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+        self.checker = threading.Thread(target=self.check)
+        self.checker.daemon = True
+        self.checker.start()
+
+    def get_report_name(self, file_name, options=None):
+        '''
+        Returns the name of the report of a file.
+        '''
+        table = (options or self.options).get("table")
+        return profile_excel.get_report_name(file_name, self.out_dir, table)
+
+    def submit(self, file_name, options=None, callback=None):
+        '''
+        Queues a file to profile. Options replace those of the service
+        for this job. The callback, if any, is called with the result
+        when the job is done, from a thread of the service.
+        Waits while the queue is full.
+        Returns the name of the report.
+        '''
+        job_options = dict(self.options)
+        if options:
+            unknown = [ k for k in options if k not in job_options ]
+            if unknown:
+                raise Exception("Unknown profile options %s" % ", ".join(sorted(unknown)))
+            job_options.update(options)
+        report_name = self.get_report_name(file_name, job_options)
+        with self.condition:
+            while not self.stopped and self.max_queued is not None and len(self.queue) >= self.max_queued:
+                self.condition.wait()
+            if self.stopped:
+                raise Exception("The service is stopped")
+            heapq.heappush(self.queue, (get_file_size(file_name), self.count, file_name, report_name, job_options,
+                                        callback, timeit.default_timer()))
+            self.count += 1
+            self.condition.notify_all()
+        return report_name
+
+    def dispatch(self):
+        '''
+        Hands queued jobs to the workers, smallest file first and one
+        per free worker, so the order is settled as late as can be.
+        '''
+        while True:
+            with self.condition:
+                while not self.stopped and (len(self.queue) == 0 or len(self.running) >= self.workers):
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                size, count, file_name, report_name, options, callback, queued = heapq.heappop(self.queue)
+                # held before the job starts, as it may finish at once
+                self.running[count] = None
+                # room for a job waiting to be queued
+                self.condition.notify_all()
+            job = (file_name, report_name, options, self.cache, None)
+            finish = self.get_finish(count, file_name, report_name, callback, queued)
+            result = self.pool.apply_async(run_job, (job,), callback=finish)
+            with self.condition:
+                if count in self.running:
+                    self.running[count] = (result, timeit.default_timer(), file_name, finish)
+
+    def check(self):
+        '''
+        Fails the jobs that ended without a result, or that have run for
+        more than max_seconds, freeing their places in the workers.
+        Runs until the service is stopped and no jobs are left.
+        '''
+        while True:
+            with self.condition:
+                if self.stopped and len(self.running) == 0:
+                    return
+                self.condition.wait(check_seconds)
+                now = timeit.default_timer()
+                jobs = [ job for job in self.running.values()
+                         if job is not None and (job[0].ready() or now - job[1] > self.max_seconds) ]
+            for result, started, file_name, finish in jobs:
+                if result.ready():
+                    try:
+                        error = result.get()
+                    except Exception as e:
+                        error = "%s: %s" % (file_name, e)
+                    finish(error)
+                elif finish("%s: no result in %d seconds, the worker may have died" % (file_name, self.max_seconds)):
+                    with self.condition:
+                        self.lost += 1
+
+    def get_finish(self, count, file_name, report_name, callback, queued):
+        '''
+        Returns the function called with the error, or None, of a job
+        once a worker is done with it, or it is given up on. Only the
+        first call finishes the job; it returns True and later ones
+        False.
+        '''
+        def finish(error):
+            with self.condition:
+                if count not in self.running:
+                    return False
+                del self.running[count]
+                self.condition.notify_all()
+            row_name = None
+            if error is None and self.transform_dir is not None:
+                try:
+                    row_name = write_feature_row(report_name, self.transform_dir, self.prof)
+                except Exception as e:
+                    error = "%s: %s" % (file_name, e)
+            result = get_result(file_name, report_name, error, timeit.default_timer() - queued, row_name)
+            print_result(result)
+            if callback is not None:
+                callback(result)
+            return True
+        return finish
+
+    def stop(self):
+        '''
+        Stops taking jobs, fails the jobs still queued and waits for the
+        workers to finish those they have, or for them to be failed.
+        '''
+        with self.condition:
+            self.stopped = True
+            dropped = self.queue
+            self.queue = []
+            self.condition.notify_all()
+        for size, count, file_name, report_name, options, callback, queued in dropped:
+            if callback is not None:
+                callback(get_result(file_name, report_name, "%s: the service stopped" % file_name, 0.0))
+        self.checker.join()
+        if self.lost > 0:
+            # the pool would wait forever for the results of lost jobs
+            self.pool.terminate()
+        else:
+            self.pool.close()
+        self.pool.join()
+
+# Inherits only from object
+class SpoolWatcher(object):
+    '''
+    Watches a directory for xls and xlsx files and queues those that are
+    new or changed once they have gone settle seconds without changing.
+    Files whose report is newer than they are were profiled before the
+    service started, and are not queued again. While the queue of the
+    service is full the watcher waits, and changes pile up in the watch
+    until it catches up.
+
+    Useful attributes:
+        spool_dir (directory watched)
+        pending (dict of file names to (time due, (size, modified time)))
+        done (dict of file names to (size, modified time) when queued)
+    '''
+
+    def __init__(self, service, spool_dir, settle=settle_seconds):
+        if not os.path.isdir(spool_dir):
+            raise Exception("Spool directory %s not found" % spool_dir)
+        self.service = service
+        self.spool_dir = spool_dir
+        self.settle = settle
+        self.pending = {}
+        self.done = {}
+        self.stopped = threading.Event()
+        self.watch = dir_watch.open_watch(spool_dir)
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stops watching, once a file being queued is queued or refused.
+        '''
+        self.stopped.set()
+        self.thread.join()
+        self.watch.close()
+
+    def run(self):
+        '''
+        Watches until stopped. Every file is looked at first, as are all
+        files again when the watch lost track of changes.
+        '''
+        names = None
+        while not self.stopped.is_set():
+            try:
+                if names is None:
+                    names = os.listdir(self.spool_dir)
+                self.add_changes(names)
+                self.queue_settled()
+                names = self.watch.wait(self.settle)
+            except Exception as e:
+                if self.stopped.is_set():
+                    # the service stopped while a file was being queued
+                    break
+                print("Error: %s: %s" % (self.spool_dir, e), file=sys.stderr)
+                self.stopped.wait(self.settle)
+                names = None
+
+    def add_changes(self, names):
+        '''
+        Puts off queueing changed files until they settle.
+        '''
+        due = timeit.default_timer() + self.settle
+        for name in names:
+            # Excel lock files and hidden files
+            if name.startswith(("~$", ".")) or os.path.splitext(name)[1].lower() not in (".xls", ".xlsx"):
+                continue
+            file_name = os.path.join(self.spool_dir, name)
+            state = self.get_state(file_name)
+            if state is None:
+                # a file removed and dropped again is profiled again
+                self.pending.pop(file_name, None)
+                self.done.pop(file_name, None)
+            else:
+                self.pending[file_name] = (due, state)
+
+    def queue_settled(self):
+        '''
+        Queues the files due, unless they changed since last seen, which
+        puts them off again, or are profiled as they are.
+        '''
+        now = timeit.default_timer()
+        for file_name, (due, state) in sorted(self.pending.items()):
+            if due > now or self.stopped.is_set():
+                continue
+            current = self.get_state(file_name)
+            if current != state:
+                if current is None:
+                    del self.pending[file_name]
+                else:
+                    self.pending[file_name] = (now + self.settle, current)
+                continue
+            del self.pending[file_name]
+            if file_name not in self.done and self.is_reported(file_name, state[1]):
+                self.done[file_name] = state
+            if self.done.get(file_name) != state:
+                self.service.submit(file_name)
+                self.done[file_name] = state
+
+    def get_state(self, file_name):
+        '''
+        Returns the size and modified time of a file, or None if it is
+        gone.
+        '''
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime)
+
+    def is_reported(self, file_name, modified):
+        '''
+        Returns True if a file has a report written since it changed.
+        '''
+        report_name = self.service.get_report_name(file_name)
+        return os.path.isfile(report_name) and os.path.getmtime(report_name) >= modified
+
+class JobHandler(SocketServer.StreamRequestHandler):
+    '''
+    Takes the jobs of a client, one JSON object a line such as
+    {"file": "/data/Input/a.xlsx", "options": {"table": true}}, until
+    the client shuts its side. Queues them all, then writes back the
+    result of each as a JSON object a line, as each is done.
+    '''
+
+    def handle(self):
+        results = Queue.Queue()
+        count = 0
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            count += 1
+            file_name = None
+            try:
+                request = json.loads(line)
+                file_name = request["file"]
+                self.server.service.submit(file_name, request.get("options"), results.put)
+            except Exception as e:
+                results.put(get_result(file_name, None, "%s: %s" % (file_name, e), 0.0))
+        for i in xrange(count):
+            self.wfile.write(json.dumps(results.get()) + "\n")
+            self.wfile.flush()
+
+class JobServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    '''
+    Takes jobs over a Unix socket, a thread per client.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, socket_name, service):
+        if os.path.exists(socket_name):
+            if is_listening(socket_name):
+                raise Exception("A service is already listening on %s" % socket_name)
+            # left behind by a service that did not stop cleanly
+            os.remove(socket_name)
+        SocketServer.UnixStreamServer.__init__(self, socket_name, JobHandler)
+        self.service = service
+
+def is_listening(socket_name):
+    '''
+    Returns True if a service takes connections on the socket.
+    '''
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_name)
+        return True
+    except socket.error:
+        return False
+    finally:
+        client.close()
+
+def submit_files(socket_name, paths, options=None):
+    '''
+    Sends the files, and the xls and xlsx files of directories, to the
+    service on the socket. Paths are sent in full, as the service may
+    run in another directory.
+    Generates the result of each as an ORDERED dict, as each is done.
+    '''
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_name)
+    try:
+        for file_name in profile_excel.find_excel_files(paths):
+            request = collections.OrderedDict([ ("file", os.path.abspath(file_name)) ])
+            if options:
+                request["options"] = options
+            client.sendall(json.dumps(request) + "\n")
+        client.shutdown(socket.SHUT_WR)
+        for line in client.makefile("r"):
+            yield json.loads(line, object_pairs_hook=collections.OrderedDict)
+    finally:
+        client.close()
+
+def serve(service, spool_dir=None, socket_name=None):
+    '''
+    Runs the service until interrupted or terminated, watching the spool
+    directory and taking jobs on the socket, either or both.
+    '''
+    watcher = None
+    server = None
+    # terminate stops as cleanly as an interrupt
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        if spool_dir is not None:
+            watcher = SpoolWatcher(service, spool_dir)
+            watcher.start()
+            print("Watching %s" % spool_dir)
+        if socket_name is not None:
+            server = JobServer(socket_name, service)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            print("Listening on %s" % socket_name)
+        sys.stdout.flush()
+        # sleeps in steps, as a wait without timeout can't be interrupted
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if watcher is not None:
+            watcher.stopped.set()
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            os.remove(socket_name)
+        # refuses the files still being queued, so the watcher can stop
+        service.stop()
+        if watcher is not None:
+            watcher.stop()
+
+def usage():
+    '''
+    Prints a usage message and exits.
+    '''
+    print('profile_service.py [options] -d directory | -s socket')
+    print('profile_service.py -r -s socket file.xls | file.xlsx | directory ...')
+    print('Options:')
+    print('   -c cache directory, to skip files profiled before (default none)')
+    print('   -d spool directory to watch for xls and xlsx files, like Input (default none)')
+    print('   -f directory to write the feature row of each report to, profiling as')
+    print('      pipeline.py does (default none)')
+    print('   -h header row skip count (default 1)')
+    print('   -j worker process count (default %d)' % multiprocessing.cpu_count())
+    print('   -k sketch distinct count and top-k values past the unique-limit (default off)')
+    print('   -l cache size limit in megabytes (default %d)' % profile_excel.cache_max_megabytes)
+    print('   -m seconds a job may run before it is failed (default %d)' % job_max_seconds)
+    print('   -o output directory for per-file reports (default stats)')
+    print('   -p profile label of the feature rows, 1-2 for regular-unregular (default 1)')
+    print('   -q count of jobs queued before taking more waits (default %d)' % queue_max_jobs)
+    print('   -r submit the files and directories named to the service on the socket')
+    print('      and print the results (default serve)')
+    print('   -s socket to take jobs on, or to submit them to (default none)')
+    print('   -t tabular format report (default no)')
+    print('   -u unique-limit (default 20)')
+    print('   -w JSON Lines report, one object per column (default no)')
+    print('   -x stream xlsx rows with flat memory use (default no)')
+    sys.exit()
+
+def main(args):
+    '''
+    Parses command-line arguments and runs the service, or submits files
+    to it.
+    '''
+    try:
+        opts, args = getopt.getopt(args, "c:d:f:h:j:k:l:m:o:p:q:rs:tu:wx")
+    except getopt.GetoptError:
+        usage()
+    # default values
+    cache_dir = None
+    cache_megabytes = profile_excel.cache_max_megabytes
+    spool_dir = None
+    transform_dir = None
+    hskip = 1
+    workers = multiprocessing.cpu_count()
+    sketch_top = 0
+    out_dir = "stats"
+    prof = "1"
+    max_queued = queue_max_jobs
+    max_seconds = job_max_seconds
+    remote = False
+    socket_name = None
+    table = False
+    json_lines = False
+    umax = 20
+    streaming = False
+    for opt, optarg in opts:
+        if opt in ("-c"):
+            cache_dir = optarg
+        elif opt in ("-d"):
+            spool_dir = optarg
+        elif opt in ("-f"):
+            transform_dir = optarg
+        elif opt in ("-h"):
+            hskip = int(optarg)
+        elif opt in ("-j"):
+            workers = int(optarg)
+        elif opt in ("-k"):
+            sketch_top = int(optarg)
+        elif opt in ("-l"):
+            cache_megabytes = int(optarg)
+        elif opt in ("-m"):
+            max_seconds = float(optarg)
+        elif opt in ("-o"):
+            out_dir = optarg
+        elif opt in ("-p"):
+            prof = optarg
+        elif opt in ("-q"):
+            max_queued = int(optarg)
+        elif opt in ("-r"):
+            remote = True
+        elif opt in ("-s"):
+            socket_name = optarg
+        elif opt in ("-t"):
+            table = True
+        elif opt in ("-u"):
+            umax = int(optarg)
+        elif opt in ("-w"):
+            json_lines = True
+        elif opt in ("-x"):
+            streaming = True
+        else:
+            usage()
+    if json_lines:
+        table = "json"
+    if remote:
+        if socket_name is None or len(args) == 0:
+            usage()
+        failures = 0
+        for result in submit_files(socket_name, args):
+            print_result(result)
+            if result["error"] is not None:
+                failures += 1
+        if failures > 0:
+            sys.exit(1)
+        return
+    if (spool_dir is None and socket_name is None) or len(args) > 0 or workers < 1 or max_queued < 1:
+        usage()
+    if transform_dir is not None:
+        # feature rows like those script.sh always made
+        options = dict(pipeline.profile_options)
+    else:
+        options = dict(header_skip=hskip, table=table, unique_max=umax, sheet_index=None,
+                       columnar=True, streaming=streaming, sketch_top=sketch_top)
+    cache = None
+    if cache_dir is not None:
+        cache = profile_cache.ProfileCache(cache_dir, cache_megabytes << 20)
+    serve(ProfileService(out_dir, workers, options, cache, max_queued, transform_dir, prof, max_seconds),
+          spool_dir, socket_name)
+
+# Pass all params after program name to our main
+if __name__ == "__main__":
+    main(sys.argv[1:])
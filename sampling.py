@@ -0,0 +1,153 @@
+'''
+Row samplers, for quick previews of large sheets.
+
+A sampler is offered the rows of a sheet one at a time, in order.
+Systematic sampling keeps every n-th row from a random start, and can
+say at once whether a row is kept, so kept rows are analyzed as they
+come. Reservoir sampling keeps a uniform random sample of a set number
+of rows from a stream of unknown length, which is only settled at the
+end, so the kept rows are held until then.
+
+Both are seeded, so the same seed picks the same rows of the same sheet
+whether it is read with xlrd or streamed.
+'''
+
+# future must be first
+from __future__ import print_function
+import math
+import random
+
+# Sampling methods, the first is the default
+methods = [ "reservoir", "systematic" ]
+
+# Inherits only from object
+class Reservoir(object):
+    '''
+    Keeps a uniform random sample of size items. Uses Li's Algorithm L,
+    which draws how many items to pass over before the next one kept,
+    so passing over an item costs only a comparison.
+
+    Useful attributes:
+        size (count of items kept)
+        count (count of items offered)
+        items (list of (index, item) tuples kept, in no order)
+    '''
+
+    def __init__(self, size, seed=0):
+        if size < 1:
+            raise Exception("Reservoir size must be positive but is %d" % size)
+        self.size = size
+        self.random = random.Random(seed)
+        self.count = 0
+        self.items = []
+        self.weight = math.exp(math.log(self.get_uniform()) / size)
+        # index of the next item kept once the reservoir is full
+        self.next = size + self.get_skip()
+
+    def get_uniform(self):
+        '''
+        Draws a number between 0 and 1, both excluded.
+        '''
+        u = self.random.random()
+        while u == 0.0:
+            u = self.random.random()
+        return u
+
+    def get_skip(self):
+        '''
+        Draws the count of items passed over before the next one kept.
+        '''
+        if self.weight >= 1.0:
+            return 0
+        return int(math.floor(math.log(self.get_uniform()) / math.log1p(-self.weight)))
+
+    def offer(self, item):
+        '''
+        Offers the next item, which may be kept until the end.
+        Returns False, as no item is in the sample for good until then.
+        '''
+        index = self.count
+        self.count += 1
+        if index < self.size:
+            self.items.append((index, item))
+        elif index == self.next:
+            self.items[self.random.randrange(self.size)] = (index, item)
+            self.weight *= math.exp(math.log(self.get_uniform()) / self.size)
+            self.next += self.get_skip() + 1
+        return False
+
+    def get_items(self):
+        '''
+        Returns the ORDERED list of items kept, in the order offered.
+        '''
+        return [ item for index, item in sorted(self.items, key=lambda pair: pair[0]) ]
+
+# Inherits only from object
+class Systematic(object):
+    '''
+    Keeps every step-th item from a random start below step. The step
+    may be fractional, to keep a set number of items out of a known
+    count; it is at least 1, which keeps every item.
+
+    Useful attributes:
+        step (float)
+        count (count of items offered)
+    '''
+
+    def __init__(self, step, seed=0):
+        self.step = max(float(step), 1.0)
+        self.count = 0
+        # position of the next item kept
+        self.next = random.Random(seed).random() * self.step
+
+    def offer(self, item):
+        '''
+        Offers the next item. Returns True if it is kept.
+        '''
+        index = self.count
+        self.count += 1
+        if index < int(self.next):
+            return False
+        self.next += self.step
+        return True
+
+    def get_items(self):
+        '''
+        Returns the items held until the end, none as all kept items
+        were taken when offered.
+        '''
+        return []
+
+def new_sampler(method, size, seed=0, count=None):
+    '''
+    Returns a sampler of the named method for a sample of size items,
+    or of a fraction of the items if size is below 1. Count is the
+    number of items to be offered, or None if unknown until the end;
+    a reservoir needs it for a fraction, and systematic sampling for a
+    number of items.
+    '''
+    if size <= 0:
+        raise Exception("Sample size must be positive but is %s" % size)
+    if method == "reservoir":
+        if size < 1:
+            if count is None:
+                raise Exception("Reservoir sampling of a fraction needs the row count, give a row count instead")
+            size = max(1, int(math.ceil(size * count)))
+        return Reservoir(int(size), seed)
+    if method == "systematic":
+        if size >= 1:
+            if count is None:
+                raise Exception("Systematic sampling of a row count needs the rows in the sheet, give a fraction instead")
+            step = count / float(size)
+        else:
+            step = 1.0 / size
+        return Systematic(step, seed)
+    raise Exception("Unknown sampling method %s, expected one of %s" % (method, ", ".join(methods)))
+
+def sample_indexes(sampler, count):
+    '''
+    Offers the indexes 0 to count - 1 to a sampler.
+    Returns the ORDERED list of indexes kept.
+    '''
+    kept = [ i for i in xrange(count) if sampler.offer(i) ]
+    return sorted(kept + sampler.get_items())
@@ -0,0 +1,484 @@
+'''
+Fixed-size summaries of a stream of values, used by ColumnStat.
+
+HyperLogLog estimates the number of distinct values; SpaceSaving keeps
+the most frequent values with bounds on their counts. They take over
+once a column has more unique values than its freqs dict may hold.
+
+Distribution keeps the mean, variance, skew (Moments) and approximate
+quantiles (KLL) of numbers, for numeric and date columns.
+
+All accept values one at a time or as a NumPy array, and all can merge
+with another summary of the same size.
+'''
+
+# future must be first
+from __future__ import print_function
+import heapq
+import itertools
+import math
+
+import numpy as np
+
+mask64 = (1 << 64) - 1
+
+# Element-wise builtins for object arrays; these loop in C, not Python.
+get_hashes = np.frompyfunc(hash, 1, 1)
+get_item = np.frompyfunc(dict.__getitem__, 2, 1)
+
+def mix64(h):
+    '''
+    Spreads the bits of a python hash over 64 bits (splitmix64 finalizer).
+    Small integers hash to themselves, which HyperLogLog cannot use as is.
+    '''
+    h &= mask64
+    h = ((h ^ (h >> 30)) * 0xbf58476d1ce4e5b9) & mask64
+    h = ((h ^ (h >> 27)) * 0x94d049bb133111eb) & mask64
+    return h ^ (h >> 31)
+
+def mix64_array(data):
+    '''
+    Same as mix64 for every value of an object array, as uint64.
+    Equal values hash equal, e.g. 1 and 1.0, just like dict keys.
+    '''
+    h = get_hashes(data).astype(np.int64).view(np.uint64)
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return h ^ (h >> np.uint64(31))
+
+def count_values(data):
+    '''
+    Counts the unique values of an object array.
+    Returns an object array of the values, in order of first appearance,
+    and an array of their counts.
+    '''
+    count = len(data)
+    # Map each value to the row of its first appearance; the dict is
+    # filled back to front so earlier rows overwrite later ones.
+    first = dict(itertools.izip(data[::-1], xrange(count - 1, -1, -1)))
+    rows, counts = np.unique(get_item(first, data).astype(np.int64), return_counts=True)
+    return data[rows], counts
+
+# Inherits only from object
+class HyperLogLog(object):
+    '''
+    Estimates the number of distinct values seen, using 2^precision
+    one-byte registers. The relative standard error is about
+    1.04 / sqrt(2^precision), i.e. 1.6% for the default of 12.
+    '''
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = np.zeros(self.size, dtype=np.uint8)
+
+    def add(self, value):
+        '''
+        Adds one value.
+        '''
+        h = mix64(hash(value))
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        # position of the leftmost 1-bit in the remaining bits
+        rank = 64 - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def add_values(self, data):
+        '''
+        Adds every value of an object array.
+        '''
+        if len(data) == 0:
+            return
+        self.add_hashes(mix64_array(data))
+
+    def add_hashes(self, h):
+        '''
+        Adds values by their mix64 hashes, as a uint64 array.
+        '''
+        index = (h >> np.uint64(64 - self.precision)).astype(np.intp)
+        rest = h & np.uint64((1 << (64 - self.precision)) - 1)
+        # frexp gives the bit length; exact since rest fits in a double
+        rank = 64 - self.precision - np.frexp(rest.astype(np.float64))[1] + 1
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def merge(self, other):
+        '''
+        Combines another HyperLogLog of the same precision into this one.
+        '''
+        if self.precision != other.precision:
+            raise Exception("Cannot merge HyperLogLog precisions %d and %d" % (self.precision, other.precision))
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        '''
+        Returns the estimated count of distinct values.
+        '''
+        m = float(self.size)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int32)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        # Small counts are better estimated by linear counting
+        if raw <= 2.5 * m and zeros > 0:
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+    def std_error(self):
+        '''
+        Returns one standard error of the estimate, as a count.
+        '''
+        return int(round(self.estimate() * 1.04 / math.sqrt(self.size)))
+
+# Inherits only from object
+class SpaceSaving(object):
+    '''
+    Keeps the most frequent values seen using a fixed number of counters.
+    Each count may overstate the true frequency by at most its error;
+    any value more frequent than total / size is guaranteed a counter.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        # counts and errors by value, at most size of each
+        self.counts = {}
+        self.errors = {}
+        # (count, order, value) per counter, least first; a count may lag
+        # behind counts, and order breaks ties without comparing values
+        self.heap = []
+        self.order = 0
+
+    def get_floor(self):
+        '''
+        Returns the most a value without a counter can have been seen.
+        '''
+        if len(self.counts) < self.size:
+            return 0
+        return min(self.counts.itervalues())
+
+    def add(self, value):
+        '''
+        Adds one value.
+        '''
+        if value in self.counts:
+            self.counts[value] += 1
+        elif len(self.counts) < self.size:
+            self.counts[value] = 1
+            self.errors[value] = 0
+            self.push(value)
+        elif self.size > 0:
+            # the least frequent value gives up its counter
+            least = self.pop_least()
+            floor = self.counts.pop(least)
+            del self.errors[least]
+            self.counts[value] = floor + 1
+            self.errors[value] = floor
+            self.push(value)
+
+    def push(self, value):
+        '''
+        Puts a value on the heap at its current count.
+        '''
+        heapq.heappush(self.heap, (self.counts[value], self.order, value))
+        self.order += 1
+
+    def pop_least(self):
+        '''
+        Takes the least frequent value off the heap and returns it.
+        Counts on the heap are never more than in counts, so the least
+        whose count is still current is the least of all; the others are
+        put back at their current counts.
+        '''
+        while True:
+            count, order, value = heapq.heappop(self.heap)
+            if count == self.counts[value]:
+                return value
+            self.push(value)
+
+    def add_values(self, data):
+        '''
+        Adds every value of an object array, by merging in its exact counts.
+        '''
+        if len(data) == 0:
+            return
+        values, counts = count_values(data)
+        self.merge_counts(values, counts, np.zeros(len(values), dtype=np.int64), 0)
+
+    def merge(self, other):
+        '''
+        Combines another SpaceSaving into this one.
+        '''
+        values = np.empty(len(other.counts), dtype=object)
+        values[:] = other.counts.keys()
+        counts = np.array([ other.counts[v] for v in values ], dtype=np.int64)
+        errors = np.array([ other.errors[v] for v in values ], dtype=np.int64)
+        self.merge_counts(values, counts, errors, other.get_floor())
+
+    def merge_counts(self, values, counts, errors, other_floor):
+        '''
+        Merges a summary given as arrays of values, counts and errors,
+        where other_floor bounds the count of values it does not hold.
+        Keeps the size most frequent values of the combination.
+        '''
+        floor = self.get_floor()
+        # Values missing on one side may have up to that side's floor.
+        counts = counts + floor
+        errors = errors + floor
+        position = dict(itertools.izip(values, xrange(len(values))))
+        extra = []
+        for value, count in self.counts.iteritems():
+            i = position.get(value)
+            if i is None:
+                extra.append(value)
+            else:
+                counts[i] += count - floor
+                errors[i] += self.errors[value] - floor
+        if len(extra) > 0:
+            more = np.empty(len(extra), dtype=object)
+            more[:] = extra
+            values = np.concatenate((values, more))
+            counts = np.concatenate((counts, [ self.counts[v] + other_floor for v in extra ]))
+            errors = np.concatenate((errors, [ self.errors[v] + other_floor for v in extra ]))
+        # Keep the largest counts
+        if len(values) > self.size:
+            keep = np.argpartition(-counts, self.size - 1)[:self.size]
+            values, counts, errors = values[keep], counts[keep], errors[keep]
+        self.counts = dict(itertools.izip(values, counts.tolist()))
+        self.errors = dict(itertools.izip(values, errors.tolist()))
+        self.heap = [ (count, order, value) for order, (value, count) in enumerate(self.counts.iteritems()) ]
+        heapq.heapify(self.heap)
+        self.order = len(self.heap)
+
+    def top(self):
+        '''
+        Returns a list of (value, count, error), most frequent first.
+        '''
+        return sorted(((v, self.counts[v], self.errors[v]) for v in self.counts),
+                      key=lambda t: -t[1])
+
+# Inherits only from object
+class Moments(object):
+    '''
+    Keeps count, mean and the second and third central moments of a
+    stream of numbers in one pass, giving mean, variance and skew.
+    Batches and merges use the pairwise update of Chan and Pebay,
+    which stays accurate where summing powers would not.
+    '''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.m3 = 0.0
+
+    def add(self, value):
+        '''
+        Adds one number.
+        '''
+        self.combine(1, float(value), 0.0, 0.0)
+
+    def add_values(self, values):
+        '''
+        Adds every number of a float array.
+        '''
+        if len(values) == 0:
+            return
+        mean = values.mean()
+        deviations = values - mean
+        self.combine(len(values), float(mean), float(np.dot(deviations, deviations)),
+                     float(np.sum(deviations ** 3)))
+
+    def merge(self, other):
+        '''
+        Combines another Moments into this one.
+        '''
+        self.combine(other.count, other.mean, other.m2, other.m3)
+
+    def combine(self, count, mean, m2, m3):
+        '''
+        Combines the moments of another set of numbers into these.
+        '''
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.m3 += (m3 + delta ** 3 * self.count * count * (self.count - count) / float(total * total)
+                    + 3.0 * delta * (self.count * m2 - count * self.m2) / total)
+        self.m2 += m2 + delta * delta * self.count * count / float(total)
+        self.mean += delta * count / float(total)
+        self.count = total
+
+    def variance(self):
+        '''
+        Returns the sample variance, or None for fewer than two numbers.
+        '''
+        if self.count < 2:
+            return None
+        return self.m2 / (self.count - 1)
+
+    def skew(self):
+        '''
+        Returns the skewness, or None when there is no spread.
+        '''
+        if self.count < 2 or self.m2 <= 0:
+            return None
+        return math.sqrt(self.count) * self.m3 / self.m2 ** 1.5
+
+# Inherits only from object
+class KLL(object):
+    '''
+    Approximates quantiles of a stream of numbers with the KLL sketch of
+    Karnin, Lang and Liberty. Keeps a stack of sorted buffers; a full
+    buffer keeps every other number and passes it up to the next one,
+    where each number stands for twice as many. Memory stays around
+    3 * size numbers and the rank error is about 1.7 / size.
+    Numbers added one at a time are held in a list and added size at a
+    time, as growing an array by one number copies all of it.
+    '''
+
+    def __init__(self, size=200):
+        self.size = size
+        # buffers[h] holds numbers of weight 2^h
+        self.buffers = [ np.empty(0) ]
+        # numbers added one at a time, not yet in buffers[0]
+        self.pending = []
+        # fixed seed so reports are reproducible
+        self.random = np.random.RandomState(0)
+
+    def capacity(self, level):
+        '''
+        Returns the capacity of a buffer; lower levels get smaller ones.
+        '''
+        depth = len(self.buffers) - level - 1
+        return int(math.ceil(self.size * (2.0 / 3.0) ** depth)) + 1
+
+    def add(self, value):
+        '''
+        Adds one number.
+        '''
+        self.pending.append(float(value))
+        if len(self.pending) >= self.size:
+            self.flush()
+
+    def add_values(self, values):
+        '''
+        Adds every number of a float array, after those pending.
+        '''
+        if len(values) == 0 and len(self.pending) == 0:
+            return
+        self.buffers[0] = np.concatenate((self.buffers[0], np.array(self.pending, dtype=np.float64), values))
+        self.pending = []
+        self.compress()
+
+    def flush(self):
+        '''
+        Adds the numbers pending.
+        '''
+        self.add_values(np.empty(0))
+
+    def merge(self, other):
+        '''
+        Combines another KLL into this one.
+        '''
+        self.flush()
+        other.flush()
+        while len(self.buffers) < len(other.buffers):
+            self.buffers.append(np.empty(0))
+        for level in xrange(len(other.buffers)):
+            self.buffers[level] = np.concatenate((self.buffers[level], other.buffers[level]))
+        self.compress()
+
+    def compress(self):
+        '''
+        While the sketch holds more numbers than its buffers' total
+        capacity, halves the lowest buffer that is over its own.
+        '''
+        while sum(len(buf) for buf in self.buffers) >= \
+              sum(self.capacity(h) for h in xrange(len(self.buffers))):
+            level = 0
+            while len(self.buffers[level]) < self.capacity(level):
+                level += 1
+            if level + 1 == len(self.buffers):
+                self.buffers.append(np.empty(0))
+            buf = np.sort(self.buffers[level])
+            # an odd number out stays behind
+            even = len(buf) - len(buf) % 2
+            self.buffers[level] = buf[even:]
+            promoted = buf[self.random.randint(2):even:2]
+            self.buffers[level + 1] = np.concatenate((self.buffers[level + 1], promoted))
+
+    def count(self):
+        '''
+        Returns the number of values added.
+        '''
+        return len(self.pending) + sum(len(self.buffers[h]) << h for h in xrange(len(self.buffers)))
+
+    def quantiles(self, fractions):
+        '''
+        Returns the approximate value at each fraction (0 to 1) of the
+        sorted numbers, or None values when empty.
+        '''
+        self.flush()
+        values = np.concatenate(self.buffers)
+        if len(values) == 0:
+            return [ None ] * len(fractions)
+        weights = np.concatenate([ np.full(len(self.buffers[h]), 1 << h, dtype=np.int64)
+                                   for h in xrange(len(self.buffers)) ])
+        order = np.argsort(values, kind="mergesort")
+        values = values[order]
+        ranks = np.cumsum(weights[order])
+        targets = np.array(fractions) * ranks[-1]
+        picks = np.minimum(np.searchsorted(ranks, targets, side="left"), len(values) - 1)
+        return values[picks].tolist()
+
+# Inherits only from object
+class Distribution(object):
+    '''
+    Moments and quantiles of a stream of numbers.
+    Values that are not finite (NaN, infinity) are left out.
+    '''
+
+    def __init__(self):
+        self.moments = Moments()
+        self.quantile_sketch = KLL()
+
+    def add(self, value):
+        '''
+        Adds one number.
+        '''
+        if math.isinf(value) or math.isnan(value):
+            return
+        self.moments.add(value)
+        self.quantile_sketch.add(value)
+
+    def add_values(self, values):
+        '''
+        Adds every number of a float array.
+        '''
+        values = values[np.isfinite(values)]
+        self.moments.add_values(values)
+        self.quantile_sketch.add_values(values)
+
+    def merge(self, other):
+        '''
+        Combines another Distribution into this one.
+        '''
+        self.moments.merge(other.moments)
+        self.quantile_sketch.merge(other.quantile_sketch)
+
+    def count(self):
+        return self.moments.count
+
+    def mean(self):
+        '''
+        Returns the mean, or None when empty.
+        '''
+        return self.moments.mean if self.moments.count > 0 else None
+
+    def variance(self):
+        return self.moments.variance()
+
+    def skew(self):
+        return self.moments.skew()
+
+    def quantiles(self, fractions):
+        return self.quantile_sketch.quantiles(fractions)
@@ -5,7 +5,16 @@ Created on Aug 24, 2017
 
 # future must be first
 from __future__ import print_function
+import collections
 import datetime
+import itertools
+import operator
+import timeit
+
+import numpy as np
+
+import pairstat
+import sketches
 
 # Simple enum
 # http://stackoverflow.com/questions/36932/how-can-i-represent-an-enum-in-python
@@ -36,6 +45,77 @@ def get_datatype_name(d):
     elif d == datatype_mixed:        return "Mixed"
     else:                            return "Unknown"
 
+def get_datatype_from_name(name):
+    '''
+    Translates the report's names of datatypes back to integers,
+    e.g. for a declared schema.
+    '''
+    for d in (datatype_charstring, datatype_digitstring, datatype_number, datatype_date, datatype_mixed):
+        if get_datatype_name(d) == name:
+            return d
+    raise Exception("Unknown datatype name %r" % name)
+
+def get_value_key(value):
+    '''
+    Returns a key to sort unique values by. Dates and date-times don't
+    compare with other values, such as the blank or text cells of a date
+    column, so they sort after them, each kind on its own.
+    '''
+    if isinstance(value, datetime.date):
+        return (type(value).__name__, value)
+    return ("", value)
+
+def join_datatypes(d1, d2):
+    '''
+    Combines two inferred datatypes the same way analyze_value does,
+    one value after another. The result does not depend on the order.
+    '''
+    if d1 == d2 or d2 == datatype_unknown: return d1
+    if d1 == datatype_unknown:             return d2
+    if (d1 == datatype_charstring or d1 == datatype_digitstring) \
+       and (d2 == datatype_charstring or d2 == datatype_digitstring):
+        return datatype_charstring
+    return datatype_mixed
+
+# Kinds of values as sorted by the isinstance chain in analyze_value.
+kind_none = 0
+kind_string = 1
+kind_number = 2
+kind_date = 3
+kind_other = 4
+
+def get_value_kind(t):
+    '''
+    Translates a value's type to its kind; done once per distinct type.
+    '''
+    if t is type(None):                                  return kind_none
+    elif issubclass(t, basestring):                      return kind_string
+    elif issubclass(t, int) or issubclass(t, long) \
+         or issubclass(t, float):                        return kind_number
+    elif issubclass(t, datetime.datetime):               return kind_date
+    else:                                                return kind_other
+
+# Element-wise builtins for object arrays; these loop in C, not Python.
+get_types = np.frompyfunc(type, 1, 1)
+get_lengths = np.frompyfunc(len, 1, 1)
+get_isspace = np.frompyfunc(operator.methodcaller("isspace"), 1, 1)
+get_isdigit = np.frompyfunc(operator.methodcaller("isdigit"), 1, 1)
+get_item = np.frompyfunc(dict.__getitem__, 2, 1)
+
+# Nonempty values of one type in a row that lock an adaptive column
+# to that type
+lock_run = 16
+
+# Dates are summarized as seconds since this moment
+epoch = datetime.datetime(1970, 1, 1)
+epoch64 = np.datetime64(epoch, "us")
+
+# Fractions reported as percentiles p1, p25, p50, p75 and p99
+percentiles = [ 0.01, 0.25, 0.5, 0.75, 0.99 ]
+
+# Rows between checks of whether columns have settled, when stopping early
+stop_check_rows = 1000
+
 # Inherits only from object
 class TableStat(object):
     '''
@@ -54,33 +134,91 @@ class TableStat(object):
 
     Useful attributes:
         unique_max (integer)
+        sketch_top (integer, 0 when sketches are off)
+        distributions (boolean)
+        schema (dict of column names to declared datatype names, or None)
+        adaptive (boolean)
+        tolerance (float, None unless stopping early)
         row_count (integer)
+        sampled_from (count of rows the analyzed rows were sampled from,
+            or None)
         stats (list of ColumnStat objects)
+        pairs (PairStat of pairs of columns, or None)
 
     Profiled with "-m cProfile" arguments to python
     '''
 
-    def __init__(self, unique_max_count, column_list):
+    def __init__(self, unique_max_count, column_list, sketch_top=0, distributions=False, schema=None,
+                 adaptive=False, tolerance=None, pairs=False):
         '''
         Constructor accepts an ORDERED list of column names.
         If the list is empty, assigns names as it does.
+        A positive sketch_top turns on the fixed-size sketches of each
+        column, keeping that many of its most frequent values.
+        Setting distributions adds moments and percentiles of numbers
+        and dates to each column.
+        A schema maps column names to datatype names as reported, e.g.
+        "Number"; those columns take the declared type without inferring
+        it. Setting adaptive lets analyze_row take a fast path for each
+        column once it settles on one type of value.
+        A tolerance stops analyzing each column once it settles: checked
+        every stop_check_rows rows, its datatype and unique count held
+        and its density moved by no more than the tolerance since the
+        last check. Its report is then an estimate.
+        Setting pairs adds statistics of pairs of columns, gathered from
+        the same rows; see pairstat.py.
         '''
         # validate the input arguments
         if not isinstance(unique_max_count, int):
             raise Exception("Expected int but received %s" % type(unique_max_count))
         if not isinstance(column_list, list):
             raise Exception("Expected list but received %s" % type(column_list))
+        if not isinstance(sketch_top, int):
+            raise Exception("Expected int but received %s" % type(sketch_top))
         # Keep the limit on unique values
         self.unique_max = unique_max_count
+        # Keep the number of top values sketched
+        self.sketch_top = sketch_top
+        # Keep whether to track moments and percentiles
+        self.distributions = distributions
+        # Keep the declared datatypes, checked up front
+        if schema is not None:
+            for name in schema.values():
+                get_datatype_from_name(name)
+        self.schema = schema
+        # Keep whether to lock columns to one type
+        self.adaptive = adaptive
+        # Keep the early-stop tolerance, and the state of the checks:
+        # the summary of each column at the last one, and when the next is
+        self.tolerance = tolerance
+        self.checks = []
+        self.next_check = stop_check_rows
         # Number of rows seen
         self.row_count = 0
+        # Number of rows sampled from, if the rows seen are a sample
+        self.sampled_from = None
         # List of stat-collection objects, one per column
-        self.stats = [ ColumnStat(i, column_list[i], self.unique_max) for i in xrange(len(column_list)) ]
+        self.stats = [ self.new_column(i, column_list[i]) for i in xrange(len(column_list)) ]
+        # Statistics of pairs of columns, and the rows held for them
+        self.pairs = pairstat.PairStat(len(column_list)) if pairs else None
+        self.pair_rows = []
 
-    def analyze_row(self, data_list):
+    def new_column(self, col_index, col_name):
+        '''
+        Creates a ColumnStat with this table's settings.
+        '''
+        declared = None
+        if self.schema is not None and col_name in self.schema:
+            declared = get_datatype_from_name(self.schema[col_name])
+        return ColumnStat(col_index, col_name, self.unique_max, self.sketch_top, self.distributions,
+                          declared, self.adaptive)
+
+    def analyze_row(self, data_list, column_times=None):
         '''
         Gathers statistics from the ORDERED list of data, which must match
         match the order and count of columns given to constructor.
+        Given a list of column_times, adds the seconds spent on each
+        column to it, to find hot spots; see instrument.py.
         '''
         self.row_count += 1
         # compute length once, not repeatedly
@@ -93,10 +231,199 @@ class TableStat(object):
             while len(self.stats) < datalen:
                 # Grow the list of column stat objects to allow
                 # extra columns, or starting with no columns defined
-                self.stats.append(ColumnStat(len(self.stats), None, self.unique_max))
-        # Analyze each field in this row
-        for i in xrange(datalen):
-            self.stats[i].analyze_value(data_list[i])
+                self.stats.append(self.new_column(len(self.stats), None))
+        # Analyze each field in this row; izip stops at the row's end
+        if column_times is None and self.tolerance is None:
+            for cs, value in itertools.izip(self.stats, data_list):
+                cs.analyze_value(value)
+        elif column_times is None:
+            for cs, value in itertools.izip(self.stats, data_list):
+                if not cs.stopped:
+                    cs.analyze_value(value)
+        else:
+            self.analyze_timed(data_list, column_times, ColumnStat.analyze_value)
+        if self.pairs is not None:
+            # pairs are analyzed a batch of rows at a time
+            self.pair_rows.append(data_list)
+            if len(self.pair_rows) >= pairstat.pair_batch_rows:
+                self.flush_pair_rows()
+        if self.tolerance is not None and self.row_count >= self.next_check:
+            self.check_settled()
+
+    def analyze_columns(self, column_lists, column_times=None):
+        '''
+        Gathers statistics from a batch of rows given column by column:
+        an ORDERED list of columns, each a list (or NumPy array) holding
+        that column's values for the same rows.
+
+        Produces the same statistics as calling analyze_row once per row,
+        but each column is handled with vectorized operations, which is
+        much faster on large inputs.
+        Takes column_times as analyze_row does.
+        '''
+        # compute length once, not repeatedly
+        collen = len(column_lists)
+        if collen == 0:
+            return
+        rows = max(len(c) for c in column_lists)
+        # Extend for wider-than-expected batches, as analyze_row does.
+        if len(self.stats) < collen:
+            if len(self.stats) > 0:
+                print("Warning: input rows have %d columns but expected %d" % (collen, len(self.stats)))
+            while len(self.stats) < collen:
+                self.stats.append(self.new_column(len(self.stats), None))
+        if self.tolerance is not None:
+            self.analyze_until_settled(column_lists, rows, column_times)
+            return
+        self.row_count += rows
+        if self.pairs is not None:
+            self.flush_pair_rows()
+            self.pairs.analyze_columns(column_lists)
+        # Analyze each column in this batch
+        if column_times is None:
+            for i in xrange(collen):
+                self.stats[i].analyze_values(column_lists[i])
+        else:
+            self.analyze_timed(column_lists, column_times, ColumnStat.analyze_values)
+
+    def analyze_timed(self, data_list, column_times, analyze):
+        '''
+        Analyzes a value or a batch of values of each column with the
+        given ColumnStat method, adding the seconds taken to column_times.
+        Columns stopped early are skipped.
+        '''
+        while len(column_times) < len(self.stats):
+            column_times.append(0.0)
+        for i, (cs, data) in enumerate(itertools.izip(self.stats, data_list)):
+            if cs.stopped:
+                continue
+            start = timeit.default_timer()
+            analyze(cs, data)
+            column_times[i] += timeit.default_timer() - start
+
+    def analyze_until_settled(self, column_lists, rows, column_times):
+        '''
+        Analyzes a batch of rows given column by column in slices that
+        end at each check of whether the columns have settled, skipping
+        the columns stopped. Rows past the point where all columns have
+        stopped are not counted.
+        '''
+        start = 0
+        while start < rows and not self.is_stopped():
+            end = min(rows, start + max(self.next_check - self.row_count, 1))
+            data = [ c[start:end] for c in column_lists ]
+            if column_times is None:
+                for cs, values in itertools.izip(self.stats, data):
+                    if not cs.stopped:
+                        cs.analyze_values(values)
+            else:
+                self.analyze_timed(data, column_times, ColumnStat.analyze_values)
+            if self.pairs is not None:
+                self.flush_pair_rows()
+                self.pairs.analyze_columns(data)
+            self.row_count += end - start
+            start = end
+            if self.row_count >= self.next_check:
+                self.check_settled()
+
+    def flush_pair_rows(self):
+        '''
+        Analyzes the rows held for the statistics of pairs of columns.
+        '''
+        if len(self.pair_rows) > 0:
+            self.pairs.analyze_rows(self.pair_rows)
+            self.pair_rows = []
+
+    def get_pairs(self):
+        '''
+        Returns the PairStat, with all rows analyzed so far, or None.
+        '''
+        if self.pairs is not None:
+            self.flush_pair_rows()
+        return self.pairs
+
+    def get_column_names(self):
+        '''
+        Returns the ORDERED list of column names.
+        '''
+        return [ cs.name for cs in self.stats ]
+
+    def check_settled(self):
+        '''
+        Stops each column whose datatype and unique count held, and whose
+        density moved by no more than the tolerance, since the last check.
+        '''
+        while len(self.checks) < len(self.stats):
+            self.checks.append(None)
+        for i, cs in enumerate(self.stats):
+            if cs.stopped or cs.empty + cs.nonempty == 0:
+                continue
+            check = (cs.datatype, min(len(cs.freqs), cs.unique_max), cs.get_density())
+            last = self.checks[i]
+            if last is not None and check[:2] == last[:2] and abs(check[2] - last[2]) <= self.tolerance:
+                cs.stopped = True
+            self.checks[i] = check
+        self.next_check = self.row_count + stop_check_rows
+
+    def is_stopped(self):
+        '''
+        Tells whether every column has stopped early, so no more rows
+        need to be read.
+        '''
+        return len(self.stats) > 0 and all(cs.stopped for cs in self.stats)
+
+    def add_sampled_rows(self, count):
+        '''
+        Counts rows that the rows analyzed were sampled from.
+        '''
+        self.sampled_from = (self.sampled_from or 0) + count
+
+    def has_estimates(self):
+        '''
+        Tells whether reports may hold estimates, from sampling rows or
+        stopping early, and so mark them.
+        '''
+        return self.sampled_from is not None or self.tolerance is not None
+
+    def get_estimated(self, cs):
+        '''
+        Tells whether the report of a column is an estimate, or None when
+        no report can be, so reports leave out the fields that mark them.
+        '''
+        if not self.has_estimates():
+            return None
+        return cs.stopped or (self.sampled_from is not None and self.row_count < self.sampled_from)
+
+    def merge(self, other):
+        '''
+        Combines the statistics of another TableStat into this one, as if
+        this one had also analyzed the other's rows after its own.
+        Use it to reduce partial results, e.g. from row ranges of a single
+        sheet profiled in separate processes. Returns self.
+        '''
+        if self.unique_max != other.unique_max:
+            raise Exception("Cannot merge unique limits %d and %d" % (self.unique_max, other.unique_max))
+        if self.sketch_top != other.sketch_top:
+            raise Exception("Cannot merge sketch sizes %d and %d" % (self.sketch_top, other.sketch_top))
+        if self.distributions != other.distributions:
+            raise Exception("Cannot merge with and without distributions")
+        if self.schema != other.schema:
+            raise Exception("Cannot merge different schemas")
+        if self.tolerance != other.tolerance:
+            raise Exception("Cannot merge different early-stop tolerances")
+        if (self.pairs is None) != (other.pairs is None):
+            raise Exception("Cannot merge with and without pairs of columns")
+        if self.pairs is not None:
+            self.get_pairs().merge(other.get_pairs())
+        self.row_count += other.row_count
+        if other.sampled_from is not None:
+            self.add_sampled_rows(other.sampled_from)
+        # Extend for a wider partial result, as analyze_row does
+        while len(self.stats) < len(other.stats):
+            self.stats.append(self.new_column(len(self.stats), None))
+        for i in xrange(len(other.stats)):
+            self.stats[i].merge(other.stats[i])
+        return self
 
     def print_report(self):
         '''
@@ -105,15 +432,21 @@ class TableStat(object):
         '''
         print("Row count = %d" % self.row_count)
         print("Note: unique value limit = %d" % self.unique_max)
+        if self.sampled_from is not None:
+            print("Note: sampled %d of %d rows" % (self.row_count, self.sampled_from))
+        if self.tolerance is not None:
+            print("Note: columns stop early once settled within %g" % self.tolerance)
         for i in xrange(len(self.stats)):
-            self.stats[i].print_report()
+            self.stats[i].print_report(self.get_estimated(self.stats[i]))
+        if self.pairs is not None:
+            self.get_pairs().print_report(self.get_column_names())
 
     def print_report_thead(self, prefix):
         '''
         Prints header for column-oriented report.
         Prefix is used for additional column heads.
         '''
-        self.stats[0].print_report_head(prefix)
+        self.stats[0].print_report_head(prefix, self.has_estimates())
 
     def print_report_tbody(self, prefix):
         '''
@@ -121,7 +454,14 @@ class TableStat(object):
         Prefix is used for additional data columns.
         '''
         for i in xrange(len(self.stats)):
-            self.stats[i].print_report_row(prefix)
+            self.stats[i].print_report_row(prefix, self.get_estimated(self.stats[i]))
+
+    def get_report_records(self):
+        '''
+        Returns the report on all columns as a list of ORDERED dicts,
+        one per column; see ColumnStat.get_report_record.
+        '''
+        return [ cs.get_report_record(self.get_estimated(cs)) for cs in self.stats ]
 
 # Inherits only from object
 class ColumnStat(object):
@@ -139,9 +479,33 @@ class ColumnStat(object):
 		freqs (dict of unique values and their frequencies)
         minval, maxval (minimum and maximum numeric values)
         minlen, maxlen (minimum and maximum string lengths)
+        distinct (HyperLogLog sketch of unique values, or None)
+        top (SpaceSaving sketch of frequent values, or None)
+        numdist, datedist (Distribution sketches of numbers and of dates
+            as seconds since 1970, or None)
+        days (dict of calendar days and the count of dates on each)
+        hours (list of the count of dates in each hour of the day)
+        infer (False when the datatype was declared)
+        locked_type (type of value taking the fast path, or None)
+        fallbacks (count of nonempty values that missed the fast path)
+        stopped (True once analysis stopped early, see TableStat)
+
+    Attributes live in slots, not a per-object dict, which keeps wide
+    tables of thousands of columns small and attribute access quick.
     '''
 
-    def __init__(self, col_index, col_name, unique_max):
+    __slots__ = ("index", "name", "unique_max", "datatype", "empty", "nonempty",
+                 "minlen", "maxlen", "minval", "maxval", "mindate", "maxdate",
+                 "freqs", "freqsfull", "distinct", "top", "numdist", "datedist", "days", "hours",
+                 "infer", "adaptive", "locked_type", "locked_kind", "run_type", "run_length", "fallbacks",
+                 "stopped")
+
+    # constants used as sentinels
+    minsentinel = 999999999
+    maxsentinel = -1
+
+    def __init__(self, col_index, col_name, unique_max, sketch_top=0, distributions=False, declared=None,
+                 adaptive=False):
         # Keep the index & name
         self.index = col_index
         self.name = col_name
@@ -153,9 +517,6 @@ class ColumnStat(object):
         self.empty = 0
         # Number of non-empty entries
         self.nonempty = 0
-        # constants used as sentinels
-        self.minsentinel = 999999999
-        self.maxsentinel = -1
         # min and max lengths for strings
         self.minlen = self.minsentinel
         self.maxlen = self.maxsentinel
@@ -165,10 +526,53 @@ class ColumnStat(object):
         # min and max values for dates
         self.mindate = None
         self.maxdate = None
+        # Histograms of dates per calendar day and per hour of the day
+        self.days = {}
+        self.hours = [ 0 ] * 24
         # Unique value frequencies (size is limited)
         self.freqs = {}
         # set when freqs grows too long
         self.freqsfull = False
+        # Fixed-size sketches that carry on past unique_max
+        if sketch_top > 0:
+            self.distinct = sketches.HyperLogLog()
+            self.top = sketches.SpaceSaving(sketch_top)
+        else:
+            self.distinct = None
+            self.top = None
+        # Moments and percentiles of numbers and dates
+        if distributions:
+            self.numdist = sketches.Distribution()
+            self.datedist = sketches.Distribution()
+        else:
+            self.numdist = None
+            self.datedist = None
+        # A declared datatype is kept, not inferred
+        if declared is not None:
+            self.datatype = declared
+            self.infer = False
+        else:
+            self.infer = True
+        # Type and kind of the values that take the fast path, once the
+        # last run of nonempty values of one type is long enough
+        self.adaptive = adaptive
+        self.locked_type = None
+        self.locked_kind = kind_none
+        self.run_type = None
+        self.run_length = 0
+        self.fallbacks = 0
+        # Set when TableStat stops analyzing the column early
+        self.stopped = False
+
+    def __getstate__(self):
+        '''
+        Pickles the slots, which have no __dict__ to pickle.
+        '''
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def analyze_value(self, value):
         '''
@@ -184,6 +588,44 @@ class ColumnStat(object):
             else:
                 # set flag in hope that boolean test is very fast
                 self.freqsfull = True
+        # Sketches see every value, however many are unique
+        if self.distinct is not None:
+            self.distinct.add(value)
+            self.top.add(value)
+
+        # Fast path for a column locked to this type of value
+        if type(value) is self.locked_type:
+            if self.locked_kind == kind_string:
+                if value == "" or value.isspace():
+                    self.empty += 1
+                else:
+                    self.nonempty += 1
+                    # only a digitstring column, or one with no type yet,
+                    # can still change
+                    if self.datatype != datatype_charstring and self.infer:
+                        self.datatype = join_datatypes(self.datatype, datatype_digitstring if value.isdigit()
+                                                                      else datatype_charstring)
+                strlen = len(value)
+                if strlen < self.minlen: self.minlen = strlen
+                if strlen > self.maxlen: self.maxlen = strlen
+            elif self.locked_kind == kind_number:
+                self.nonempty += 1
+                if self.datatype != datatype_number and self.infer:
+                    self.datatype = join_datatypes(self.datatype, datatype_number)
+                if value < self.minval: self.minval = value
+                if value > self.maxval: self.maxval = value
+                if self.numdist is not None: self.numdist.add(float(value))
+            else:
+                self.nonempty += 1
+                if self.datatype != datatype_date and self.infer:
+                    self.datatype = join_datatypes(self.datatype, datatype_date)
+                if self.mindate is None or value < self.mindate: self.mindate = value
+                if self.maxdate is None or value > self.maxdate: self.maxdate = value
+                if self.datedist is not None: self.datedist.add((value - epoch).total_seconds())
+                day = value.date()
+                self.days[day] = self.days.get(day, 0) + 1
+                self.hours[value.hour] += 1
+            return
 
         # Test for type
         if value is None:
@@ -198,8 +640,12 @@ class ColumnStat(object):
                 # TODO: possibly turn off digitstring on non-zero whitespace?
             else:
                 self.nonempty += 1
+                if self.adaptive: self.track_type(value)
                 # infer type of data within the string
-                if value.isdigit():
+                if not self.infer:
+                    # declared
+                    pass
+                elif value.isdigit():
                     # this value is only numbers
                     if self.datatype == datatype_digitstring:
                         # this is the most common case, no need to look further
@@ -231,22 +677,32 @@ class ColumnStat(object):
         elif isinstance(value, int) or isinstance(value, long) or isinstance(value, float):
             # It's a proper number.
             self.nonempty += 1
+            if self.adaptive: self.track_type(value)
             # Note type
-            if self.datatype == datatype_unknown: self.datatype = datatype_number
+            if not self.infer: pass
+            elif self.datatype == datatype_unknown: self.datatype = datatype_number
             elif self.datatype != datatype_number: self.datatype = datatype_mixed
             # Store min/max numeric values
             if value < self.minval: self.minval = value
             if value > self.maxval: self.maxval = value
+            if self.numdist is not None: self.numdist.add(float(value))
 
         elif isinstance(value, datetime.datetime):
             # It's a date-time value; first seen from XLSX via openpyxl
             self.nonempty += 1
+            if self.adaptive: self.track_type(value)
             # Note type
-            if self.datatype == datatype_unknown: self.datatype = datatype_date
+            if not self.infer: pass
+            elif self.datatype == datatype_unknown: self.datatype = datatype_date
             elif self.datatype != datatype_date: self.datatype = datatype_mixed
             # Store min/max date values
             if self.mindate is None or value < self.mindate: self.mindate = value
             if self.maxdate is None or value > self.maxdate: self.maxdate = value
+            if self.datedist is not None: self.datedist.add((value - epoch).total_seconds())
+            # Count per day and hour
+            day = value.date()
+            self.days[day] = self.days.get(day, 0) + 1
+            self.hours[value.hour] += 1
 
         else:
             # Tabular data should not have non-scalar values like list, etc.
@@ -254,11 +710,202 @@ class ColumnStat(object):
 
             # not a string
 
-    def print_report(self):
+    def track_type(self, value):
+        '''
+        Counts a nonempty value that missed the fast path, and locks the
+        column to its type after lock_run values of that type in a row.
+        Empty values neither count nor break a run, so a number column
+        with blank cells still locks to numbers.
+        '''
+        if self.locked_type is not None:
+            self.fallbacks += 1
+        if type(value) is self.run_type:
+            self.run_length += 1
+            if self.run_length == lock_run:
+                self.locked_type = self.run_type
+                self.locked_kind = get_value_kind(self.run_type)
+        else:
+            self.run_type = type(value)
+            self.run_length = 1
+
+    def analyze_values(self, values):
+        '''
+        Analyzes a batch of new values (i.e., new rows) for the column.
+        Accepts a list or a NumPy array.
+
+        Same results as calling analyze_value on each value in turn,
+        but uses vectorized operations over the whole batch.
+        '''
+        count = len(values)
+        if count == 0:
+            return
+        # Keep values as python objects so types are not coerced
+        data = np.empty(count, dtype=object)
+        data[:] = values
+        # Track unique values/frequencies, limited by unique_max.
+        self.analyze_freqs(data)
+        # Sketches see every value, however many are unique
+        if self.distinct is not None:
+            self.distinct.add_values(data)
+            self.top.add_values(data)
+
+        # Sort values by kind, one isinstance test per distinct type
+        types = get_types(data)
+        kinds = np.empty(count, dtype=np.int8)
+        for t in set(types):
+            kinds[types == t] = get_value_kind(t)
+        if (kinds == kind_other).any():
+            # Tabular data should not have non-scalar values like list, etc.
+            raise Exception("Cannot profile type " + str(types[kinds == kind_other][0]))
+
+        # Count None values as empty
+        self.empty += int(np.count_nonzero(kinds == kind_none))
+
+        strings = data[kinds == kind_string]
+        if len(strings) > 0:
+            lengths = get_lengths(strings).astype(np.int64)
+            isempty = (lengths == 0) | get_isspace(strings).astype(bool)
+            nonempty = strings[~isempty]
+            self.empty += int(np.count_nonzero(isempty))
+            self.nonempty += len(nonempty)
+            if len(nonempty) > 0 and self.infer:
+                # infer type of data within the strings
+                isdigit = get_isdigit(nonempty).astype(bool)
+                if isdigit.any():
+                    self.datatype = join_datatypes(self.datatype, datatype_digitstring)
+                if not isdigit.all():
+                    self.datatype = join_datatypes(self.datatype, datatype_charstring)
+            # track min/max length of the strings, empty ones included
+            self.minlen = min(self.minlen, int(lengths.min()))
+            self.maxlen = max(self.maxlen, int(lengths.max()))
+
+        numbers = data[kinds == kind_number]
+        if len(numbers) > 0:
+            self.nonempty += len(numbers)
+            if self.infer: self.datatype = join_datatypes(self.datatype, datatype_number)
+            # Store min/max numeric values; NaN never compares, so skip it
+            floats = numbers.astype(np.float64)
+            if self.numdist is not None: self.numdist.add_values(floats)
+            numbers = numbers[~np.isnan(floats)]
+            floats = floats[~np.isnan(floats)]
+            if len(numbers) > 0:
+                # argmin/argmax keep the first of equal values, like analyze_value
+                value = numbers[floats.argmin()]
+                if value < self.minval: self.minval = value
+                value = numbers[floats.argmax()]
+                if value > self.maxval: self.maxval = value
+
+        dates = data[kinds == kind_date]
+        if len(dates) > 0:
+            self.nonempty += len(dates)
+            if self.infer: self.datatype = join_datatypes(self.datatype, datatype_date)
+            # Store min/max date values
+            value = min(dates)
+            if self.mindate is None or value < self.mindate: self.mindate = value
+            value = max(dates)
+            if self.maxdate is None or value > self.maxdate: self.maxdate = value
+            times = np.array(dates.tolist(), dtype="datetime64[us]")
+            if self.datedist is not None:
+                seconds = times - epoch64
+                self.datedist.add_values(seconds.astype(np.int64) / 1e6)
+            # Count per day and hour; coarser units round down
+            days, counts = np.unique(times.astype("datetime64[D]"), return_counts=True)
+            for day, count in itertools.izip(days.tolist(), counts.tolist()):
+                self.days[day] = self.days.get(day, 0) + count
+            hours = np.bincount(times.astype("datetime64[h]").astype(np.int64) % 24, minlength=24)
+            self.hours = [ a + b for a, b in itertools.izip(self.hours, hours.tolist()) ]
+
+    def analyze_freqs(self, data):
+        '''
+        Counts unique values of an object array into freqs, stopping at
+        exactly the same point as analyze_value would on unique_max.
+        '''
+        if self.freqsfull:
+            return
+        room = self.unique_max - len(self.freqs)
+        if room <= 0:
+            # the first value of the batch finds freqs already full
+            self.freqsfull = True
+            return
+        count = len(data)
+        # Map each value to the row of its first appearance; the dict is
+        # filled back to front so earlier rows overwrite later ones.
+        first = dict(itertools.izip(data[::-1], xrange(count - 1, -1, -1)))
+        codes = get_item(first, data).astype(np.int64)
+        # Rows counted; stop after the value that fills freqs.
+        cut = count
+        for i in np.unique(codes):
+            if data[i] not in self.freqs:
+                room -= 1
+                if room == 0:
+                    cut = i + 1
+                    if cut < count:
+                        self.freqsfull = True
+                    break
+        rows, counts = np.unique(codes[:cut], return_counts=True)
+        for i in xrange(len(rows)):
+            # keep the first-seen value as key, as the dict would
+            value = data[rows[i]]
+            self.freqs[value] = self.freqs.get(value, 0) + int(counts[i])
+
+    def merge(self, other):
+        '''
+        Combines the statistics of another ColumnStat for the same column
+        into this one, as if this one had also analyzed the other's values.
+        Reports match a single pass over all values; once the unique limit
+        is reached the result is marked full like analyze_value does.
+        Returns self.
+        '''
+        if self.unique_max != other.unique_max:
+            raise Exception("Cannot merge unique limits %d and %d" % (self.unique_max, other.unique_max))
+        if self.name is None:
+            self.name = other.name
+        self.datatype = join_datatypes(self.datatype, other.datatype)
+        self.fallbacks += other.fallbacks
+        self.stopped = self.stopped or other.stopped
+        self.empty += other.empty
+        self.nonempty += other.nonempty
+        # Sentinels lose to any real value, so plain comparisons work.
+        # On ties keep our own value, which was seen first.
+        if other.minlen < self.minlen: self.minlen = other.minlen
+        if other.maxlen > self.maxlen: self.maxlen = other.maxlen
+        if other.minval < self.minval: self.minval = other.minval
+        if other.maxval > self.maxval: self.maxval = other.maxval
+        if other.mindate is not None and (self.mindate is None or other.mindate < self.mindate):
+            self.mindate = other.mindate
+        if other.maxdate is not None and (self.maxdate is None or other.maxdate > self.maxdate):
+            self.maxdate = other.maxdate
+        for day, count in other.days.iteritems():
+            self.days[day] = self.days.get(day, 0) + count
+        self.hours = [ a + b for a, b in itertools.izip(self.hours, other.hours) ]
+        # Frequencies are only reported while below the limit, so
+        # exact counts matter only if neither side has overflowed.
+        if self.freqsfull:
+            pass
+        elif other.freqsfull:
+            # reports test the length of freqs, so take the full one
+            self.freqs = dict(other.freqs)
+            self.freqsfull = True
+        else:
+            for value, count in other.freqs.iteritems():
+                self.freqs[value] = self.freqs.get(value, 0) + count
+            self.freqsfull = len(self.freqs) >= self.unique_max
+        if self.distinct is not None:
+            self.distinct.merge(other.distinct)
+            self.top.merge(other.top)
+        if self.numdist is not None:
+            self.numdist.merge(other.numdist)
+            self.datedist.merge(other.datedist)
+        return self
+
+    def print_report(self, estimated=None):
         '''
         Prints field report to stdout, one result per line.
+        Marks the report an estimate when estimated is True.
         '''
         print("Column '%s' (index %d)" % (self.name, self.index))
+        if estimated:
+            print("\tEstimated from = %d rows" % (self.empty + self.nonempty))
         print("\tData type      = %s" % get_datatype_name(self.datatype))
         print("\tEmpty count    = %d" % self.empty)
         print("\tNonempty count = %d" % self.nonempty)
@@ -272,40 +919,125 @@ class ColumnStat(object):
         if self.datatype == datatype_date:
             print("\tMax date       = %s" % self.maxdate)
             print("\tMin date       = %s" % self.mindate)
+        if len(self.days) > 0:
+            days, hours = self.get_date_histograms()
+            print("\tDates per day  = %s" % "{" + ", ".join("%s: %d" % day for day in days) + "}")
+            print("\tDates per hour = %s" % ", ".join("%d" % count for count in hours))
         # Don't just echo the max value count when it's exceeded
         if len(self.freqs) < self.unique_max:
             print("\tUnique count   = %d" % len(self.freqs))
             # emit dictionary contents sorted by key
-            print("\tUnique values  = %s" % "{" + ", ".join("%r: %r" % (key, self.freqs[key]) for key in sorted(self.freqs)) + "}")
+            print("\tUnique values  = %s" % "{" + ", ".join("%r: %r" % (key, self.freqs[key]) for key in sorted(self.freqs, key=get_value_key)) + "}")
         else:
             print("\tUnique count   > %d" % self.unique_max);
+        if self.distinct is not None:
+            distinct, error, top = self.get_sketch_report()
+            print("\tDistinct est.  = %d +- %d" % (distinct, error))
+            print("\tTop values     = %s" % top)
+        if self.adaptive:
+            print("\tFast path miss = %d" % self.fallbacks)
+        if self.numdist is not None:
+            report = self.get_distribution_report()
+            print("\tMean           = %s" % report[0])
+            print("\tVariance       = %s" % report[1])
+            print("\tSkew           = %s" % report[2])
+            print("\tPercentiles    = %s" % ", ".join("%s" % p for p in report[3:]))
+
+    def get_date_histograms(self):
+        '''
+        Returns the histograms of dates: an ORDERED list of (day, count)
+        tuples for the days that have dates, and the list of counts for
+        each hour of the day, from midnight.
+        '''
+        return (sorted(self.days.items()), list(self.hours))
+
+    def get_top_values(self):
+        '''
+        Returns the distinct count, its standard error and an ORDERED list
+        of (value, count, error) tuples of the top values, most frequent
+        first. Exact while freqs is below the limit, else from the sketches.
+        '''
+        if len(self.freqs) < self.unique_max:
+            top = sorted(self.freqs, key=self.freqs.get, reverse=True)[:self.top.size]
+            top = [ (value, self.freqs[value], 0) for value in top ]
+            distinct = len(self.freqs)
+            error = 0
+        else:
+            top = self.top.top()
+            distinct = self.distinct.estimate()
+            error = self.distinct.std_error()
+        return distinct, error, top
+
+    def get_sketch_report(self):
+        '''
+        Returns the distinct count, its standard error and the top values
+        as a string of low-high count ranges, most frequent first.
+        '''
+        distinct, error, top = self.get_top_values()
+        return distinct, error, "{" + ", ".join("%r: %d-%d" % (value, count - err, count) for value, count, err in top) + "}"
+
+    def get_distribution_report(self):
+        '''
+        Returns mean, variance, skew and the percentiles, from numbers if
+        the column has any, else from dates; None where unknown.
+        For dates the mean and percentiles are date-times, and the
+        variance is in squared days.
+        '''
+        if self.numdist.count() > 0:
+            dist = self.numdist
+            convert = lambda x: x
+            scale = 1.0
+        else:
+            dist = self.datedist
+            convert = lambda x: epoch + datetime.timedelta(seconds=x)
+            scale = 86400.0 ** 2
+        mean = dist.mean()
+        variance = dist.variance()
+        return ([ convert(mean) if mean is not None else None,
+                  variance / scale if variance is not None else None,
+                  dist.skew() ]
+                + [ convert(q) if q is not None else None for q in dist.quantiles(percentiles) ])
 
     def get_density(self):
         return (self.nonempty / float(self.empty + self.nonempty))
 
-    def print_report_head(self, prefix):
+    def print_report_head(self, prefix, estimates=False):
         '''
         Prints the column heads for a tabular report to stdout.
         Use in conjunction with print_report_row.
-        Optionally adds a prefix, which supports sheet name and index.
+        Optionally adds a prefix, which supports sheet name and index,
+        and the heads of the fields that mark estimates.
         '''
         print(prefix + "Column name,Column index,Data type,Empty count,Nonempty count,Density,"
               + "Max length str,Min length str,Max number,Min number,Max date,Min date,"
-              + "Unique count,Unique values")
+              + "Unique count,Unique values"
+              + (",Distinct estimate,Distinct error,Top values" if self.distinct is not None else "")
+              + (",Mean,Variance,Skew,P1,P25,P50,P75,P99" if self.numdist is not None else "")
+              + (",Rows analyzed,Estimated" if estimates else ""))
 
-    def print_report_row(self, prefix):
+    def print_report_row(self, prefix, estimated=None):
         '''
         Prints field report to stdout, one result per column.
         Optionally adds a prefix, which supports sheet name and index.
+        Unless estimated is None, adds the rows analyzed and whether the
+        report is an estimate.
         '''
         # Avoid a hopelessly wide line.
         if len(self.freqs) < self.unique_max:
             myuniques = str(len(self.freqs))
             # emit dictionary contents sorted by key
-            myfreqs = "{" + ", ".join("%r: %r" % (key, self.freqs[key]) for key in sorted(self.freqs)) + "}"
+            myfreqs = "{" + ", ".join("%r: %r" % (key, self.freqs[key]) for key in sorted(self.freqs, key=get_value_key)) + "}"
         else:
             myuniques = "> " + str(self.unique_max)
             myfreqs = "Unknown"
+        # Optional columns from the sketches
+        mysketch = ""
+        if self.distinct is not None:
+            mysketch = ',%d,%d,"%s"' % self.get_sketch_report()
+        if self.numdist is not None:
+            mysketch += "".join(",%s" % x for x in self.get_distribution_report())
+        if estimated is not None:
+            mysketch += ",%d,%s" % (self.empty + self.nonempty, estimated)
         print(prefix
               + "%s," % self.name
               + "%d," % self.index
@@ -321,8 +1053,56 @@ class ColumnStat(object):
               + "%s," % self.mindate
               + "%s," % myuniques
               + '"%s"' % myfreqs     # surround with quotes
+              + mysketch
             )
 
+    def get_report_record(self, estimated=None):
+        '''
+        Returns the fields of the tabular report as an ORDERED dict of
+        plain values instead of a line of text: None where the tabular
+        report has None, unique values as a list of (value, count) pairs
+        sorted by value, or None past the unique limit. Optional fields
+        follow the options in use: sketches, distributions, the fast path
+        and the date histograms, for columns that have dates. Unless
+        estimated is None, the rows analyzed and whether the report is an
+        estimate follow.
+        '''
+        record = collections.OrderedDict()
+        record["column_name"] = self.name
+        record["column_index"] = self.index
+        record["data_type"] = get_datatype_name(self.datatype)
+        record["empty_count"] = self.empty
+        record["nonempty_count"] = self.nonempty
+        record["density"] = self.get_density()
+        record["max_length"] = self.maxlen if self.maxlen != self.maxsentinel else None
+        record["min_length"] = self.minlen if self.minlen != self.minsentinel else None
+        record["max_number"] = self.maxval if self.maxval != self.maxsentinel else None
+        record["min_number"] = self.minval if self.minval != self.minsentinel else None
+        record["max_date"] = self.maxdate
+        record["min_date"] = self.mindate
+        record["unique_limit"] = self.unique_max
+        if len(self.freqs) < self.unique_max:
+            record["unique_count"] = len(self.freqs)
+            record["unique_values"] = [ (key, self.freqs[key]) for key in sorted(self.freqs, key=get_value_key) ]
+        else:
+            record["unique_count"] = None
+            record["unique_values"] = None
+        if self.distinct is not None:
+            record["distinct_estimate"], record["distinct_error"], record["top_values"] = self.get_top_values()
+        if self.numdist is not None:
+            report = self.get_distribution_report()
+            record["mean"], record["variance"], record["skew"] = report[:3]
+            for p, value in itertools.izip(percentiles, report[3:]):
+                record["p%d" % round(p * 100)] = value
+        if self.adaptive:
+            record["fast_path_misses"] = self.fallbacks
+        if len(self.days) > 0:
+            record["dates_per_day"], record["dates_per_hour"] = self.get_date_histograms()
+        if estimated is not None:
+            record["rows_analyzed"] = self.empty + self.nonempty
+            record["estimated"] = estimated
+        return record
+
 
 # Basic tests
 # TODO: How to generate a date-time value?
@@ -339,5 +1119,23 @@ if __name__ == "__main__":
     print("Generating wide report:")
     ts.print_report_thead("")
     ts.print_report_tbody("")
+    print("Generating wide report from merged halves (same as above):")
+    ts = TableStat(unique_max_count = 5, column_list = cols)
+    ts.analyze_row([None , None, None   , None  ])
+    ts.analyze_row(["   ", 1   , "hi"           ])
+    ts2 = TableStat(unique_max_count = 5, column_list = cols)
+    ts2.analyze_row(["\t" , 2   , "world", "456", "bonus" ])
+    ts2.analyze_row([None , 3.0 , "bar"  , "789" ])
+    ts2.analyze_row([None , 4.0 , "bar"  , "012" ])
+    ts.merge(ts2)
+    ts.print_report_thead("")
+    ts.print_report_tbody("")
+    print("Generating tall report of dates among blank and text cells:")
+    ts = TableStat(unique_max_count = 5, column_list = [ "Dates" ])
+    ts.analyze_row([datetime.datetime(2017, 8, 24)])
+    ts.analyze_row([u""                           ])
+    ts.analyze_row([u"n/a"                        ])
+    ts.analyze_row([datetime.datetime(2017, 8, 25)])
+    ts.print_report()
     # This tests constructor input validation
     # bogus = TableStat("hi")
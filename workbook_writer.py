@@ -0,0 +1,306 @@
+'''
+Streaming writers for large workbooks.
+
+Rows are written one at a time and a sheet that reaches the row or
+column limit of its format goes on in a new sheet, the header row
+repeated at the top. Columns past the limit go to sheets of their own,
+one band of columns each, so no value is lost.
+
+xlsx sheets are spooled to temporary files and zipped from there, so
+memory use stays flat however many rows are written. xls files are
+written with xlwt, which has to hold the whole workbook until it is
+saved; its rows are flushed to their compact binary records as they
+go, which keeps that as small as xlwt allows. Only xlsx output streams,
+so large outputs should be given an .xlsx name.
+'''
+
+# future must be first
+from __future__ import print_function
+import abc
+import datetime
+import math
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+# xlwt, see http://www.python-excel.org
+import xlwt
+
+import xlsx_reader
+
+# Sheet limits of each format
+xls_max_rows = 65536
+xls_max_cols = 256
+xlsx_max_rows = 1048576
+xlsx_max_cols = 16384
+
+# Longest sheet name Excel takes
+max_sheet_name = 31
+
+# Rows written to an xls sheet between flushes to binary records
+xls_flush_rows = 1000
+
+# Characters XML can't hold, and text that looks like their escapes
+unsafe_re = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]|_(?=x[0-9A-Fa-f]{4}_)', re.UNICODE)
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_DOCREL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKGREL = "http://schemas.openxmlformats.org/package/2006/relationships"
+WORKSHEET_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"
+
+def get_part_name(name, part, band, max_cols):
+    '''
+    Names the sheets a sheet is split into: more rows are numbered from
+    2, and more columns are named after their range.
+    '''
+    suffix = ""
+    if part > 0:
+        suffix += " %d" % (part + 1)
+    if band > 0:
+        suffix += " cols %d-%d" % (band * max_cols + 1, (band + 1) * max_cols)
+    return name[:max_sheet_name - len(suffix)] + suffix
+
+def to_unicode(value):
+    '''
+    Converts a value to unicode text, taking byte strings as UTF-8.
+    '''
+    if isinstance(value, unicode):
+        return value
+    return str(value).decode("utf-8")
+
+def escape_text(text):
+    '''
+    Escapes text for a cell: characters XML can't hold become _xHHHH_,
+    as xlsx_reader reads them back, and XML markup is escaped.
+    '''
+    text = unsafe_re.sub(lambda m: u"_x%04X_" % ord(m.group(0)), to_unicode(text))
+    return escape(text).encode("utf-8")
+
+# Inherits only from object
+class WorkbookWriter(object):
+    '''
+    Splits the rows of sheets over as many sheets as the limits of the
+    format need; subclasses write the cells.
+
+    Use as a context manager; the file is complete once closed.
+    '''
+
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, out_name, max_rows, max_cols):
+        self.out_name = out_name
+        self.max_rows = max_rows
+        self.max_cols = max_cols
+        # names taken, to keep them unique
+        self.names = set()
+        self.name = None
+        self.header = None
+        # sheets of the current part, one per band of columns
+        self.bands = []
+        self.part = 0
+        # rows written to the current part, header included
+        self.rowx = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_sheet(self, name, header=None):
+        '''
+        Starts a new sheet, with an optional header row that is repeated
+        on each sheet it is split into.
+        '''
+        self.name = name
+        self.header = list(header) if header is not None else None
+        self.part = 0
+        self.start_part()
+
+    def start_part(self):
+        '''
+        Starts the sheets for the next rows, with the header.
+        '''
+        # the sheets before are done with
+        for sheet in self.bands:
+            self.finish_sheet(sheet)
+        self.bands = []
+        self.rowx = 0
+        if self.header is not None:
+            self.write_row(self.header)
+
+    def get_band(self, band):
+        '''
+        Returns the sheet of a band of columns in the current part,
+        creating the sheets of bands up to it.
+        '''
+        while len(self.bands) <= band:
+            name = get_part_name(self.name, self.part, len(self.bands), self.max_cols)
+            count = 1
+            while name.lower() in self.names:
+                count += 1
+                name = get_part_name(self.name + " (%d)" % count, self.part, len(self.bands), self.max_cols)
+            self.names.add(name.lower())
+            self.bands.append(self.new_sheet(name))
+        return self.bands[band]
+
+    def write_row(self, values):
+        '''
+        Writes the next row of the current sheet.
+        '''
+        if self.name is None:
+            raise Exception("No sheet to write rows to")
+        if self.rowx == self.max_rows:
+            self.part += 1
+            self.start_part()
+        for band in xrange(max(1, int(math.ceil(len(values) / float(self.max_cols))))):
+            self.write_cells(self.get_band(band), self.rowx, values[band * self.max_cols:(band + 1) * self.max_cols])
+        self.rowx += 1
+
+    @abc.abstractmethod
+    def new_sheet(self, name):
+        '''
+        Adds a sheet of the given name to the file and returns it.
+        '''
+
+    @abc.abstractmethod
+    def write_cells(self, sheet, rowx, values):
+        '''
+        Writes values to a row of a sheet, from its first column.
+        '''
+
+    def finish_sheet(self, sheet):
+        '''
+        Ends a sheet no more rows will be written to.
+        '''
+        pass
+
+    @abc.abstractmethod
+    def close(self):
+        '''
+        Completes the file.
+        '''
+
+class XlsWriter(WorkbookWriter):
+    '''
+    Writes an xls file with xlwt, up to 65536 rows and 256 columns a sheet.
+    '''
+
+    def __init__(self, out_name):
+        super(XlsWriter, self).__init__(out_name, xls_max_rows, xls_max_cols)
+        self.book = xlwt.Workbook()
+
+    def new_sheet(self, name):
+        return self.book.add_sheet(name)
+
+    def write_cells(self, sheet, rowx, values):
+        for colx, value in enumerate(values):
+            sheet.write(rowx, colx, value)
+        if rowx % xls_flush_rows == xls_flush_rows - 1:
+            sheet.flush_row_data()
+
+    def close(self):
+        if self.book is not None:
+            self.book.save(self.out_name)
+            self.book = None
+
+class XlsxWriter(WorkbookWriter):
+    '''
+    Writes an xlsx file, up to 1048576 rows and 16384 columns a sheet.
+    Text is written as inline strings, so there is no shared string
+    table to hold; dates are written as ISO 8601 text.
+    '''
+
+    def __init__(self, out_name):
+        super(XlsxWriter, self).__init__(out_name, xlsx_max_rows, xlsx_max_cols)
+        self.temp_dir = tempfile.mkdtemp()
+        # ORDERED list of (sheet name, spool file)
+        self.sheets = []
+        self.column_names = []
+
+    def new_sheet(self, name):
+        spool = open(os.path.join(self.temp_dir, "sheet%d.xml" % (len(self.sheets) + 1)), "wb")
+        spool.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    '<worksheet xmlns="%s"><sheetData>' % NS_MAIN)
+        self.sheets.append((name, spool))
+        return spool
+
+    def write_cells(self, sheet, rowx, values):
+        while len(self.column_names) < len(values):
+            self.column_names.append(xlsx_reader.get_column_name(len(self.column_names)))
+        cells = []
+        for colx, value in enumerate(values):
+            if value is None or value == "":
+                continue
+            ref = "%s%d" % (self.column_names[colx], rowx + 1)
+            if isinstance(value, bool):
+                cells.append('<c r="%s" t="b"><v>%d</v></c>' % (ref, value))
+            elif isinstance(value, (int, long)):
+                cells.append('<c r="%s"><v>%d</v></c>' % (ref, value))
+            elif isinstance(value, float) and not (math.isnan(value) or math.isinf(value)):
+                cells.append('<c r="%s"><v>%s</v></c>' % (ref, repr(float(value))))
+            else:
+                if isinstance(value, (datetime.datetime, datetime.date)):
+                    value = value.isoformat()
+                cells.append('<c r="%s" t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>'
+                             % (ref, escape_text(value)))
+        sheet.write('<row r="%d">%s</row>' % (rowx + 1, "".join(cells)))
+
+    def finish_sheet(self, sheet):
+        sheet.write('</sheetData></worksheet>')
+        sheet.close()
+
+    def close(self):
+        if self.temp_dir is None:
+            return
+        try:
+            with zipfile.ZipFile(self.out_name, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as z:
+                z.writestr("[Content_Types].xml",
+                           '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                           '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                           '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                           '<Default Extension="xml" ContentType="application/xml"/>'
+                           '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+                           + "".join('<Override PartName="/xl/worksheets/sheet%d.xml" ContentType="%s"/>'
+                                     % (i + 1, WORKSHEET_TYPE) for i in xrange(len(self.sheets)))
+                           + '</Types>')
+                z.writestr("_rels/.rels",
+                           '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                           '<Relationships xmlns="%s">'
+                           '<Relationship Id="rId1" Type="%s/officeDocument" Target="xl/workbook.xml"/>'
+                           '</Relationships>' % (NS_PKGREL, NS_DOCREL))
+                z.writestr("xl/workbook.xml",
+                           '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                           '<workbook xmlns="%s" xmlns:r="%s"><sheets>' % (NS_MAIN, NS_DOCREL)
+                           + "".join('<sheet name=%s sheetId="%d" r:id="rId%d"/>'
+                                     % (quoteattr(to_unicode(name)).encode("utf-8"), i + 1, i + 1)
+                                     for i, (name, spool) in enumerate(self.sheets))
+                           + '</sheets></workbook>')
+                z.writestr("xl/_rels/workbook.xml.rels",
+                           '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                           '<Relationships xmlns="%s">' % NS_PKGREL
+                           + "".join('<Relationship Id="rId%d" Type="%s/worksheet" Target="worksheets/sheet%d.xml"/>'
+                                     % (i + 1, NS_DOCREL, i + 1) for i in xrange(len(self.sheets)))
+                           + '</Relationships>')
+                for sheet in self.bands:
+                    self.finish_sheet(sheet)
+                self.bands = []
+                for i, (name, spool) in enumerate(self.sheets):
+                    # copied from disk in blocks
+                    z.write(spool.name, "xl/worksheets/sheet%d.xml" % (i + 1))
+        finally:
+            for name, spool in self.sheets:
+                spool.close()
+            shutil.rmtree(self.temp_dir)
+            self.temp_dir = None
+
+def open_workbook_writer(out_name):
+    '''
+    Returns the writer for a file name: xlsx for .xlsx files, else xls.
+    '''
+    if os.path.splitext(out_name)[1].lower() == ".xlsx":
+        return XlsxWriter(out_name)
+    return XlsWriter(out_name)
@@ -0,0 +1,330 @@
+'''
+Streaming reader for the rows of xlsx sheets.
+
+Parses the sheet XML inside the xlsx zip one row at a time, instead of
+loading the whole sheet into memory like xlrd does. Values come back as
+xlrd would give them: text as unicode, numbers as float, booleans and
+error codes as int, and empty cells as u''. Dates come as float too,
+unless asked for as datetime.datetime.
+'''
+
+# future must be first
+from __future__ import print_function
+import re
+import zipfile
+import xml.etree.cElementTree as ET
+
+# xlrd, see http://www.python-excel.org and https://pypi.python.org/pypi/xlrd
+from xlrd.biffh import error_text_from_code
+from xlrd.book import Book
+from xlrd.formatting import is_date_format_string
+from xlrd.xldate import xldate_as_datetime
+
+# XML namespaces used by the parts we read
+NS_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+NS_DOCREL = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+XML_SPACE_ATTR = "{http://www.w3.org/XML/1998/namespace}space"
+
+# Tags compared for every cell, built once
+ROW_TAG = NS_MAIN + "row"
+CELL_TAG = NS_MAIN + "c"
+VALUE_TAG = NS_MAIN + "v"
+INLINE_TAG = NS_MAIN + "is"
+TEXT_TAG = NS_MAIN + "t"
+RUN_TAG = NS_MAIN + "r"
+SHEET_DATA_TAG = NS_MAIN + "sheetData"
+CELL_XFS_TAG = NS_MAIN + "cellXfs"
+NUM_FMT_TAG = NS_MAIN + "numFmt"
+XF_TAG = NS_MAIN + "xf"
+WORKBOOK_PR_TAG = NS_MAIN + "workbookPr"
+
+# Built-in number formats that show dates, as xlrd has them
+builtin_date_formats = set(range(14, 23) + range(45, 48))
+
+# is_date_format_string only reads the logging settings of its book
+format_book = Book()
+format_book.verbosity = 0
+
+# Marks a cell without a value, which xlrd leaves out
+blank = object()
+
+error_code_from_text = dict((text, code) for code, text in error_text_from_code.items())
+
+# Most dates kept by a date cache, which is emptied when full, so
+# memory stays flat on columns of distinct timestamps
+date_cache_max = 4096
+
+# Escapes like _x000D_ for characters not allowed in XML
+escape_re = re.compile(r'_x[0-9A-Fa-f]{4}_', re.UNICODE)
+
+def unescape(text):
+    '''
+    Replaces _xHHHH_ escapes with the characters they stand for.
+    '''
+    if "_" in text:
+        return escape_re.sub(lambda m: unichr(int(m.group(0)[2:6], 16)), text)
+    return text
+
+def get_text(elem):
+    '''
+    Gets the text of a <t> or <v> element, trimmed unless preserved.
+    '''
+    text = elem.text
+    if text is None:
+        return u""
+    if elem.get(XML_SPACE_ATTR) != "preserve":
+        text = text.strip("\t\n \r")
+    return unicode(unescape(text))
+
+def get_rich_text(elem):
+    '''
+    Gets the text of an <si> or <is> element, joining formatted runs.
+    '''
+    parts = []
+    for child in elem:
+        if child.tag == TEXT_TAG:
+            parts.append(get_text(child))
+        elif child.tag == RUN_TAG:
+            parts.extend(get_text(t) for t in child if t.tag == TEXT_TAG)
+    return u"".join(parts)
+
+def get_date(serial, datemode, cache):
+    '''
+    Converts the serial number of a date cell to a datetime.datetime,
+    looking it up in the cache dict first, as timestamps repeat a lot.
+    The cache holds at most date_cache_max dates.
+    A serial out of range for datetime is kept as a float.
+    '''
+    value = cache.get(serial)
+    if value is None:
+        try:
+            value = xldate_as_datetime(serial, datemode)
+        except (OverflowError, ValueError):
+            value = serial
+        if len(cache) >= date_cache_max:
+            cache.clear()
+        cache[serial] = value
+    return value
+
+def get_date_styles(styles):
+    '''
+    Reads the styles part of a xlsx file and returns the set of cell
+    style indexes, as the strings found in cells, whose number format
+    shows a date.
+    '''
+    date_formats = set(builtin_date_formats)
+    date_styles = set()
+    # index of the next cell style, while within <cellXfs>
+    xfx = None
+    for event, elem in ET.iterparse(styles, events=("start", "end")):
+        if event == "start":
+            if elem.tag == CELL_XFS_TAG:
+                xfx = 0
+            continue
+        if elem.tag == NUM_FMT_TAG:
+            if is_date_format_string(format_book, elem.get("formatCode")):
+                date_formats.add(int(elem.get("numFmtId")))
+        elif elem.tag == XF_TAG and xfx is not None:
+            # only cell styles are indexed by cells
+            if int(elem.get("numFmtId", "0")) in date_formats:
+                date_styles.add(str(xfx))
+            xfx += 1
+        elif elem.tag == CELL_XFS_TAG:
+            xfx = None
+    return date_styles
+
+def is_xlsx(file_name):
+    '''
+    Tells a xlsx file from a xls file by its leading bytes, as xlrd does.
+    xlsx files are zip archives; xls files may contain one, so
+    zipfile.is_zipfile can't tell them apart.
+    '''
+    with open(file_name, "rb") as f:
+        return f.read(4) == b"PK\x03\x04"
+
+def get_column_index(cell_name):
+    '''
+    Translates a cell name like "AB12" to a zero-based column index.
+    '''
+    colx = 0
+    for c in cell_name:
+        if c.isdigit():
+            break
+        if c != "$":
+            colx = colx * 26 + ord(c) - ord("A") + 1
+    return colx - 1
+
+def get_column_name(colx):
+    '''
+    Translates a zero-based column index to its letters, like "AB".
+    '''
+    name = ""
+    colx += 1
+    while colx > 0:
+        colx, rem = divmod(colx - 1, 26)
+        name = chr(ord("A") + rem) + name
+    return name
+
+# Inherits only from object
+class XlsxReader(object):
+    '''
+    Opens an xlsx file and streams the rows of its sheets.
+    Only the shared string table is held in memory; sheet rows are
+    parsed and released one at a time, so memory use does not grow
+    with the number of rows.
+
+    Set dates to get the values of cells formatted as dates as
+    datetime.datetime, like xlsTransform.py does with xlrd's cell types.
+
+    Use as a context manager, like xlrd's open_workbook.
+    '''
+
+    def __init__(self, file_name, dates=False):
+        self.zip_file = zipfile.ZipFile(file_name)
+        # Map relationship ids to part names
+        targets = {}
+        shared_strings_name = "xl/sharedStrings.xml"
+        styles_name = "xl/styles.xml"
+        for rel in ET.fromstring(self.zip_file.read("xl/_rels/workbook.xml.rels")):
+            target = rel.get("Target")
+            # targets are relative to xl/ unless absolute
+            target = target[1:] if target.startswith("/") else "xl/" + target
+            targets[rel.get("Id")] = target
+            if rel.get("Type").endswith("/sharedStrings"):
+                shared_strings_name = target
+            elif rel.get("Type").endswith("/styles"):
+                styles_name = target
+        # ORDERED list of (sheet name, part name)
+        self.sheets = []
+        workbook = ET.fromstring(self.zip_file.read("xl/workbook.xml"))
+        for sheet in workbook.iter(NS_MAIN + "sheet"):
+            self.sheets.append((sheet.get("name"), targets[sheet.get(NS_DOCREL + "id")]))
+        # Styles of date cells, none unless dates are wanted
+        self.date_styles = set()
+        self.date_cache = {}
+        self.datemode = 0
+        if dates:
+            for pr in workbook.iter(WORKBOOK_PR_TAG):
+                self.datemode = 1 if pr.get("date1904") in ("1", "true", "on") else 0
+            if styles_name in self.zip_file.namelist():
+                with self.zip_file.open(styles_name) as part:
+                    self.date_styles = get_date_styles(part)
+        # Shared strings are needed for any row, so read them once
+        self.shared_strings = []
+        if shared_strings_name in self.zip_file.namelist():
+            with self.zip_file.open(shared_strings_name) as part:
+                for event, elem in ET.iterparse(part):
+                    if elem.tag == NS_MAIN + "si":
+                        self.shared_strings.append(get_rich_text(elem))
+                        elem.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.zip_file.close()
+
+    def sheet_names(self):
+        return [ name for name, part in self.sheets ]
+
+    def iter_rows(self, sheet_index):
+        '''
+        Generates the rows of a sheet as lists of values, in order.
+        Rows are padded with u'' to the widest row seen so far, and
+        missing rows come back as empty rows, as xlrd would show them.
+        Trailing rows without any value are not generated.
+        '''
+        width = 0
+        # row number of the current <row>, and of the next row to generate
+        current = -1
+        rowx = 0
+        sheet_data = None
+        with self.zip_file.open(self.sheets[sheet_index][1]) as part:
+            for event, elem in ET.iterparse(part, events=("start", "end")):
+                if event == "start":
+                    if elem.tag == SHEET_DATA_TAG:
+                        sheet_data = elem
+                    continue
+                if elem.tag != ROW_TAG:
+                    continue
+                # the row number is optional
+                row_number = elem.get("r")
+                current = int(row_number) - 1 if row_number is not None else current + 1
+                row = self.get_row_values(elem)
+                # release the parsed row
+                sheet_data.clear()
+                if not row:
+                    # rows of blank cells don't count, like in xlrd
+                    continue
+                if len(row) > width:
+                    width = len(row)
+                # emit empty rows for any gap
+                while rowx < current:
+                    yield [ u"" ] * width
+                    rowx += 1
+                row.extend([ u"" ] * (width - len(row)))
+                yield row
+                rowx += 1
+
+    def get_row_values(self, row_elem):
+        '''
+        Converts the cells of a <row> element to a list of values,
+        up to the last cell that has a value.
+        '''
+        row = []
+        colx = -1
+        for cell in row_elem:
+            if cell.tag != CELL_TAG:
+                continue
+            cell_name = cell.get("r")
+            colx = get_column_index(cell_name) if cell_name is not None else colx + 1
+            cell_type = cell.get("t", "n")
+            value = blank
+            if cell_type == "inlineStr":
+                for child in cell:
+                    if child.tag == INLINE_TAG:
+                        value = get_rich_text(child)
+                    elif child.tag == VALUE_TAG:
+                        value = child.text
+                if not value:
+                    value = blank
+            else:
+                text = None
+                child = cell.find(VALUE_TAG)
+                if child is not None:
+                    text = child.text
+                if cell_type == "n":
+                    # n = number, most frequent type; blank without text
+                    if text:
+                        value = float(text)
+                        # the style tells a date, style 0 by default
+                        if self.date_styles and cell.get("s", "0") in self.date_styles:
+                            value = get_date(value, self.datemode, self.date_cache)
+                elif cell_type == "s":
+                    # s = index into shared string table
+                    if text: value = self.shared_strings[int(text)]
+                elif cell_type == "str":
+                    # str = string result from formula; xlrd keeps None
+                    # when the result is missing
+                    value = get_text(child) if child is not None else None
+                elif cell_type == "b":
+                    # b = boolean, kept as int like xlrd
+                    value = 1 if text in ("1", "true", "on") else 0
+                elif cell_type == "e":
+                    # e = error, kept as xlrd's error code
+                    value = error_code_from_text[text if text else "#N/A"]
+                else:
+                    raise Exception("Unknown cell type %r in cell %r" % (cell_type, cell_name))
+            if value is blank:
+                continue
+            # pad skipped cells
+            if colx > len(row):
+                row.extend([ u"" ] * (colx - len(row)))
+            if colx == len(row):
+                row.append(value)
+            else:
+                row[colx] = value
+        return row